@@ -0,0 +1,276 @@
+# library_bench.py
+# Benchmarks for the Library engine on synthetic data.
+#
+#   python library_bench.py --sizes 1k,100k --out bench.json
+#   python library_bench.py --sizes 1k,100k --baseline bench.json   # exit 1 on regression
+#   python library_bench.py --sizes 1k --clients 1,4,16             # + library_server checkout load test
+#
+# For every size, a synthetic store with that many books, users and
+# transactions is written to a temporary directory. Each operation is then
+# driven headlessly and reported as JSON: latency percentiles (ms),
+# throughput (ops/s) and peak traced memory (KiB).
+#
+# With --clients, a library_server is started on a synthetic store and N
+# client threads (one RemoteLibrary connection each) issue and return books
+# as fast as they can; the report gets checkouts/s and latency per N.
+
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from library_core import (JournalStorage, Library, LibraryError, OpenLoans, SnapshotStorage, Unavailable,
+                          new_user_meta)
+from library_server import RemoteLibrary
+
+CIRCULATE_BATCH = 50  # items per circulate() call
+
+WORDS = ("river", "night", "garden", "empire", "silent", "code", "atlas", "winter", "shadow",
+         "ocean", "stone", "paper", "iron", "glass", "story", "tiger", "moon", "city", "fire", "road")
+
+def parse_size(text):
+    text = text.strip().lower()
+    mult = {"k": 1000, "m": 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * mult)
+
+def make_synthetic_store(n, seed=1):
+    """n books, n users and n transactions (a quarter of them still open)."""
+    rnd = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    books = {}
+    for i in range(n):
+        title = f"{rnd.choice(WORDS).title()} {rnd.choice(WORDS)} {i}"
+        books[title] = {"author": f"Author {rnd.randrange(max(1, n // 20))}", "qty": rnd.randint(1, 5)}
+    titles = list(books)
+    users = {f"user{i}": new_user_meta((start + timedelta(minutes=i)).isoformat()) for i in range(n)}
+    names = list(users)
+    issued = []
+    for i in range(n):
+        user, title = rnd.choice(names), rnd.choice(titles)
+        issued_on = start + timedelta(minutes=rnd.randrange(600000))
+        tx = {"id": i + 1, "user": user, "book": title, "issued_on": issued_on.isoformat(),
+              "due_date": (issued_on + timedelta(days=14)).isoformat(), "returned": rnd.random() > 0.25}
+        if tx["returned"]:
+            tx["returned_on"] = (issued_on + timedelta(days=rnd.randint(1, 20))).isoformat()
+        else:
+            books[title]["qty"] += 1  # keep an available copy for every open loan
+        users[user]["loans"] += 1
+        issued.append(tx)
+    return {"books": books, "users": users, "issued": issued, "next_tx_id": n + 1}
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    k = min(len(sorted_vals) - 1, max(0, round(p / 100 * (len(sorted_vals) - 1))))
+    return sorted_vals[k]
+
+def measure(fn, args_list, memory=True):
+    """Call fn(*args) for each args tuple; returns the stats dict."""
+    times = []
+    t0 = time.perf_counter()
+    for args in args_list:
+        t = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - t)
+    total = time.perf_counter() - t0
+    times.sort()
+    stats = {
+        "n": len(times),
+        "p50_ms": round(percentile(times, 50) * 1000, 4),
+        "p95_ms": round(percentile(times, 95) * 1000, 4),
+        "p99_ms": round(percentile(times, 99) * 1000, 4),
+        "max_ms": round(times[-1] * 1000, 4) if times else 0.0,
+        "ops_per_s": round(len(times) / total, 1) if total else 0.0,
+    }
+    if memory and args_list:
+        # one extra traced call; tracing is too slow to leave on for the timed loop
+        tracemalloc.start()
+        fn(*args_list[0])
+        stats["peak_kib"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        tracemalloc.stop()
+    return stats
+
+def bench_size(n, iterations, workdir, seed=1):
+    rnd = random.Random(seed)
+    data_file = os.path.join(workdir, f"bench_{n}.json")
+    store = make_synthetic_store(n, seed)
+    JournalStorage(data_file).compact(store)
+    del store
+    results = {}
+    reps = [()] * 3
+
+    results["load_store"] = measure(lambda: JournalStorage(data_file).load(OpenLoans()), reps)
+    snap_file = os.path.join(workdir, f"bench_{n}.snap")
+    SnapshotStorage(snap_file).compact(make_synthetic_store(n, seed))
+    # startup (header, meta, open loans) and everything faulted in
+    results["load_snapshot"] = measure(lambda: SnapshotStorage(snap_file).load(OpenLoans()), reps)
+    results["load_snapshot_all"] = measure(lambda: SnapshotStorage(snap_file).load(OpenLoans()).load_all(), reps)
+    lib = Library(data_file, archive_after=None)  # archived separately below
+    lib.load()
+    results["save_store"] = measure(lambda: lib.storage.compact(lib.store), reps)
+
+    titles = list(lib.store["books"])
+    names = list(lib.store["users"])
+    k = min(iterations, n)
+
+    results["add_book"] = measure(lib.add_book, [(f"Bench title {i}", "Bench", 2) for i in range(k)], memory=False)
+    lib.search("warm")  # builds the index
+    queries = [(rnd.choice(WORDS)[:rnd.randint(2, 5)],) for _ in range(k)] + [(t,) for t in rnd.sample(titles, k)]
+    results["search_book"] = measure(lib.search, queries)
+    results["list_all_books"] = measure(lib.books, [()] * 5)
+
+    pairs = [(rnd.choice(names), t) for t in rnd.sample(titles, k)]
+    results["issue_book"] = measure(lambda u, b: lib.issue(u, b, 14), pairs, memory=False)
+    results["return_book"] = measure(lib.return_book, pairs, memory=False)
+    # scanner bursts: the same kind of traffic, CIRCULATE_BATCH items per all-or-nothing commit
+    pairs = [(rnd.choice(names), t) for t in rnd.sample(titles, k)]
+    batches = [pairs[i:i + CIRCULATE_BATCH] for i in range(0, k, CIRCULATE_BATCH)]
+    results["circulate_issue"] = measure(lambda ops: lib.circulate([("issue", u, b) for u, b in ops]),
+                                         [(ops,) for ops in batches], memory=False)
+    results["circulate_return"] = measure(lambda ops: lib.circulate([("return", u, b) for u, b in ops]),
+                                          [(ops,) for ops in batches], memory=False)
+
+    results["archive_returned"] = measure(lib.archive_returned, [(0,)], memory=False)
+    results["user_history"] = measure(lambda u: sum(1 for _ in lib.history(u)), [(u,) for u in rnd.sample(names, min(k, 20))])
+
+    idle = [(u,) for u in names if u not in lib.loans.by_user][:k]
+    results["delete_user"] = measure(lib.delete_user, idle, memory=False)
+    lib.close()
+    return results
+
+def bench_server(n, client_counts, ops, workdir, seed=1):
+    """Checkouts/s through library_server for each number of concurrent clients."""
+    data_file = os.path.join(workdir, f"server_{n}.json")
+    store = make_synthetic_store(n, seed)
+    titles, names = list(store["books"]), list(store["users"])
+    JournalStorage(data_file).compact(store)
+    del store
+    server = os.path.join(os.path.dirname(os.path.abspath(__file__)), "library_server.py")
+    proc = subprocess.Popen([sys.executable, server, "--data", data_file, "--port", "0"],
+                            stdout=subprocess.PIPE, text=True)
+    try:
+        url = proc.stdout.readline().rsplit(" on ", 1)[-1].strip()
+        if not url.startswith("http"):
+            raise LibraryError("library_server did not start.")
+        results = {}
+        for clients in client_counts:
+            remote = RemoteLibrary(url)
+            times, refused, failed = [], [0], [0]
+            lock = threading.Lock()
+            def desk(i):
+                rnd = random.Random(seed * 1000 + i)
+                user, mine = names[i % len(names)], []
+                for _ in range(ops):
+                    title = rnd.choice(titles)
+                    t = time.perf_counter()
+                    try:
+                        remote.issue(user, title)
+                        took = time.perf_counter() - t
+                        remote.return_book(user, title)
+                    except Unavailable:
+                        with lock:
+                            refused[0] += 1
+                        continue
+                    except LibraryError:
+                        with lock:
+                            failed[0] += 1
+                        continue
+                    mine.append(took)
+                remote.close()
+                with lock:
+                    times.extend(mine)
+            threads = [threading.Thread(target=desk, args=(i,)) for i in range(clients)]
+            t0 = time.perf_counter()
+            for th in threads:
+                th.start()
+            for th in threads:
+                th.join()
+            total = time.perf_counter() - t0
+            times.sort()
+            results[str(clients)] = {
+                "checkouts": len(times), "refused": refused[0], "failed": failed[0],
+                "checkouts_per_s": round(len(times) / total, 1) if total else 0.0,
+                "p50_ms": round(percentile(times, 50) * 1000, 4),
+                "p95_ms": round(percentile(times, 95) * 1000, 4),
+                "p99_ms": round(percentile(times, 99) * 1000, 4),
+            }
+        return results
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=60)
+
+def compare(current, baseline, tolerance):
+    """List (size, op, metric, old, new) where p50/p95 got slower than tolerance allows."""
+    regressions = []
+    for size, ops in current.items():
+        for op, stats in ops.items():
+            old = baseline.get(size, {}).get(op)
+            if not old:
+                continue
+            for metric in ("p50_ms", "p95_ms"):
+                if old.get(metric) and stats[metric] > old[metric] * tolerance:
+                    regressions.append((size, op, metric, old[metric], stats[metric]))
+    return regressions
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark Library engine operations on synthetic data")
+    p.add_argument("--sizes", default="1k,100k", help="comma-separated, e.g. 1k,100k,1m (default: %(default)s)")
+    p.add_argument("--iterations", type=int, default=200, help="operations timed per action (default: %(default)s)")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", help="write results JSON here (default: stdout)")
+    p.add_argument("--baseline", help="results JSON to compare against")
+    p.add_argument("--tolerance", type=float, default=1.25, help="allowed slowdown factor (default: %(default)s)")
+    p.add_argument("--clients", help="also load-test library_server with these client counts, e.g. 1,4,16")
+    p.add_argument("--server-size", default="10k", help="store size for the server test (default: %(default)s)")
+    p.add_argument("--server-ops", type=int, default=200, help="checkouts per client (default: %(default)s)")
+    args = p.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="library_bench_")
+    try:
+        sizes = {}
+        for text in args.sizes.split(","):
+            n = parse_size(text)
+            print(f"benchmarking {n} books/users/transactions ...", file=sys.stderr)
+            sizes[str(n)] = bench_size(n, args.iterations, workdir, args.seed)
+        if args.clients:
+            n = parse_size(args.server_size)
+            print(f"load-testing library_server on {n} books with {args.clients} clients ...", file=sys.stderr)
+            server = bench_server(n, [int(c) for c in args.clients.split(",")], args.server_ops, workdir, args.seed)
+    except LibraryError as e:
+        print(f"{e.title}: {e}", file=sys.stderr)
+        return 1
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"python": sys.version.split()[0], "created": datetime.now().isoformat(timespec="seconds"),
+              "iterations": args.iterations, "results": sizes}
+    if args.clients:
+        report["server_checkout"] = server
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(sizes, baseline, args.tolerance)
+        for size, op, metric, old, new in regressions:
+            print(f"REGRESSION {op} @ {size}: {metric} {old} -> {new} ms", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
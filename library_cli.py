@@ -0,0 +1,198 @@
+# library_cli.py
+# Command-line client for the headless Library engine (no Tk import).
+#
+#   python library_cli.py issue "Areeb" "EK THA TIGER" --days 7
+#   python library_cli.py batch ops.jsonl      # one {"action": ..., ...} per line
+#   python library_cli.py circulate scans.jsonl  # {"action": "issue"|"return", "user", "book"} lines, all or nothing
+#   python library_cli.py migrate library_data.json library.db
+#   python library_cli.py migrate library_data.json library_data.snap   # binary snapshot, lazy startup
+#   python library_cli.py import books acquisitions.csv
+#   python library_cli.py export loans - --format jsonl
+#   python library_cli.py --data library.db books   # .db/.sqlite files use the SQLite backend, .snap the binary snapshot
+#   python library_cli.py history --user "Areeb"     # includes archived loans
+#   python library_cli.py --metrics timings.json --profile search search tiger
+#
+# Every command prints its results as JSON lines.
+
+import argparse
+import json
+import sys
+from contextlib import nullcontext
+from dataclasses import asdict, is_dataclass
+
+from library_core import (ARCHIVE_AFTER_DAYS, DATA_FILE, DEFAULT_LOAN_DAYS, SEARCH_LIMIT, Library,
+                          LibraryError, convert_data_file, file_format, read_rows)
+from library_metrics import METRICS
+
+# batch action -> Library method; the remaining keys of a line are its keyword arguments
+ACTIONS = {
+    "add_book": "add_book", "remove_book": "remove_book", "update_book": "update_book",
+    "search": "search", "register": "register_user", "delete_user": "delete_user",
+    "rename_user": "rename_user", "issue": "issue", "return": "return_book",
+    "reserve": "reserve", "cancel_reservation": "cancel_reservation",
+}
+
+def to_json(result):
+    if is_dataclass(result):
+        result = asdict(result)
+    return json.dumps(result, ensure_ascii=False)
+
+def emit(results):
+    for r in results:
+        print(to_json(r))
+
+def open_arg(path, mode):
+    # '-' means stdin/stdout, which must not be closed afterwards
+    if path == "-":
+        return nullcontext(sys.stdin if mode == "r" else sys.stdout)
+    return open(path, mode, encoding="utf-8", newline="")
+
+def run_batch(lib, stream):
+    failed = 0
+    for n, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            op = json.loads(line)
+            method = getattr(lib, ACTIONS[op.pop("action")])
+            out = {"line": n, "ok": True, "result": method(**op)}
+        except (ValueError, KeyError, TypeError) as e:
+            out = {"line": n, "ok": False, "error": f"Bad operation: {e}"}
+        except LibraryError as e:
+            out = {"line": n, "ok": False, "error": str(e)}
+        failed += not out["ok"]
+        if is_dataclass(out.get("result")):
+            out["result"] = asdict(out["result"])
+        print(json.dumps(out, ensure_ascii=False))
+    return 1 if failed else 0
+
+def run_circulate(lib, stream, days):
+    ops = []
+    for n, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            op = json.loads(line)
+            ops.append((op["action"], op["user"], op["book"]))
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Validation: line {n}: Bad operation: {e}", file=sys.stderr)
+            return 1
+    report = lib.circulate(ops, days)
+    emit(report.items)
+    return 0 if report.applied else 1
+
+def build_parser():
+    p = argparse.ArgumentParser(description="Library engine command line")
+    p.add_argument("--data", default=DATA_FILE, help="data file (default: %(default)s)")
+    p.add_argument("--metrics", help="write operation timings to this JSON file on exit")
+    p.add_argument("--profile", metavar="OP", help="cProfile the first call of OP ('*' for any) into profiles/")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("add-book"); c.add_argument("title"); c.add_argument("--author", default=""); c.add_argument("--qty", type=int, default=1)
+    c = sub.add_parser("remove-book"); c.add_argument("title")
+    c = sub.add_parser("update-book"); c.add_argument("title"); c.add_argument("--author", default=""); c.add_argument("--qty", type=int)
+    c = sub.add_parser("search"); c.add_argument("q"); c.add_argument("--limit", type=int, default=SEARCH_LIMIT)
+    sub.add_parser("books")
+    c = sub.add_parser("register"); c.add_argument("name")
+    c = sub.add_parser("delete-user"); c.add_argument("name")
+    c = sub.add_parser("rename-user"); c.add_argument("old"); c.add_argument("new")
+    sub.add_parser("users")
+    c = sub.add_parser("issue"); c.add_argument("user"); c.add_argument("book"); c.add_argument("--days", type=int, default=DEFAULT_LOAN_DAYS)
+    c = sub.add_parser("return"); c.add_argument("user"); c.add_argument("book")
+    c = sub.add_parser("reserve"); c.add_argument("user"); c.add_argument("book")
+    c = sub.add_parser("cancel-reservation"); c.add_argument("user"); c.add_argument("book")
+    c = sub.add_parser("reservations", help="a user's holds, or a book's queue in order")
+    c.add_argument("--user"); c.add_argument("--book")
+    sub.add_parser("expire-holds", help="pass unclaimed held copies on to the next in line")
+    sub.add_parser("issued")
+    sub.add_parser("overdue", help="overdue loans, most overdue first, with fines so far")
+    c = sub.add_parser("history", help="all loans of a user and/or book, archived ones first")
+    c.add_argument("--user"); c.add_argument("--book")
+    c = sub.add_parser("archive", help="move old returned loans to the history archive")
+    c.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="returned more than this many days ago (default: %(default)s)")
+    c = sub.add_parser("batch", help="run JSON-lines operations from a file ('-' for stdin)"); c.add_argument("file")
+    c = sub.add_parser("circulate", help="issue/return JSON-lines items from a file ('-' for stdin) in one all-or-nothing commit")
+    c.add_argument("file"); c.add_argument("--days", type=int, default=DEFAULT_LOAN_DAYS)
+    c = sub.add_parser("migrate", help="copy a data file into another format (.json, .snap or .db)"); c.add_argument("src"); c.add_argument("dest")
+    c = sub.add_parser("import", help="bulk import a .csv/.jsonl file ('-' for stdin)")
+    c.add_argument("kind", choices=("books", "users")); c.add_argument("file"); c.add_argument("--format", choices=("csv", "jsonl"))
+    c = sub.add_parser("export", help="stream data to a .csv/.jsonl file ('-' for stdout)")
+    c.add_argument("kind", choices=("books", "users", "loans")); c.add_argument("file"); c.add_argument("--format", choices=("csv", "jsonl"))
+    return p
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        METRICS.profile_next(args.profile)
+    try:
+        return run(args)
+    finally:
+        if args.metrics:
+            METRICS.export(args.metrics)
+
+def run_command(lib, args):
+    if args.cmd == "batch":
+        if args.file == "-":
+            return run_batch(lib, sys.stdin)
+        with open(args.file, encoding="utf-8") as f:
+            return run_batch(lib, f)
+    if args.cmd == "circulate":
+        with open_arg(args.file, "r") as f:
+            return run_circulate(lib, f, args.days)
+    if args.cmd in ("import", "export"):
+        fmt = args.format or ("jsonl" if args.file == "-" else file_format(args.file))
+        with open_arg(args.file, "r" if args.cmd == "import" else "w") as f:
+            if args.cmd == "export":
+                lib.export(args.kind, f, fmt)
+                return 0
+            importer = lib.import_books if args.kind == "books" else lib.import_users
+            report = importer(read_rows(f, fmt))
+        emit([report])
+        return 1 if report.failed else 0
+    calls = {
+        "add-book": lambda: [lib.add_book(args.title, args.author, args.qty)],
+        "remove-book": lambda: [lib.remove_book(args.title)],
+        "update-book": lambda: [lib.update_book(args.title, args.author, args.qty)],
+        "search": lambda: lib.search(args.q, limit=args.limit).books,
+        "books": lib.books,
+        "register": lambda: [lib.register_user(args.name)],
+        "delete-user": lambda: [lib.delete_user(args.name)],
+        "rename-user": lambda: [lib.rename_user(args.old, args.new)],
+        "users": lib.users,
+        "issue": lambda: [lib.issue(args.user, args.book, args.days)],
+        "return": lambda: [lib.return_book(args.user, args.book)],
+        "reserve": lambda: [lib.reserve(args.user, args.book)],
+        "cancel-reservation": lambda: [lib.cancel_reservation(args.user, args.book)],
+        "reservations": lambda: lib.reservations(args.user, args.book),
+        "expire-holds": lambda: [{"released": lib.expire_holds()}],
+        "issued": lib.active_loans,
+        "overdue": lib.overdue,
+        "history": lambda: lib.history(args.user, args.book),
+        "archive": lambda: [{"archived": lib.archive_returned(args.days)}],
+    }
+    emit(calls[args.cmd]())
+    return 0
+
+def run(args):
+    if args.cmd == "migrate":
+        try:
+            books, users, loans, archived = convert_data_file(args.src, args.dest)
+        except LibraryError as e:
+            print(f"{e.title}: {e}", file=sys.stderr)
+            return 1
+        emit([{"books": books, "users": users, "loans": loans, "archived": archived}])
+        return 0
+    lib = Library(args.data)
+    try:
+        try:
+            return run_command(lib, args)
+        finally:
+            lib.close()  # waits for pending writes and folds the journal
+    except LibraryError as e:
+        print(f"{e.title}: {e}", file=sys.stderr)
+        return 1
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2640 @@
+# library_core.py
+# Headless catalog / user / circulation engine for the Library app.
+# No Tk here: library_management_system.py (the UI) and library_cli.py are
+# both thin clients of Library. Importing this module does no I/O; the data
+# file is read on first use.
+
+import csv
+import gzip
+import heapq
+import io
+import json
+import mmap
+import os
+import queue
+import re
+import sqlite3
+import struct
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import MutableMapping
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+from itertools import islice
+
+from library_metrics import instrument
+
+DATA_FILE = "library_data.json"
+COMPACT_EVERY = 500  # journal records before compaction
+SEARCH_LIMIT = 200   # default cap on search results
+DEFAULT_LOAN_DAYS = 14
+FINE_PER_DAY = 5.0        # charged per full day a loan is overdue
+IMPORT_BATCH = 5000       # rows per persistence commit during bulk import
+MAX_IMPORT_ERRORS = 100   # row errors kept in an ImportReport
+REINDEX_BATCH = 1000      # commits larger than this drop the search index for a lazy rebuild
+COALESCE_DELAY = 0.05     # seconds the background writer waits to gather a burst
+RETRY_DELAY = 1.0         # seconds before the background writer retries a failed write
+CLOSE_TIMEOUT = 10.0      # seconds close() waits for pending background writes
+ARCHIVE_AFTER_DAYS = 90   # returned loans older than this move to the history archive on load
+HOLD_DAYS = 3             # days a copy set aside for a reservation waits before going to the next in line
+
+# ---------- Errors ----------
+class LibraryError(Exception):
+    """Base class for engine errors; the message is meant for the user."""
+    title = "Error"
+
+class ValidationError(LibraryError):
+    title = "Validation"
+
+class NotFound(LibraryError):
+    pass
+
+class Conflict(LibraryError):
+    pass
+
+class Unavailable(Conflict):
+    title = "Unavailable"
+
+class StorageError(LibraryError):
+    title = "Save error"
+
+# ---------- Results ----------
+@dataclass(frozen=True)
+class Book:
+    title: str
+    author: str
+    qty: int
+    reserved: tuple = ()
+
+@dataclass(frozen=True)
+class User:
+    name: str
+    registered_on: str = None
+    loans: int = 0
+    active: int = 0
+
+@dataclass(frozen=True)
+class Hold:
+    id: int
+    user: str
+    book: str
+    placed_on: str = None
+    expires: str = None  # set once a copy is set aside for this hold
+    position: int = 0    # 1-based place in the book's queue
+
+@dataclass(frozen=True)
+class Loan:
+    id: int
+    user: str
+    book: str
+    issued_on: str
+    due_date: str
+    returned: bool = False
+    returned_on: str = None
+    fine: float = 0.0  # accrued so far if open and overdue, final if returned
+    held_for: Hold = None  # on a return: the reservation the copy was set aside for
+
+@dataclass(frozen=True)
+class SearchResult:
+    books: list
+    total: int
+
+@dataclass(frozen=True)
+class Page:
+    rows: list
+    total: int
+    offset: int
+
+@dataclass
+class ImportReport:
+    added: int = 0
+    merged: int = 0
+    skipped: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)  # (row number, message), first MAX_IMPORT_ERRORS only
+
+    def error(self, row, msg):
+        self.failed += 1
+        if len(self.errors) < MAX_IMPORT_ERRORS:
+            self.errors.append((row, msg))
+
+@dataclass(frozen=True)
+class BatchItem:
+    action: str  # "issue" or "return"
+    user: str
+    book: str
+    ok: bool = True
+    loan: Loan = None  # the issued or returned loan, once the batch is applied
+    error: str = None
+
+@dataclass(frozen=True)
+class BatchReport:
+    applied: bool  # False: some item failed and nothing was committed
+    items: list
+
+def _text(value, what):
+    # arguments also arrive as JSON (batch files, the circulation server), so check before strip()
+    if not isinstance(value, str):
+        raise ValidationError(f"{what} must be text.")
+    return value.strip()
+
+def _book(title, d, queue=()):
+    return Book(title, d.get("author", ""), d.get("qty", 0), tuple(h["user"] for h in queue))
+
+def _hold(h, position=0):
+    return Hold(h["id"], h["user"], h["book"], h.get("placed_on"), h.get("expires"), position)
+
+def fine_for(due_date, on):
+    """FINE_PER_DAY for every full day between the due date and `on` (ISO strings)."""
+    days = (datetime.fromisoformat(on) - datetime.fromisoformat(due_date)).days
+    return max(0, days) * FINE_PER_DAY
+
+def _loan(tx, now=None, held_for=None):
+    returned_on = tx.get("returned_on")
+    end = returned_on if tx.get("returned", False) else now
+    fine = fine_for(tx["due_date"], end) if end else 0.0
+    return Loan(tx["id"], tx["user"], tx["book"], tx["issued_on"], tx["due_date"],
+                tx.get("returned", False), returned_on, fine, held_for)
+
+def _held_by(tx, user, spans):
+    # open loans follow renames; a returned one keeps the name it came back under
+    if not tx.get("returned", False):
+        return tx["user"] == user
+    at = tx.get("returned_on") or tx["issued_on"]
+    return any(tx["user"] == n and lo < at and (hi is None or at < hi) for n, lo, hi in spans)
+
+# ---------- Store layout + journal records ----------
+# store: { books: {title: {author, qty}},
+#          users: {name: {registered_on, loans}}, issued: [txs], next_tx_id,
+#          holds: {str(hold id): {id, user, book, placed_on, expires?}}, next_hold_id,
+#          renames: [[old, new, at]] }
+# issued holds active and recently returned loans; older ones live in the HistoryArchive.
+# qty counts copies on the shelf: copies set aside for a hold are not in it.
+def make_empty_store():
+    return {"books": {}, "users": {}, "issued": [], "next_tx_id": 1, "holds": {}}
+
+def new_user_meta(registered_on=None):
+    return {"registered_on": registered_on, "loans": 0}
+
+class OpenLoans:
+    """Active (not returned) transactions indexed by id, user, book and due date,
+    plus the reservation queues (holds)."""
+    def __init__(self):
+        self.by_id = {}    # tx id -> tx
+        self.by_user = {}  # user -> {tx id: tx}
+        self.by_book = {}  # title -> {tx id: tx}
+        self.by_due = []   # sorted (due_date iso, tx id); ISO strings sort chronologically
+        self.holds = Holds()
+
+    def rebuild(self, s):
+        self.holds.rebuild(s)
+        self.by_id.clear(); self.by_user.clear(); self.by_book.clear()
+        for tx in s.get("issued", []):
+            if not tx.get("returned", False):
+                self._link(tx)
+        self.by_due = sorted((tx["due_date"], i) for i, tx in self.by_id.items())
+
+    def _link(self, tx):
+        self.by_id[tx["id"]] = tx
+        self.by_user.setdefault(tx["user"], {})[tx["id"]] = tx
+        self.by_book.setdefault(tx["book"], {})[tx["id"]] = tx
+
+    def add(self, tx):
+        self._link(tx)
+        insort(self.by_due, (tx["due_date"], tx["id"]))
+
+    def discard(self, tx):
+        if self.by_id.pop(tx["id"], None) is not None:
+            entry = (tx["due_date"], tx["id"])
+            i = bisect_left(self.by_due, entry)
+            if i < len(self.by_due) and self.by_due[i] == entry:
+                del self.by_due[i]
+        for idx, key in ((self.by_user, tx["user"]), (self.by_book, tx["book"])):
+            loans = idx.get(key)
+            if loans is not None:
+                loans.pop(tx["id"], None)
+                if not loans:
+                    del idx[key]
+
+    def rename_user(self, old, new):
+        loans = self.by_user.pop(old, None)
+        if loans:
+            for tx in loans.values():
+                tx["user"] = new
+            self.by_user.setdefault(new, {}).update(loans)
+
+    def for_user(self, user):
+        return list(self.by_user.get(user, {}).values())
+
+    def for_book(self, title):
+        return list(self.by_book.get(title, {}).values())
+
+    def due_between(self, after, until):
+        """(due, id) entries with after < due <= until; after=None means from the start."""
+        lo = 0 if after is None else bisect_right(self.by_due, (after, sys.maxsize))
+        hi = bisect_right(self.by_due, (until, sys.maxsize))
+        return self.by_due[lo:max(lo, hi)]
+
+    def overdue_count(self, now):
+        return bisect_right(self.by_due, (now, sys.maxsize))
+
+class Holds:
+    """Reservation queues, FIFO per book, with a per-user index.
+
+    Both indexes are keyed by hold id, so adding, cancelling and renaming
+    never scan a queue; dicts keep insertion order, which is queue order.
+    Copies are only ever set aside for the oldest waiting holds, so the
+    holds with a copy (allocated) are always at the front of their queue.
+    """
+    def __init__(self):
+        self.by_book = {}    # title -> {hold id: hold}, oldest first
+        self.by_user = {}    # user -> {hold id: hold}
+        self.allocated = {}  # hold id -> hold with a copy set aside
+        self.by_expiry = []  # sorted (expires iso, hold id) of the allocated holds
+
+    def rebuild(self, s):
+        self.by_book.clear(); self.by_user.clear(); self.allocated.clear()
+        for hold in sorted(s.get("holds", {}).values(), key=lambda h: h["id"]):
+            self._link(hold)
+        self.by_expiry = sorted((h["expires"], i) for i, h in self.allocated.items())
+
+    def _link(self, hold):
+        self.by_book.setdefault(hold["book"], {})[hold["id"]] = hold
+        self.by_user.setdefault(hold["user"], {})[hold["id"]] = hold
+        if hold.get("expires"):
+            self.allocated[hold["id"]] = hold
+
+    def add(self, hold):
+        self._link(hold)
+        if hold.get("expires"):
+            insort(self.by_expiry, (hold["expires"], hold["id"]))
+
+    def _unallocate(self, hold):
+        if self.allocated.pop(hold["id"], None) is not None:
+            entry = (hold["expires"], hold["id"])
+            i = bisect_left(self.by_expiry, entry)
+            if i < len(self.by_expiry) and self.by_expiry[i] == entry:
+                del self.by_expiry[i]
+
+    def discard(self, hold):
+        self._unallocate(hold)
+        for idx, key in ((self.by_book, hold["book"]), (self.by_user, hold["user"])):
+            holds = idx.get(key)
+            if holds is not None:
+                holds.pop(hold["id"], None)
+                if not holds:
+                    del idx[key]
+
+    def allocate(self, hold, expires):
+        self._unallocate(hold)
+        hold["expires"] = expires
+        self.allocated[hold["id"]] = hold
+        insort(self.by_expiry, (expires, hold["id"]))
+
+    def expired(self, now):
+        """Allocated holds whose copy has waited until now (iso) or longer, soonest first."""
+        return [self.allocated[i] for _, i in self.by_expiry[:bisect_right(self.by_expiry, (now, sys.maxsize))]]
+
+    def rename_user(self, old, new):
+        holds = self.by_user.pop(old, None)
+        if holds:
+            for hold in holds.values():
+                hold["user"] = new
+            self.by_user.setdefault(new, {}).update(holds)
+
+    def queue(self, title):
+        return list(self.by_book.get(title, {}).values())
+
+    def for_user(self, user):
+        return list(self.by_user.get(user, {}).values())
+
+    def find(self, user, title):
+        return next((h for h in self.by_user.get(user, {}).values() if h["book"] == title), None)
+
+    def position(self, hold):
+        return list(self.by_book.get(hold["book"], {})).index(hold["id"]) + 1
+
+    def next_waiting(self, title, skip=()):
+        """Oldest hold on title without a copy yet (ids in skip excluded)."""
+        return next((h for h in self.by_book.get(title, {}).values()
+                     if not h.get("expires") and h["id"] not in skip), None)
+
+def _holds_of(s, loans, key, value):
+    # through the index when there is one
+    if loans is not None:
+        return loans.holds.for_user(value) if key == "user" else loans.holds.queue(value)
+    return [h for h in s.get("holds", {}).values() if h[key] == value]
+
+def _new_hold(s, user, title):
+    # for reservations from older files, which were a plain list of names per book
+    hold = {"id": s.get("next_hold_id", 1), "user": user, "book": title, "placed_on": None}
+    s.setdefault("holds", {})[str(hold["id"])] = hold
+    s["next_hold_id"] = hold["id"] + 1
+
+def _drop_hold(s, hold, loans):
+    s.get("holds", {}).pop(str(hold["id"]), None)
+    if loans is not None:
+        loans.holds.discard(hold)
+
+def _bump(table, key, name, by):
+    # written back rather than edited in place: a SqliteTable hands out copies of its rows
+    row = table[key]
+    row[name] = row.get(name, 0) + by
+    table[key] = row
+
+def _free_copy(s, title, rec, loans):
+    # a returned or released copy goes to the hold named by the record, else back on the shelf
+    hold = s.get("holds", {}).get(str(rec.get("to")))
+    if hold is not None and hold["book"] == title and not hold.get("expires"):
+        if loans is not None:
+            loans.holds.allocate(hold, rec["expires"])
+        else:
+            hold["expires"] = rec["expires"]
+    elif title in s["books"]:
+        _bump(s["books"], title, "qty", 1)
+
+def apply_record(s, rec, loans=None):
+    op = rec["op"]
+    # books is looked up per op, so user and loan records leave a lazily loaded catalog on disk
+    if op == "batch":
+        # one journal line, so a torn write drops the whole batch rather than its tail
+        for sub in rec["recs"]:
+            apply_record(s, sub, loans)
+    elif op == "book_put":
+        # copied so a record still queued for a background write never sees later in-place edits
+        s["books"][rec["title"]] = dict(rec["book"])
+    elif op == "book_del":
+        s["books"].pop(rec["title"], None)
+        for hold in _holds_of(s, loans, "book", rec["title"]):
+            _drop_hold(s, hold, loans)
+    elif op == "user_add":
+        s["users"][rec["name"]] = new_user_meta(rec.get("registered_on"))
+    elif op == "user_del":
+        s["users"].pop(rec["name"], None)
+        # delete_user cancels the holds first; this only catches what is left
+        for hold in _holds_of(s, loans, "user", rec["name"]):
+            _drop_hold(s, hold, loans)
+            if hold.get("expires"):
+                _free_copy(s, hold["book"], {}, loans)
+    elif op == "user_rename":
+        old, new = rec["old"], rec["new"]
+        users = s["users"]
+        if old in users:
+            users[new] = users.pop(old)
+        if rec.get("at"):
+            # returned loans keep the name they came back under; history() maps them through renames
+            s.setdefault("renames", []).append([old, new, rec["at"]])
+        # so only open loans and holds follow, and a rename never reads the loan history
+        if loans is not None:
+            txs = loans.for_user(old)
+            loans.rename_user(old, new)
+            loans.holds.rename_user(old, new)
+            if isinstance(s, SqliteStore):
+                for tx in txs:
+                    s["issued"].changed(tx)
+        else:
+            for tx in s.get("issued", []):
+                if tx["user"] == old and not tx.get("returned", False):
+                    tx["user"] = new
+            for hold in _holds_of(s, loans, "user", old):
+                hold["user"] = new
+    elif op == "issue":
+        tx = dict(rec["tx"])
+        books = s["books"]
+        s.setdefault("issued", []).append(tx)
+        # issuing against a hold consumes it; an allocated hold already had its copy off the shelf
+        hold = s.get("holds", {}).get(str(rec["hold"])) if rec.get("hold") else None
+        if hold is not None:
+            _drop_hold(s, hold, loans)
+        if tx["book"] in books and (hold is None or not hold.get("expires")):
+            _bump(books, tx["book"], "qty", -1)
+        if tx["user"] in s["users"]:
+            _bump(s["users"], tx["user"], "loans", 1)
+        s["next_tx_id"] = max(s.get("next_tx_id", 1), tx["id"] + 1)
+        if loans is not None:
+            loans.add(tx)
+    elif op == "return":
+        if loans is not None:
+            tx = loans.by_id.get(rec["id"])
+        else:
+            tx = next((t for t in reversed(s.get("issued", []))
+                       if t.get("id") == rec["id"] and not t.get("returned", False)), None)
+        if tx is not None:
+            tx["returned"] = True
+            tx["returned_on"] = rec["returned_on"]
+            _free_copy(s, tx["book"], rec, loans)
+            if loans is not None:
+                loans.discard(tx)
+            if isinstance(s, SqliteStore):
+                s["issued"].changed(tx)
+    elif op == "hold_add":
+        hold = dict(rec["hold"])
+        s.setdefault("holds", {})[str(hold["id"])] = hold
+        s["next_hold_id"] = max(s.get("next_hold_id", 1), hold["id"] + 1)
+        if hold.get("expires") and hold["book"] in s["books"]:
+            _bump(s["books"], hold["book"], "qty", -1)  # a shelf copy set aside straight away
+        if loans is not None:
+            loans.holds.add(hold)
+    elif op == "hold_cancel":
+        hold = s.get("holds", {}).get(str(rec["id"]))
+        if hold is not None:
+            _drop_hold(s, hold, loans)
+            if hold.get("expires"):
+                _free_copy(s, hold["book"], rec, loans)
+    elif op == "hold_allocate":
+        # a shelf copy set aside for a waiting hold (restocked title, or holds from older files)
+        hold = s.get("holds", {}).get(str(rec["id"]))
+        book = s["books"].get(hold["book"]) if hold is not None else None
+        if book is not None and not hold.get("expires") and book.get("qty", 0) > 0:
+            _bump(s["books"], hold["book"], "qty", -1)
+            if loans is not None:
+                loans.holds.allocate(hold, rec["expires"])
+            else:
+                hold["expires"] = rec["expires"]
+    elif op == "archive":
+        # returned loans already written to the history archive
+        ids = set(rec["ids"])
+        if isinstance(s, SqliteStore):
+            s["issued"].discard(ids)
+        else:
+            s["issued"] = [tx for tx in s.get("issued", []) if tx["id"] not in ids]
+
+def migrate_store(s):
+    # older files have no transaction ids; number them in history order
+    next_id = s.get("next_tx_id", 1)
+    for tx in s.setdefault("issued", []):
+        if "id" not in tx:
+            tx["id"] = next_id
+        next_id = max(next_id, tx["id"] + 1)
+    s["next_tx_id"] = next_id
+    s.setdefault("books", {})
+    # users used to be a plain list of names; now name -> metadata
+    users = s.get("users", {})
+    if isinstance(users, list):
+        users = {name: new_user_meta() for name in users}
+        for tx in s["issued"]:
+            if tx["user"] in users:
+                users[tx["user"]]["loans"] += 1
+    s["users"] = users
+    # reservations used to be a list of names inside each book; now FIFO holds
+    s.setdefault("holds", {})
+    for title, d in s["books"].items():
+        for user in dict.fromkeys(d.pop("reserved", None) or ()):
+            _new_hold(s, user, title)
+    return s
+
+# ---------- Persistence ----------
+class JournalStorage:
+    """library_data.json snapshot plus an append-only journal.
+
+    Every mutation is appended to the journal as one small record and fsynced.
+    Loading replays the journal over the snapshot; compaction folds it back
+    into a fresh snapshot written atomically (temp file + os.replace). fold()
+    does the same from disk in a child process while appends carry on.
+    """
+    def __init__(self, data_file=DATA_FILE, journal_file=None):
+        self.data_file = data_file
+        # named after the whole file name, so library_data.json and library_data.snap
+        # next to each other never replay each other's records
+        self.journal_file = journal_file or data_file + ".journal"
+        self.seq = 0      # last record written or replayed
+        self.pending = 0  # records not yet folded into the snapshot
+        self._io_lock = threading.Lock()    # appends, snapshot writes and journal trims
+        self._fold_lock = threading.Lock()  # one compaction at a time
+
+    @instrument("load_store")
+    def load(self, loans, upto=None):
+        """Snapshot plus journal. With upto, only records up to that seq are
+        replayed and the journal is opened read-only, as a fold does while the
+        writer keeps appending."""
+        s, snap_seq = self._read_snapshot(loans)
+        self.seq, self.pending = snap_seq, 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "r+b" if upto is None else "rb") as f:
+                good = 0
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError
+                        rec = json.loads(line)
+                    except ValueError:
+                        # torn tail from a crash mid-append; drop it so new records follow valid ones
+                        if upto is None:
+                            f.truncate(good)
+                        break
+                    good += len(line)
+                    if upto is not None and rec["seq"] > upto:
+                        break
+                    if rec["seq"] <= snap_seq:
+                        continue  # already folded into the snapshot
+                    apply_record(s, rec, loans)
+                    self.seq = rec["seq"]
+                    self.pending += 1
+        return s
+
+    def _read_snapshot(self, loans):
+        """(store, journal_seq) from the snapshot, migrated and with loans indexed."""
+        s = make_empty_store()
+        if os.path.exists(self.data_file):
+            try:
+                with open(self.data_file, "r", encoding="utf-8") as f:
+                    s = json.load(f)
+            except Exception:
+                # keep the unreadable snapshot around instead of overwriting it later
+                os.replace(self.data_file, self.data_file + ".corrupt")
+                s = make_empty_store()
+        snap_seq = s.pop("journal_seq", 0)
+        migrate_store(s)
+        loans.rebuild(s)
+        return s, snap_seq
+
+    def append(self, rec):
+        """Write-ahead: append + fsync the record; returns it with its seq."""
+        return self.append_many([rec])[0]
+
+    @instrument("append_record")
+    def append_many(self, recs):
+        """Append a batch of records with a single fsync."""
+        with self._io_lock:
+            recs = [dict(rec, seq=self.seq + i) for i, rec in enumerate(recs, 1)]
+            try:
+                with open(self.journal_file, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n" for rec in recs)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                raise StorageError(f"Could not save data: {e}") from e
+            if recs:
+                self.seq = recs[-1]["seq"]
+            self.pending += len(recs)
+        return recs
+
+    @instrument("save_store")
+    def compact(self, s):
+        with self._fold_lock, self._io_lock:
+            try:
+                self._save_snapshot(s)
+                # records up to journal_seq are skipped on replay, so a crash before
+                # this truncate is harmless
+                open(self.journal_file, "w").close()
+            except OSError as e:
+                raise StorageError(f"Could not save data: {e}") from e
+            self.pending = 0
+
+    def _save_snapshot(self, s):
+        tmp = self.data_file + ".tmp"
+        with open(tmp, "wb") as f:
+            self._write_snapshot(f, s)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.data_file)
+
+    def _write_snapshot(self, f, s):
+        if isinstance(s, SnapshotStore):
+            s.load_all()  # read from a binary snapshot, saved as JSON
+        # compact dumps() goes through the C encoder; indent=2 would not
+        f.write(_dump(dict(s, journal_seq=self.seq)))
+
+    @instrument("fold_journal")
+    def fold(self):
+        """Compaction from disk, without the live store and off this process.
+
+        A child process replays the snapshot and the journal up to the current
+        seq and writes the new snapshot, so parsing and dumping a big store
+        never holds this process's GIL (and with it the UI). Appends go on
+        meanwhile; afterwards the journal keeps only the records written since.
+        """
+        with self._fold_lock:
+            with self._io_lock:
+                upto, pending = self.seq, self.pending
+                try:
+                    offset = os.path.getsize(self.journal_file)
+                except OSError:
+                    offset = 0
+            if not offset:
+                return
+            # a fresh interpreter that imports only this module (from its own directory)
+            cmd = [sys.executable, "-c", "import sys, library_core; library_core._fold_main(sys.argv[1:])",
+                   type(self).__name__, os.path.abspath(self.data_file), os.path.abspath(self.journal_file), str(upto)]
+            try:
+                proc = subprocess.run(cmd, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                      capture_output=True, text=True)
+            except OSError as e:
+                raise StorageError(f"Could not save data: {e}") from e
+            if proc.returncode != 0:
+                why = (proc.stderr.strip().splitlines() or [f"exit code {proc.returncode}"])[-1]
+                raise StorageError(f"Could not save data: {why}")
+            with self._io_lock:
+                try:
+                    self._trim_journal(offset)
+                except OSError as e:
+                    raise StorageError(f"Could not save data: {e}") from e
+                self.pending -= pending
+
+    def _trim_journal(self, offset):
+        # the snapshot now holds everything before offset; keep what was appended since.
+        # A crash before the swap is harmless: replay skips records up to journal_seq
+        with open(self.journal_file, "rb") as f:
+            f.seek(offset)
+            rest = f.read()
+        tmp = self.journal_file + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(rest)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.journal_file)
+
+    def close(self):
+        pass
+
+def _dump(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _fold_main(argv):
+    # the child process JournalStorage.fold() runs: storage class, data file, journal, seq
+    cls, data_file, journal_file, upto = argv
+    storage = globals()[cls](data_file, journal_file)
+    storage._save_snapshot(storage.load(OpenLoans(), int(upto)))
+
+# ---------- Binary snapshot ----------
+# A .snap file: header (magic, version, journal_seq, section count), then an
+# offset index of (name, offset, length) entries, then the sections, each
+# compact UTF-8 JSON. Sections: meta (counters, holds, renames), books, users,
+# loans (open) and history (returned, not yet archived).
+SNAPSHOT_MAGIC = b"LIBSNAP\0"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<8sIQI")
+SNAPSHOT_ENTRY = struct.Struct("<16sQQ")
+LAZY_SECTIONS = ("books", "users", "issued")  # store keys a SnapshotStore loads on first use
+
+def read_snapshot(path, names):
+    """(journal_seq, {name: bytes}) for the named sections of a .snap file.
+
+    The file is memory-mapped, so only the header, the index and the pages
+    of the requested sections are read.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        magic, version, seq, count = SNAPSHOT_HEADER.unpack_from(m, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError("not a library snapshot")
+        index = {}
+        for i in range(count):
+            name, offset, length = SNAPSHOT_ENTRY.unpack_from(m, SNAPSHOT_HEADER.size + i * SNAPSHOT_ENTRY.size)
+            index[name.rstrip(b"\0").decode()] = (offset, length)
+        return seq, {name: m[index[name][0]:sum(index[name])] for name in names}
+
+class SnapshotStore(dict):
+    """Working store over a .snap file whose big sections load on first use.
+
+    books, users and issued stay on disk until something reads them
+    (s["books"], get, setdefault); __missing__ then maps the file and parses
+    just that section. The open loans are read up front for the loan index,
+    and issued is later built around those same tx dicts. A section nobody
+    has read was not changed by any record since, so it can be read from
+    whichever snapshot the file holds by then.
+    """
+    def __init__(self, path, active, oldest_return=None):
+        super().__init__()
+        self.path = path
+        self.active = active                # open loans as of the snapshot
+        self.oldest_return = oldest_return  # earliest return in the history section
+        self._fault_lock = threading.Lock()
+
+    def __missing__(self, key):
+        if key not in LAZY_SECTIONS:
+            raise KeyError(key)
+        with self._fault_lock:
+            if not dict.__contains__(self, key):  # another thread may have loaded it meanwhile
+                self._load(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        return self[key] if key in LAZY_SECTIONS else dict.get(self, key, default)
+
+    def setdefault(self, key, default=None):
+        return self[key] if key in LAZY_SECTIONS else dict.setdefault(self, key, default)
+
+    def __contains__(self, key):
+        return key in LAZY_SECTIONS or dict.__contains__(self, key)
+
+    @instrument("load_section")
+    def _load(self, key):
+        if key != "issued":
+            self[key] = json.loads(self._read([key])[key])
+            return
+        # a fold since loading may have moved some of our open loans to the history
+        mine = {tx["id"] for tx in self.active}
+        history = [tx for tx in json.loads(self._read(["history"])["history"]) if tx["id"] not in mine]
+        self["issued"] = list(heapq.merge(history, self.active, key=lambda tx: tx["id"]))
+
+    def _read(self, names):
+        try:
+            return read_snapshot(self.path, names)[1]
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            raise StorageError(f"Could not read data: {e}") from e
+
+    def load_all(self):
+        for key in LAZY_SECTIONS:
+            self[key]
+        return self
+
+    def returns_before(self, cutoff):
+        """Whether a returned loan may be older than cutoff (iso); while the
+        history is on disk this is answered from the snapshot."""
+        if dict.__contains__(self, "issued"):
+            return True
+        return ((self.oldest_return is not None and self.oldest_return < cutoff)
+                or any(tx.get("returned", False) and (tx.get("returned_on") or tx["issued_on"]) < cutoff
+                       for tx in self.active))
+
+    def unloaded_sections(self):
+        """Raw bytes of the sections still on disk, for copying into a new snapshot."""
+        if not dict.__contains__(self, "issued") and any(tx.get("returned", False) for tx in self.active):
+            self["issued"]  # loans returned since loading belong in the history
+        names = [key for key in ("books", "users") if not dict.__contains__(self, key)]
+        if not dict.__contains__(self, "issued"):
+            names.append("history")
+        return self._read(names)
+
+class SnapshotStorage(JournalStorage):
+    """Binary .snap snapshot plus the same append-only journal as JournalStorage.
+
+    Loading reads the header, meta and open loans; books, users and the loan
+    history are faulted in by SnapshotStore when first used. Compaction
+    copies sections that were never loaded byte for byte.
+    """
+    def _read_snapshot(self, loans):
+        if not os.path.exists(self.data_file):
+            return super()._read_snapshot(loans)
+        try:
+            snap_seq, raw = read_snapshot(self.data_file, ("meta", "loans"))
+            meta, active = json.loads(raw["meta"]), json.loads(raw["loans"])
+        except Exception:
+            # keep the unreadable snapshot around instead of overwriting it later
+            os.replace(self.data_file, self.data_file + ".corrupt")
+            return super()._read_snapshot(loans)
+        s = SnapshotStore(self.data_file, active, meta.pop("oldest_return", None))
+        s.update(meta)
+        s.setdefault("holds", {})
+        # only the open loans: the history stays on disk
+        loans.rebuild({"holds": s["holds"], "issued": active})
+        return s, snap_seq
+
+    def _write_snapshot(self, f, s):
+        raw = s.unloaded_sections() if isinstance(s, SnapshotStore) else {}
+        if "history" in raw:
+            active, history, oldest = s.active, raw["history"], s.oldest_return
+        else:
+            issued = s["issued"]
+            active = [tx for tx in issued if not tx.get("returned", False)]
+            history = [tx for tx in issued if tx.get("returned", False)]
+            oldest = min((tx.get("returned_on") or tx["issued_on"] for tx in history), default=None)
+            history = _dump(history)
+        meta = {k: v for k, v in s.items() if k not in LAZY_SECTIONS}
+        sections = {"meta": _dump(dict(meta, oldest_return=oldest)),
+                    "books": raw["books"] if "books" in raw else _dump(s["books"]),
+                    "users": raw["users"] if "users" in raw else _dump(s["users"]),
+                    "loans": _dump(active), "history": history}
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.seq, len(sections)))
+        offset = SNAPSHOT_HEADER.size + len(sections) * SNAPSHOT_ENTRY.size
+        for name, data in sections.items():
+            f.write(SNAPSHOT_ENTRY.pack(name.encode(), offset, len(data)))
+            offset += len(data)
+        for data in sections.values():
+            f.write(data)
+
+class SqliteStorage:
+    """SQLite database in WAL mode, one small transaction per record.
+
+    Books, users, loans and holds live in indexed tables, so a record
+    touches only the rows it changes and there is nothing to compact. The
+    working store (SqliteStore) reads books, users and the loan history
+    from the database as they are asked for; only the holds and the open
+    loans are loaded into memory, for the engine's indexes.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+        CREATE TABLE IF NOT EXISTS books (title TEXT PRIMARY KEY, author TEXT NOT NULL, qty INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS users (name TEXT PRIMARY KEY, registered_on TEXT, loans INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE IF NOT EXISTS loans (id INTEGER PRIMARY KEY, user TEXT NOT NULL, book TEXT NOT NULL,
+            issued_on TEXT NOT NULL, due_date TEXT NOT NULL, returned INTEGER NOT NULL DEFAULT 0, returned_on TEXT);
+        CREATE INDEX IF NOT EXISTS loans_user ON loans(user);
+        CREATE INDEX IF NOT EXISTS loans_book ON loans(book);
+        CREATE INDEX IF NOT EXISTS loans_open ON loans(id) WHERE returned = 0;
+        CREATE INDEX IF NOT EXISTS loans_returned ON loans(returned_on) WHERE returned = 1;
+        CREATE TABLE IF NOT EXISTS holds (id INTEGER PRIMARY KEY, title TEXT NOT NULL, user TEXT NOT NULL,
+            placed_on TEXT, expires TEXT);
+        CREATE INDEX IF NOT EXISTS holds_title ON holds(title);
+        CREATE INDEX IF NOT EXISTS holds_user ON holds(user);
+        CREATE TABLE IF NOT EXISTS renames (pos INTEGER PRIMARY KEY AUTOINCREMENT, old TEXT NOT NULL, new TEXT NOT NULL, at TEXT NOT NULL);
+    """
+    # search indexes over titles and authors, kept in step by triggers: trigrams
+    # (books_fts) and, for queries too short for a trigram, word prefixes (books_words)
+    FTS_TABLES = {"books_fts": "tokenize='trigram'", "books_words": "prefix='1 2'"}
+    FTS_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(title, author, content='books',
+            content_rowid='rowid', {options});
+        CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON books BEGIN
+            INSERT INTO {fts} (rowid, title, author) VALUES (new.rowid, new.title, new.author);
+        END;
+        CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON books BEGIN
+            INSERT INTO {fts} ({fts}, rowid, title, author) VALUES ('delete', old.rowid, old.title, old.author);
+        END;
+        CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF title, author ON books BEGIN
+            INSERT INTO {fts} ({fts}, rowid, title, author) VALUES ('delete', old.rowid, old.title, old.author);
+            INSERT INTO {fts} (rowid, title, author) VALUES (new.rowid, new.title, new.author);
+        END;
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.seq = 0
+        self.pending = 0  # always 0: nothing to fold
+        self.written = 0  # records written since load(); a SqliteStore keeps newer changes in memory
+        self.fts = False  # books_fts is there (needs SQLite with FTS5 and the trigram tokenizer)
+        self.conn = None  # opened on first use
+        self.store = None  # the SqliteStore load() returned
+        self._io_lock = threading.Lock()  # a checkpoint must not run inside a write transaction
+
+    def _connect(self):
+        if self.conn is None:
+            try:
+                # check_same_thread off: a PersistenceWorker may write after the UI thread loaded
+                conn = sqlite3.connect(self.db_file, isolation_level=None, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=FULL")  # same durability as the fsynced journal
+                conn.executescript(self.SCHEMA)
+            except sqlite3.Error as e:
+                raise StorageError(f"Could not open database: {e}") from e
+            self.fts = self._create_fts(conn)
+            self.conn = conn
+        return self.conn
+
+    def _create_fts(self, c):
+        try:
+            for fts, options in self.FTS_TABLES.items():
+                new = not c.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)).fetchone()
+                c.executescript(self.FTS_SCHEMA.format(fts=fts, options=options))
+                if new:
+                    # books written by an SQLite without FTS5 (or the trigram tokenizer)
+                    c.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+        except sqlite3.OperationalError:
+            return False  # no FTS5 or trigram here: searches use the in-memory index
+        return True
+
+    @instrument("load_store")
+    def load(self, loans):
+        """A SqliteStore over the database, with the holds and open loans indexed."""
+        c = self._connect()
+        if self.store is not None:
+            self.store.close()
+        s = self.store = SqliteStore(self)
+        self.written = 0
+        for row in c.execute("SELECT id, user, title, placed_on, expires FROM holds ORDER BY id"):
+            hold = dict(zip(("id", "user", "book", "placed_on"), row[:4]))
+            if row[4] is not None:
+                hold["expires"] = row[4]
+            s["holds"][str(hold["id"])] = hold
+            s["next_hold_id"] = hold["id"] + 1
+        active = [SqliteLoans.from_row(row) for row in c.execute(
+            "SELECT id, user, book, issued_on, due_date, returned, returned_on FROM loans WHERE returned = 0 ORDER BY id")]
+        row = c.execute("SELECT value FROM meta WHERE key = 'next_tx_id'").fetchone()
+        s["next_tx_id"] = row[0] if row else 1
+        renames = [list(r) for r in c.execute("SELECT old, new, at FROM renames ORDER BY pos")]
+        if renames:
+            s["renames"] = renames
+        # only the open loans: the history stays in the database
+        loans.rebuild({"holds": s["holds"], "issued": active})
+        return s
+
+    def _free_copy(self, c, title, rec):
+        # mirrors _free_copy() on the store: to the hold named by the record, else the shelf
+        if rec.get("to") and c.execute("UPDATE holds SET expires = ? WHERE id = ? AND title = ? AND expires IS NULL",
+                                       (rec["expires"], rec["to"], title)).rowcount:
+            return
+        c.execute("UPDATE books SET qty = qty + 1 WHERE title = ?", (title,))
+
+    def _write(self, c, rec):
+        op = rec["op"]
+        if op == "batch":
+            for sub in rec["recs"]:
+                self._write(c, sub)
+        elif op == "book_put":
+            b = rec["book"]
+            c.execute("INSERT INTO books (title, author, qty) VALUES (?, ?, ?) "
+                      "ON CONFLICT(title) DO UPDATE SET author = excluded.author, qty = excluded.qty",
+                      (rec["title"], b.get("author", ""), b.get("qty", 0)))
+        elif op == "book_del":
+            c.execute("DELETE FROM books WHERE title = ?", (rec["title"],))
+            c.execute("DELETE FROM holds WHERE title = ?", (rec["title"],))
+        elif op == "user_add":
+            c.execute("INSERT OR REPLACE INTO users (name, registered_on, loans) VALUES (?, ?, 0)",
+                      (rec["name"], rec.get("registered_on")))
+        elif op == "user_del":
+            c.execute("DELETE FROM users WHERE name = ?", (rec["name"],))
+            for (title,) in c.execute("SELECT title FROM holds WHERE user = ? AND expires IS NOT NULL",
+                                      (rec["name"],)).fetchall():
+                c.execute("UPDATE books SET qty = qty + 1 WHERE title = ?", (title,))
+            c.execute("DELETE FROM holds WHERE user = ?", (rec["name"],))
+        elif op == "user_rename":
+            args = (rec["new"], rec["old"])
+            c.execute("UPDATE users SET name = ? WHERE name = ?", args)
+            c.execute("UPDATE loans SET user = ? WHERE user = ? AND returned = 0", args)
+            c.execute("UPDATE holds SET user = ? WHERE user = ?", args)
+            if rec.get("at"):
+                c.execute("INSERT INTO renames (old, new, at) VALUES (?, ?, ?)", (rec["old"], rec["new"], rec["at"]))
+        elif op == "issue":
+            tx = rec["tx"]
+            c.execute("INSERT INTO loans (id, user, book, issued_on, due_date) VALUES (?, ?, ?, ?, ?)",
+                      (tx["id"], tx["user"], tx["book"], tx["issued_on"], tx["due_date"]))
+            row = None
+            if rec.get("hold"):
+                row = c.execute("SELECT expires FROM holds WHERE id = ?", (rec["hold"],)).fetchone()
+                c.execute("DELETE FROM holds WHERE id = ?", (rec["hold"],))
+            if not (row and row[0]):
+                c.execute("UPDATE books SET qty = qty - 1 WHERE title = ?", (tx["book"],))
+            c.execute("UPDATE users SET loans = loans + 1 WHERE name = ?", (tx["user"],))
+            c.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('next_tx_id', ?)", (tx["id"] + 1,))
+        elif op == "return":
+            row = c.execute("SELECT book FROM loans WHERE id = ? AND returned = 0", (rec["id"],)).fetchone()
+            if row:
+                c.execute("UPDATE loans SET returned = 1, returned_on = ? WHERE id = ?", (rec["returned_on"], rec["id"]))
+                self._free_copy(c, row[0], rec)
+        elif op == "hold_add":
+            h = rec["hold"]
+            c.execute("INSERT INTO holds (id, title, user, placed_on, expires) VALUES (?, ?, ?, ?, ?)",
+                      (h["id"], h["book"], h["user"], h.get("placed_on"), h.get("expires")))
+            if h.get("expires"):
+                c.execute("UPDATE books SET qty = qty - 1 WHERE title = ?", (h["book"],))
+        elif op == "hold_cancel":
+            row = c.execute("SELECT title, expires FROM holds WHERE id = ?", (rec["id"],)).fetchone()
+            if row:
+                c.execute("DELETE FROM holds WHERE id = ?", (rec["id"],))
+                if row[1]:
+                    self._free_copy(c, row[0], rec)
+        elif op == "hold_allocate":
+            row = c.execute("SELECT h.title FROM holds h JOIN books b ON b.title = h.title "
+                            "WHERE h.id = ? AND h.expires IS NULL AND b.qty > 0", (rec["id"],)).fetchone()
+            if row:
+                c.execute("UPDATE holds SET expires = ? WHERE id = ?", (rec["expires"], rec["id"]))
+                c.execute("UPDATE books SET qty = qty - 1 WHERE title = ?", (row[0],))
+        elif op == "archive":
+            c.executemany("DELETE FROM loans WHERE id = ? AND returned = 1", ((i,) for i in rec["ids"]))
+
+    def append(self, rec):
+        return self.append_many([rec])[0]
+
+    @instrument("append_record")
+    def append_many(self, recs):
+        """Write a batch of records in one transaction."""
+        with self._io_lock:
+            recs = [dict(rec, seq=self.seq + i) for i, rec in enumerate(recs, 1)]
+            try:
+                c = self._connect()
+                c.execute("BEGIN IMMEDIATE")
+                try:
+                    for rec in recs:
+                        self._write(c, rec)
+                except BaseException:
+                    c.execute("ROLLBACK")
+                    raise
+                c.execute("COMMIT")
+            except sqlite3.Error as e:
+                raise StorageError(f"Could not save data: {e}") from e
+            if recs:
+                self.seq = recs[-1]["seq"]
+            self.written += len(recs)
+            if self.store is not None:
+                self.store.evict()
+        return recs
+
+    @instrument("save_store")
+    def compact(self, s=None):
+        with self._io_lock:
+            try:
+                self._connect().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error as e:
+                raise StorageError(f"Could not save data: {e}") from e
+
+    fold = compact
+
+    def import_store(self, s):
+        """Replace the database contents with a store dict in one transaction."""
+        c = self._connect()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            for table in ("books", "users", "loans", "holds", "renames", "meta"):
+                c.execute(f"DELETE FROM {table}")
+            c.executemany("INSERT INTO books (title, author, qty) VALUES (?, ?, ?)",
+                          ((t, d.get("author", ""), d.get("qty", 0)) for t, d in s["books"].items()))
+            c.executemany("INSERT INTO holds (id, title, user, placed_on, expires) VALUES (?, ?, ?, ?, ?)",
+                          ((h["id"], h["book"], h["user"], h.get("placed_on"), h.get("expires"))
+                           for h in s["holds"].values()))
+            c.executemany("INSERT INTO users (name, registered_on, loans) VALUES (?, ?, ?)",
+                          ((n, m.get("registered_on"), m.get("loans", 0)) for n, m in s["users"].items()))
+            c.executemany("INSERT INTO loans (id, user, book, issued_on, due_date, returned, returned_on) "
+                          "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                          ((tx["id"], tx["user"], tx["book"], tx["issued_on"], tx["due_date"],
+                            int(tx.get("returned", False)), tx.get("returned_on")) for tx in s["issued"]))
+            c.execute("INSERT INTO meta (key, value) VALUES ('next_tx_id', ?)", (s["next_tx_id"],))
+            c.executemany("INSERT INTO renames (old, new, at) VALUES (?, ?, ?)", s.get("renames", []))
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+        c.execute("COMMIT")
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+class SqliteTable(MutableMapping):
+    """books or users of a SqliteStore: a dict-like view of one table.
+
+    Reads are point queries and keyset scans in rowid order, which is the
+    order rows were added in. Rows come back as fresh dicts, so a change is
+    a write (table[key] = row); it waits in pending, None for a deletion,
+    until the records that made it are in the database.
+    """
+    CHUNK = 1000  # rows per query while scanning
+
+    def __init__(self, store, table, key, columns):
+        self.store = store
+        self.table, self.key, self.columns = table, key, columns
+        self.pending = {}  # key -> (row or None, SqliteStore.applied when set)
+        cols = ", ".join(columns)
+        self._get = f"SELECT {cols} FROM {table} WHERE {key} = ?"
+        self._scan_sql = (f"SELECT rowid, {key}, {cols} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                          f"SELECT rowid, {key}, {cols} FROM {table} WHERE rowid < ? ORDER BY rowid DESC LIMIT ?")
+
+    def _row(self, values):
+        return dict(zip(self.columns, values))
+
+    def __getitem__(self, key):
+        with self.store.lock:
+            if key in self.pending:
+                row = self.pending[key][0]
+            else:
+                rows = self.store.read(self._get, (key,))
+                row = self._row(rows[0]) if rows else None
+        if row is None:
+            raise KeyError(key)
+        return row
+
+    def __contains__(self, key):
+        with self.store.lock:
+            if key in self.pending:
+                return self.pending[key][0] is not None
+            return self._stored(key)
+
+    def _stored(self, key):
+        return bool(self.store.read(f"SELECT 1 FROM {self.table} WHERE {self.key} = ?", (key,)))
+
+    def __setitem__(self, key, row):
+        with self.store.lock:
+            self.pending[key] = (row, self.store.applied)
+
+    def __delitem__(self, key):
+        with self.store.lock:
+            if key not in self:
+                raise KeyError(key)
+            self.pending[key] = (None, self.store.applied)
+
+    def __len__(self):
+        with self.store.lock:
+            n = self.store.read(f"SELECT COUNT(*) FROM {self.table}")[0][0]
+            return n + sum((row is not None) - self._stored(key) for key, (row, _) in self.pending.items())
+
+    def __iter__(self):
+        return (key for key, _ in self.items())
+
+    def __reversed__(self):
+        return (key for key, _ in self._scan(reverse=True))
+
+    def items(self):
+        return self._scan()
+
+    def keys_at(self, offset, limit, reverse=False):
+        """limit keys from position offset of iter() (reversed() if reverse) order."""
+        return [key for key, _ in islice(self._scan(reverse, offset), limit)]
+
+    def _scan(self, reverse=False, offset=0):
+        # pending is copied once; rows not in the database yet come last (first when reversed)
+        with self.store.lock:
+            pending = {key: row for key, (row, _) in self.pending.items()}
+            new = [key for key, row in pending.items() if row is not None and not self._stored(key)]
+            gone = [r[0][0] for r in (self.store.read(f"SELECT rowid FROM {self.table} WHERE {self.key} = ?", (key,))
+                                      for key, row in pending.items() if row is None) if r]
+        head, tail = (list(reversed(new)), []) if reverse else ([], new)
+        yield from ((key, pending[key]) for key in head[offset:])
+        offset = max(0, offset - len(head))
+        last = sys.maxsize if reverse else 0
+        # jump over most of the offset in SQL; each deleted row before the jump is one row less to skip
+        jump = offset - len(gone)
+        if jump > 0:
+            rows = self.store.read(f"SELECT rowid FROM {self.table} ORDER BY rowid{' DESC' if reverse else ''} "
+                                   "LIMIT 1 OFFSET ?", (jump - 1,))
+            if rows:
+                last = rows[0][0]
+                offset -= jump - sum((r >= last) if reverse else (r <= last) for r in gone)
+        skip = set(new)
+        while True:
+            rows = self.store.read(self._scan_sql[reverse], (last, self.CHUNK))
+            for rowid, key, *values in rows:
+                if key in skip or (key in pending and pending[key] is None):
+                    continue  # new ones (written while scanning) are yielded with the rest of new
+                if offset:
+                    offset -= 1
+                    continue
+                yield key, pending[key] if key in pending else self._row(values)
+            if len(rows) < self.CHUNK:
+                break
+            last = rows[-1][0]
+        yield from ((key, pending[key]) for key in tail[offset:])
+
+    def evict(self, written):
+        for key in [key for key, (_, tag) in self.pending.items() if tag <= written]:
+            del self.pending[key]
+
+class SqliteLoans:
+    """The loans (issued) of a SqliteStore, open and returned, in id order.
+
+    Stands in for the store's list of transactions: append() and the
+    changed() / discard() notes the records make wait in pending, as with
+    SqliteTable; iteration and the history queries read the database.
+    """
+    COLUMNS = "id, user, book, issued_on, due_date, returned, returned_on"
+    CHUNK = 1000
+
+    def __init__(self, store):
+        self.store = store
+        self.pending = {}  # tx id -> (tx or None, SqliteStore.applied when set)
+
+    @staticmethod
+    def from_row(row):
+        tx = dict(zip(("id", "user", "book", "issued_on", "due_date"), row[:5]), returned=bool(row[5]))
+        if row[6] is not None:
+            tx["returned_on"] = row[6]
+        return tx
+
+    def _note(self, tx_id, tx):
+        with self.store.lock:
+            self.pending[tx_id] = (tx, self.store.applied)
+
+    def append(self, tx):
+        self._note(tx["id"], tx)
+
+    def changed(self, tx):
+        self._note(tx["id"], tx)
+
+    def discard(self, ids):
+        for tx_id in ids:
+            self._note(tx_id, None)
+
+    def _stored(self, tx_id):
+        return bool(self.store.read("SELECT 1 FROM loans WHERE id = ?", (tx_id,)))
+
+    def __len__(self):
+        with self.store.lock:
+            n = self.store.read("SELECT COUNT(*) FROM loans")[0][0]
+            return n + sum((tx is not None) - self._stored(i) for i, (tx, _) in self.pending.items())
+
+    def __iter__(self):
+        return self._scan()
+
+    def matching(self, user=None, book=None):
+        """Loans of user and/or book, from the loans_user / loans_book indexes."""
+        where = [f"{col} = ?" for col, value in (("user", user), ("book", book)) if value is not None]
+        return self._scan(" AND ".join(where), tuple(v for v in (user, book) if v is not None),
+                          lambda tx: (user is None or tx["user"] == user) and (book is None or tx["book"] == book))
+
+    def returned_before(self, cutoff):
+        """Returned loans whose return (or issue, if unrecorded) is before cutoff (iso)."""
+        return list(self._scan("returned = 1 AND (returned_on < ? OR (returned_on IS NULL AND issued_on < ?))",
+                               (cutoff, cutoff),
+                               lambda tx: tx.get("returned", False) and (tx.get("returned_on") or tx["issued_on"]) < cutoff))
+
+    def _scan(self, where="", args=(), keep=None):
+        # rows come from the database unless pending has the loan, which then counts as is
+        with self.store.lock:
+            pending = {i: tx for i, (tx, _) in self.pending.items()}
+        mine = sorted((tx for tx in pending.values() if tx is not None and (keep is None or keep(tx))),
+                      key=lambda tx: tx["id"])
+        sql = f"SELECT {self.COLUMNS} FROM loans WHERE id > ?{' AND ' + where if where else ''} ORDER BY id LIMIT ?"
+
+        def stored():
+            last = 0
+            while True:
+                rows = self.store.read(sql, (last, *args, self.CHUNK))
+                yield from (self.from_row(row) for row in rows if row[0] not in pending)
+                if len(rows) < self.CHUNK:
+                    break
+                last = rows[-1][0]
+        return heapq.merge(stored(), mine, key=lambda tx: tx["id"])
+
+    def evict(self, written):
+        for i in [i for i, (_, tag) in self.pending.items() if tag <= written]:
+            del self.pending[i]
+
+class SqliteStore(dict):
+    """Working store over a SQLite database.
+
+    books and users are SqliteTables and issued is SqliteLoans, all read
+    from the database on demand; holds, counters and renames are plain
+    entries loaded up front. What the engine applies is kept in the views'
+    pending maps, tagged with the number of records applied so far, and
+    dropped once the storage has written that many (evict()). While records
+    are being applied (applying()) the database is read as of before them,
+    so a synchronous write that lands first is not counted twice.
+    """
+    def __init__(self, storage):
+        super().__init__(make_empty_store())
+        self.storage = storage
+        self.applied = 0  # records applied since load, counted like SqliteStorage.written
+        self.lock = threading.RLock()  # the views' pending maps and the read connection
+        self._db = None
+        self["books"] = SqliteTable(self, "books", "title", ("author", "qty"))
+        self["users"] = SqliteTable(self, "users", "name", ("registered_on", "loans"))
+        self["issued"] = SqliteLoans(self)
+
+    def read(self, sql, args=()):
+        with self.lock:
+            try:
+                if self._db is None:
+                    # a connection of its own: the writer's may be inside a transaction on another thread
+                    self._db = sqlite3.connect(self.storage.db_file, isolation_level=None, check_same_thread=False)
+                return self._db.execute(sql, args).fetchall()
+            except sqlite3.Error as e:
+                raise StorageError(f"Could not read data: {e}") from e
+
+    @contextmanager
+    def applying(self):
+        """Around writing (or queueing) records and applying them; add their
+        number to applied once they are written or queued."""
+        with self.lock:
+            self.read("BEGIN")
+            try:
+                self.read("SELECT 1 FROM meta LIMIT 1")  # pins the snapshot reads see until COMMIT
+                yield
+            finally:
+                self.read("COMMIT")
+                self.evict()
+
+    def evict(self):
+        with self.lock:
+            for view in (self["books"], self["users"], self["issued"]):
+                view.evict(self.storage.written)
+
+    def book_candidates(self, q):
+        """SearchIndex.candidates() for the lowercased q, from books_fts (or
+        books_words for a q too short for a trigram); None without them."""
+        if not self.storage.fts:
+            return None
+        if len(q) < 3 and not WORD.search(q):
+            return []
+        books = self["books"]
+        fts, match = ("books_fts", '"{}"') if len(q) >= 3 else ("books_words", '"{}"*')  # a word starting with q
+        with self.lock:
+            pending = {title: row for title, (row, _) in books.pending.items()}
+            rows = self.read(f"SELECT b.title, b.author FROM {fts} f JOIN books b ON b.rowid = f.rowid "
+                             f"WHERE {fts} MATCH ?", (match.format(q.replace('"', '""')),))
+        rows = [r for r in rows if r[0] not in pending]
+        rows += [(title, row.get("author", "")) for title, row in pending.items() if row is not None]
+        return [(title, (title.lower(), (author or "").lower())) for title, author in rows]
+
+    def load_all(self):
+        """The whole store as plain dicts and lists, e.g. to save it in another format."""
+        s = {k: v for k, v in self.items() if k not in LAZY_SECTIONS}
+        s.update(books=dict(self["books"].items()), users=dict(self["users"].items()), issued=list(self["issued"]))
+        return s
+
+    def close(self):
+        with self.lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+class PersistenceWorker:
+    """Writes journal records on a background thread.
+
+    Records submitted while a write is in flight are coalesced into the next
+    append_many() call, i.e. one fsync (or one transaction) per burst. Failed
+    batches stay queued and are retried every RETRY_DELAY; on_error gets the
+    first failure of a run of them (from the worker thread), and is armed
+    again by the next successful write. Every COMPACT_EVERY records the
+    storage is folded on a second thread, so writes carry on while it runs.
+    """
+    def __init__(self, storage, on_error=None, delay=COALESCE_DELAY):
+        self.storage = storage
+        self.on_error = on_error
+        self.delay = delay
+        self._queue = []
+        self._submitted = 0  # records handed in
+        self._written = 0    # records durably written
+        self._flushing = 0   # callers blocked in flush()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._folder = None       # thread running storage.fold()
+        self._fold_at = COMPACT_EVERY  # pending records that start the next fold
+        self._failing = set()     # "write" / "fold" while that keeps failing (already reported)
+        self._thread = threading.Thread(target=self._run, name="library-persist", daemon=True)
+        self._thread.start()
+
+    def submit(self, recs):
+        with self._cond:
+            self._queue.extend(recs)
+            self._submitted += len(recs)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    return
+                # let the rest of a burst arrive; a caller blocked in flush() cuts this
+                # short, since whatever is queued meanwhile joins the next batch anyway
+                self._cond.wait_for(lambda: self._flushing or self._closed, self.delay)
+                batch, self._queue = self._queue, []
+            try:
+                self.storage.append_many(batch)
+            except LibraryError as e:
+                with self._cond:
+                    self._queue[:0] = batch
+                self._failed("write", e)
+                time.sleep(RETRY_DELAY)
+                continue
+            self._failing.discard("write")
+            with self._cond:
+                self._written += len(batch)
+                self._cond.notify_all()
+            if self.storage.pending >= self._fold_at and not (self._folder and self._folder.is_alive()):
+                self._folder = threading.Thread(target=self._fold, name="library-fold", daemon=True)
+                self._folder.start()
+
+    def _fold(self):
+        try:
+            self.storage.fold()
+        except LibraryError as e:
+            # try again once as many records again have piled up
+            self._fold_at = self.storage.pending + COMPACT_EVERY
+            self._failed("fold", e)
+        else:
+            self._fold_at = COMPACT_EVERY
+            self._failing.discard("fold")
+
+    def _failed(self, kind, e):
+        # a disk that stays full would otherwise report every RETRY_DELAY
+        if kind not in self._failing:
+            self._failing.add(kind)
+            if self.on_error:
+                self.on_error(e)
+
+    def flush(self, timeout=None):
+        """Wait until everything submitted so far is written; False on timeout."""
+        with self._cond:
+            target = self._submitted
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                return self._cond.wait_for(lambda: self._written >= target, timeout)
+            finally:
+                self._flushing -= 1
+
+    def close(self, timeout=None):
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._folder:
+            self._folder.join(timeout)
+        return flushed
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+SNAPSHOT_SUFFIXES = (".snap",)
+
+def open_storage(path=DATA_FILE):
+    """Pick the backend from the file name: SQLite for .db/.sqlite, binary snapshot
+    for .snap, else JSON + journal."""
+    if path.lower().endswith(SQLITE_SUFFIXES):
+        return SqliteStorage(path)
+    if path.lower().endswith(SNAPSHOT_SUFFIXES):
+        return SnapshotStorage(path)
+    return JournalStorage(path)
+
+def convert_data_file(src, dest):
+    """One-shot copy of a data file (plus its journal and history archive) into
+    another format, by suffix: JSON, binary snapshot or SQLite. Returns the
+    number of books, users, loans and archived loans carried over."""
+    source, target = open_storage(src), open_storage(dest)
+    if _storage_files(source) & _storage_files(target):
+        # compacting the target would truncate a journal the source still needs
+        raise ValidationError("Source and target share a data or journal file; pick another target name.")
+    s = source.load(OpenLoans())
+    if isinstance(s, SqliteStore):
+        s = s.load_all()
+        source.close()
+    try:
+        if isinstance(target, SqliteStorage):
+            target.import_store(s)
+        else:
+            target.compact(s)
+    except sqlite3.Error as e:
+        raise StorageError(f"Could not migrate data: {e}") from e
+    finally:
+        target.close()
+    archived = HistoryArchive(default_archive_dir(src)).copy_into(HistoryArchive(default_archive_dir(dest)))
+    return len(s["books"]), len(s["users"]), len(s["issued"]), archived
+
+def _storage_files(storage):
+    paths = (getattr(storage, name, None) for name in ("data_file", "journal_file", "db_file"))
+    return {os.path.normcase(os.path.abspath(p)) for p in paths if p}
+
+def migrate_json_to_sqlite(json_file, db_file):
+    """One-shot copy of a JSON snapshot (plus its journal) into a SQLite database."""
+    return convert_data_file(json_file, db_file)
+
+# ---------- History archive ----------
+class _Head(io.RawIOBase):
+    """The first n bytes of a binary file, read-only."""
+    def __init__(self, f, n):
+        self.f, self.left = f, n
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.f.read(min(len(b), self.left))
+        self.left -= len(data)
+        b[:len(data)] = data
+        return len(data)
+
+class HistoryArchive:
+    """Returned loans moved out of the working store, one gzip JSON-lines segment per month.
+
+    Segments are keyed by the month a loan was returned. Adding loans to a
+    month appends one gzip member to its segment, then one line to the
+    <month>.ids sidecar: the segment size after the member and the loan ids
+    in it. Readers stop at the last recorded size, and bytes past it (a
+    member torn by a crash, whose loans are still in the store) are cut off
+    by the next append. Loans already in a segment are skipped, which makes a
+    repeated archive run after a crash harmless.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()  # appends, and readers taking a segment's size
+
+    def segments(self):
+        """Segment paths, oldest month first."""
+        try:
+            names = sorted(n for n in os.listdir(self.directory) if n.endswith(".jsonl.gz"))
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, n) for n in names]
+
+    @staticmethod
+    def _sidecar(path):
+        """(ids, segment size, sidecar bytes) from the whole lines of a segment's sidecar."""
+        ids, end, good = set(), 0, 0
+        with open(path[:-len(".jsonl.gz")] + ".ids", "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn by a crash, like the member it was for
+                size, *rest = line.split()
+                ids.update(map(int, rest))
+                end, good = int(size), good + len(line)
+        return ids, end, good
+
+    def _end(self, path):
+        with self._lock:
+            try:
+                return self._sidecar(path)[1]
+            except FileNotFoundError:
+                return os.path.getsize(path)  # no sidecar (copied in by hand): the segment as it is
+
+    def _seen(self, path):
+        """Ids already in a segment, once anything past its last recorded member is cut off."""
+        ids_path = path[:-len(".jsonl.gz")] + ".ids"
+        try:
+            ids, end, good = self._sidecar(path)
+        except FileNotFoundError:
+            if not os.path.exists(path):
+                return set()
+            with gzip.open(path, "rb") as f:
+                ids = {json.loads(line)["id"] for line in f}
+            end = os.path.getsize(path)
+            with open(ids_path, "wb") as f:
+                f.write(" ".join(map(str, [end, *sorted(ids)])).encode() + b"\n")
+            return ids
+        with open(ids_path, "r+b") as f:
+            f.truncate(good)
+        if os.path.exists(path):
+            with open(path, "ab") as f:
+                f.truncate(end)
+        return ids
+
+    @instrument("archive_append")
+    def append(self, txs):
+        """Add returned transactions to their month segments; returns how many were new."""
+        by_month = {}
+        for tx in txs:
+            by_month.setdefault((tx.get("returned_on") or tx["issued_on"])[:7], []).append(tx)
+        added = 0
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with self._lock:
+                for month, month_txs in sorted(by_month.items()):
+                    path = os.path.join(self.directory, f"{month}.jsonl.gz")
+                    seen = self._seen(path)
+                    new = [tx for tx in month_txs if tx["id"] not in seen]
+                    if not new:
+                        continue
+                    # a gzip file may hold several members, read back as one stream
+                    member = gzip.compress(b"".join(_dump(tx) + b"\n" for tx in new))
+                    with open(path, "ab") as f:
+                        f.write(member)
+                        f.flush()
+                        os.fsync(f.fileno())
+                        end = f.tell()
+                    with open(path[:-len(".jsonl.gz")] + ".ids", "ab") as f:
+                        f.write(" ".join(map(str, [end] + [tx["id"] for tx in new])).encode() + b"\n")
+                        f.flush()
+                        os.fsync(f.fileno())
+                    added += len(new)
+        except (OSError, EOFError, ValueError) as e:
+            raise StorageError(f"Could not archive loans: {e}") from e
+        return added
+
+    def _lines(self, path):
+        # only whole members: one being appended meanwhile is past the recorded size
+        end = self._end(path)
+        with open(path, "rb") as raw, gzip.GzipFile(fileobj=_Head(raw, end), mode="rb") as f:
+            yield from f
+
+    def copy_into(self, other):
+        """Add every archived loan to another archive, one month at a time.
+
+        Returns the number of loans in this archive; loans the other one
+        already has are skipped, and an archive shared by both is left as is.
+        """
+        if os.path.normcase(os.path.abspath(self.directory)) == os.path.normcase(os.path.abspath(other.directory)):
+            return sum(1 for _ in self.read())
+        n = 0
+        try:
+            for path in self.segments():
+                txs = [json.loads(line) for line in self._lines(path)]
+                other.append(txs)
+                n += len(txs)
+        except (OSError, EOFError, ValueError) as e:
+            raise StorageError(f"Could not copy archived loans: {e}") from e
+        return n
+
+    def read(self, needle=None):
+        """Stream archived transactions, oldest month first.
+
+        needle is a value (user name or title) that must appear in a line for
+        it to be decoded; callers still check the field it belongs to.
+        """
+        raw = json.dumps(needle, ensure_ascii=False).encode("utf-8") if needle is not None else None
+        for path in self.segments():
+            for line in self._lines(path):
+                if raw is None or raw in line:
+                    yield json.loads(line)
+
+def default_archive_dir(data_file):
+    return os.path.splitext(data_file)[0] + "_archive"
+
+# ---------- Search index ----------
+WORD = re.compile(r"\w+")
+
+class SearchIndex:
+    """Trigram and word-prefix index over lowercased titles and authors.
+
+    A query of 3+ characters only touches the titles that share its
+    trigrams, and candidates are re-checked with a plain substring test, so
+    results are exactly those of a linear scan. A shorter query has no
+    trigram to look up; it matches titles with a word (in the title or the
+    author) starting with it, from the 1- and 2-character word prefixes.
+    """
+    def __init__(self):
+        self.grams = {}     # trigram -> set of titles
+        self.prefixes = {}  # first 1 and 2 characters of each word -> set of titles
+        self.text = {}      # title -> (title lower, author lower)
+
+    @classmethod
+    def build(cls, books):
+        idx = cls()
+        for t, d in books.items():
+            idx.add(t, d.get("author", ""))
+        return idx
+
+    @staticmethod
+    def _grams(text):
+        # padded so that titles/authors shorter than 3 chars still get grams
+        padded = f"\0{text}\0"
+        return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+    @staticmethod
+    def _prefixes(text):
+        return {w[:n] for w in WORD.findall(text) for n in (1, 2)}
+
+    def _keys(self, t, a):
+        return ((self.grams, self._grams(t) | self._grams(a)),
+                (self.prefixes, self._prefixes(t) | self._prefixes(a)))
+
+    def add(self, title, author):
+        if title in self.text:
+            self.remove(title)
+        t, a = title.lower(), (author or "").lower()
+        self.text[title] = (t, a)
+        for idx, keys in self._keys(t, a):
+            for k in keys:
+                idx.setdefault(k, set()).add(title)
+
+    def remove(self, title):
+        if title not in self.text:
+            return
+        for idx, keys in self._keys(*self.text.pop(title)):
+            for k in keys:
+                titles = idx.get(k)
+                if titles is not None:
+                    titles.discard(title)
+                    if not titles:
+                        del idx[k]
+
+    def candidates(self, q):
+        """(title, (title lower, author lower)) pairs that may contain the lowercased q.
+
+        Only set operations and copies, so a caller can take them under a
+        lock and leave the filtering and ranking (rank()) for after.
+        """
+        if len(q) >= 3:
+            posting = sorted((self.grams.get(q[i:i+3], set()) for i in range(len(q) - 2)), key=len)
+            return [(t, self.text[t]) for t in set(posting[0]).intersection(*posting[1:])]
+        word = WORD.search(q)
+        return [(t, self.text[t]) for t in self.prefixes.get(word.group(), ())] if word else []
+
+    @staticmethod
+    def _rank(t, q):
+        if t == q:
+            return 0
+        if t.startswith(q):
+            return 1
+        if q in t.split():
+            return 2
+        if q in t:
+            return 3
+        return 4  # author match
+
+    @staticmethod
+    def rank(candidates, q, limit=None):
+        """(titles best match first, total) of the candidates that contain q."""
+        matches = [(title, t) for title, (t, a) in candidates if q in t or q in a]
+        key = lambda m: (SearchIndex._rank(m[1], q), m[1])
+        if limit is None or limit >= len(matches):
+            ranked = sorted(matches, key=key)
+        else:
+            ranked = heapq.nsmallest(limit, matches, key=key)
+        return [title for title, _ in ranked], len(matches)
+
+    def search(self, q, limit=None):
+        """Return (titles best match first, total number of matches)."""
+        q = q.strip().lower()
+        if not q:
+            return [], 0
+        return self.rank(self.candidates(q), q, limit)
+
+class SearchWorker:
+    """Runs Library.search on a background thread; only the newest query counts.
+
+    submit() returns a generation number straight away. A query still waiting
+    when a newer one arrives is dropped, and a result that finishes after a
+    newer submit() (or cancel()) is discarded, so `results` only ever gets
+    answers to the latest query: (generation, query, SearchResult or None,
+    LibraryError or None). The caller drains `results` on its own thread.
+    """
+    def __init__(self, lib, limit=SEARCH_LIMIT):
+        self.lib = lib
+        self.limit = limit
+        self.results = queue.SimpleQueue()
+        self.generation = 0
+        self._query = None  # (generation, text) waiting to run
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="library-search", daemon=True)
+        self._thread.start()
+
+    def submit(self, q):
+        with self._cond:
+            self.generation += 1
+            self._query = (self.generation, q)
+            self._cond.notify()
+            return self.generation
+
+    def cancel(self):
+        """Make any queued or running query stale."""
+        with self._cond:
+            self.generation += 1
+            self._query = None
+
+    def _run(self):
+        try:
+            self.lib.prepare_search()  # so the first keystroke does not pay for the index
+        except LibraryError:
+            pass  # search() reports it
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._query or self._closed)
+                if self._closed:
+                    return
+                (gen, q), self._query = self._query, None
+            try:
+                res, err = self.lib.search(q, limit=self.limit), None
+            except LibraryError as e:
+                res, err = None, e
+            if gen == self.generation:
+                self.results.put((gen, q, res, err))
+
+    def close(self, timeout=None):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+# ---------- Bulk import / export ----------
+EXPORT_FIELDS = {
+    "books": ("title", "author", "qty"),
+    "users": ("name", "registered_on", "loans"),
+    "loans": ("id", "user", "book", "issued_on", "due_date", "returned", "returned_on"),
+}
+
+def file_format(path):
+    """'csv' or 'jsonl', from the file extension."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        return "csv"
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise ValidationError(f"Unsupported file type '{ext}' (use .csv or .jsonl).")
+
+def read_rows(f, fmt):
+    """Yield one dict per CSV row / JSON line without reading the whole file."""
+    if fmt == "csv":
+        yield from csv.DictReader(f)
+        return
+    for line in f:
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None  # reported as a bad row by the importer
+            yield row if isinstance(row, dict) else {}
+
+def write_rows(rows, f, fmt, fields):
+    """Stream dict rows out as CSV or JSON lines; returns the row count."""
+    n = 0
+    if fmt == "csv":
+        w = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        w.writeheader()
+        for n, row in enumerate(rows, 1):
+            w.writerow(row)
+        return n
+    for n, row in enumerate(rows, 1):
+        f.write(json.dumps({k: row.get(k) for k in fields}, ensure_ascii=False) + "\n")
+    return n
+
+# ---------- Paged views ----------
+# sort keys per view; no sort means storage order (books/users as added, loans by id)
+VIEW_SORTS = {
+    "books": {"title": lambda t, d: t.lower(), "author": lambda t, d: d.get("author", "").lower(),
+              "qty": lambda t, d: d.get("qty", 0)},
+    "users": {"name": lambda n, m: n.lower(), "registered_on": lambda n, m: m.get("registered_on") or "",
+              "loans": lambda n, m: m.get("loans", 0)},
+    "loans": {"user": lambda i, tx: tx["user"].lower(), "book": lambda i, tx: tx["book"].lower(),
+              "due_date": lambda i, tx: tx["due_date"]},
+}
+MAX_CACHED_VIEWS = 8
+
+# ---------- Engine ----------
+class Library:
+    """Catalog, users and circulation over a persistent store.
+
+    Methods validate their input, raise LibraryError subclasses on failure and
+    return Book / User / Loan results. Nothing is read from disk until the
+    first call that needs the data.
+    """
+    def __init__(self, data_file=DATA_FILE, storage=None, background=False, on_error=None,
+                 archive=None, archive_after=ARCHIVE_AFTER_DAYS):
+        self.storage = storage or open_storage(data_file)
+        self.archive = archive or HistoryArchive(default_archive_dir(data_file))
+        self.archive_after = archive_after  # days; None turns off archiving on load
+        self.loans = OpenLoans()
+        self._store = None
+        self._search = None
+        self._views = {}  # (kind, sort, descending, filter) -> ordered keys, dropped on every commit
+        # held while loading, applying commits, allocating ids and searching, so a
+        # SearchWorker (or a library_server request thread) can read under it
+        # while another thread writes
+        self.lock = threading.RLock()
+        self._index_backlog = None  # book changes made while prepare_search() builds off the lock
+        self._index_built = threading.Condition(self.lock)  # a build in progress finished
+        # background=True: writes go through a PersistenceWorker and calls return
+        # once the in-memory store is updated
+        self.writer = PersistenceWorker(self.storage, on_error) if background else None
+
+    @property
+    def store(self):
+        if self._store is None:
+            with self.lock:
+                if self._store is None:
+                    self._store = self.storage.load(self.loans)
+                    if self.archive_after is not None:
+                        try:
+                            self.archive_returned(self.archive_after)
+                        except StorageError:
+                            pass  # the loans stay in the working store; retried on the next load
+        return self._store
+
+    def load(self):
+        """Load now rather than on first use."""
+        return self.store
+
+    def _commit(self, rec):
+        rec = self._commit_many([rec])[0]
+        if self.writer is None and self.storage.pending >= COMPACT_EVERY:
+            try:
+                self.storage.compact(self._store)
+            except StorageError:
+                pass  # every record is still in the journal; retried on the next commit
+        return rec
+
+    def _commit_many(self, recs):
+        """Persist records as one batch, then apply them. Does not compact."""
+        s = self.store
+        sqlite = isinstance(s, SqliteStore)
+        # written and applied under the lock, so every reader sees both or neither
+        with self.lock, (s.applying() if sqlite else nullcontext()):
+            if self.writer:
+                self.writer.submit(recs)
+            else:
+                recs = self.storage.append_many(recs)
+            if sqlite:
+                s.applied += len(recs)  # what they change stays in memory until that many are written
+            self._views.clear()
+            if len(recs) > REINDEX_BATCH:
+                self._search = None  # cheaper to rebuild on the next search than to patch row by row
+            for rec in recs:
+                apply_record(s, rec, self.loans)
+            for rec in (sub for rec in recs for sub in (rec["recs"] if rec["op"] == "batch" else (rec,))):
+                if rec["op"] not in ("book_put", "book_del"):
+                    continue
+                if self._search is None:
+                    if self._index_backlog is not None:
+                        self._index_backlog.append(rec)
+                elif rec["op"] == "book_put":
+                    self._search.add(rec["title"], rec["book"].get("author", ""))
+                else:
+                    self._search.remove(rec["title"])
+        return recs
+
+    def compact(self, timeout=CLOSE_TIMEOUT):
+        """Fold the journal into a fresh snapshot (no-op if nothing was loaded).
+
+        The snapshot is stamped with the last written seq, so records the
+        background writer still holds are written first; otherwise they would
+        be in the snapshot and replayed over it again.
+        """
+        if self._store is None:
+            return
+        with self.lock:  # nothing new is committed between the flush and the snapshot
+            if self.writer and not self.writer.flush(timeout):
+                raise StorageError("Some changes could not be saved.")
+            if self.storage.pending:
+                self.storage.compact(self._store)
+
+    def flush(self, timeout=None):
+        """Block until every committed operation is on disk; False on timeout."""
+        return self.writer.flush(timeout) if self.writer else True
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        if self.writer and not self.writer.close(timeout):
+            raise StorageError("Some changes could not be saved.")
+        self.compact()
+        self.storage.close()
+
+    # ----- catalog -----
+    def _book_data(self, title):
+        d = self.store["books"].get(title)
+        if d is None:
+            raise NotFound("Book not found.")
+        return d
+
+    def _as_book(self, title, d):
+        return _book(title, d, self.loans.holds.by_book.get(title, {}).values())
+
+    def get_book(self, title):
+        return self._as_book(title, self._book_data(title))
+
+    @instrument("books")
+    def books(self):
+        return [self._as_book(t, d) for t, d in self.store["books"].items()]
+
+    @instrument("add_book")
+    def add_book(self, title, author="", qty=0):
+        title = _text(title, "Title")
+        author = _text(author, "Author") or "Unknown"
+        if not title:
+            raise ValidationError("Title required.")
+        book = dict(self.store["books"].get(title) or {"author": author, "qty": 0})
+        book["qty"] += int(qty)
+        self._commit_many(self._book_records({title: book}))
+        self._compact_after_bulk()
+        return self.get_book(title)
+
+    @instrument("remove_book")
+    def remove_book(self, title):
+        title = _text(title, "Title")
+        if not title or title not in self.store["books"]:
+            raise NotFound("Book not found.")
+        if self.loans.for_book(title):
+            raise Conflict("Book currently issued; cannot remove.")
+        removed = self._as_book(title, self.store["books"][title])
+        self._commit({"op": "book_del", "title": title})
+        return removed
+
+    @instrument("update_book")
+    def update_book(self, title, author="", qty=None):
+        title = _text(title, "Title")
+        d = self._book_data(title)
+        book = dict(d, author=_text(author, "Author") or d["author"], qty=int(d["qty"] if qty is None else qty))
+        self._commit_many(self._book_records({title: book}))
+        self._compact_after_bulk()
+        return self.get_book(title)
+
+    def _book_records(self, books):
+        """book_put records for {title: book}, then copies set aside for anyone
+        waiting on a title whose shelf they restock."""
+        recs = [{"op": "book_put", "title": t, "book": b} for t, b in books.items()]
+        queued = [t for t in books if t in self.loans.holds.by_book]
+        if queued:
+            recs += self._settle_records(queued, datetime.now(), set(), {t: books[t]["qty"] for t in queued})
+        return recs
+
+    @instrument("prepare_search")
+    def prepare_search(self):
+        """Build the search index now rather than on the first search.
+
+        Only copying the catalog holds the lock; the index itself is built
+        without it and then caught up with the changes made meanwhile, so a
+        background thread can call this without stalling writers. A caller
+        that finds another thread building waits for that build.
+        """
+        books = self.store["books"]
+        if isinstance(books, SqliteTable) and self.storage.fts:
+            return  # searched in the database
+        with self.lock:
+            while self._index_backlog is not None:
+                self._index_built.wait()
+            if self._search is not None:
+                return
+            items = [(t, d.get("author", "")) for t, d in books.items()]
+            self._index_backlog = []
+        idx = None
+        try:
+            built = SearchIndex()
+            for title, author in items:
+                built.add(title, author)
+            idx = built
+        finally:
+            with self.lock:
+                backlog, self._index_backlog = self._index_backlog, None
+                if idx is not None and self._search is None:
+                    for rec in backlog:
+                        if rec["op"] == "book_put":
+                            idx.add(rec["title"], rec["book"].get("author", ""))
+                        else:
+                            idx.remove(rec["title"])
+                    self._search = idx
+                self._index_built.notify_all()
+
+    def _search_titles(self, q, limit=None):
+        """(titles best match first, total) for q. The lock is held only while the
+        candidates are taken; filtering and ranking run without it."""
+        q = q.strip().lower()
+        s = self.store
+        if isinstance(s, SqliteStore):
+            candidates = s.book_candidates(q)
+            if candidates is not None:
+                return SearchIndex.rank(candidates, q, limit)
+        while True:
+            self.prepare_search()  # built off the lock; a no-op once there
+            with self.lock:
+                if self._search is not None:  # else a big commit dropped it meanwhile
+                    candidates = self._search.candidates(q)
+                    break
+        return SearchIndex.rank(candidates, q, limit)
+
+    @instrument("search")
+    def search(self, q, limit=SEARCH_LIMIT):
+        if not _text(q, "Query"):
+            raise ValidationError("Enter search query.")
+        titles, total = self._search_titles(q, limit)
+        books = self.store["books"]
+        with self.lock:
+            # a title removed since ranking is left out
+            return SearchResult([self._as_book(t, books[t]) for t in titles if t in books], total)
+
+    # ----- users -----
+    def has_user(self, name):
+        return name in self.store["users"]
+
+    def _user(self, name):
+        meta = self.store["users"][name]
+        return User(name, meta.get("registered_on"), meta.get("loans", 0),
+                    len(self.loans.by_user.get(name, ())))
+
+    @instrument("users")
+    def users(self):
+        return [self._user(n) for n in self.store["users"]]
+
+    @instrument("register_user")
+    def register_user(self, name):
+        name = _text(name, "Name")
+        if not name:
+            raise ValidationError("Name required.")
+        if name in self.store["users"]:
+            raise Conflict("User exists.")
+        self._commit({"op": "user_add", "name": name, "registered_on": datetime.now().isoformat()})
+        return self._user(name)
+
+    def ensure_user(self, name):
+        """Register name if it is new; returns True when it was added."""
+        if self.has_user(name):
+            return False
+        self.register_user(name)
+        return True
+
+    @instrument("delete_user")
+    def delete_user(self, name):
+        name = _text(name, "Name")
+        if name not in self.store["users"]:
+            raise NotFound("User not found.")
+        if self.loans.for_user(name):
+            raise Conflict("User has issued books; can't delete.")
+        removed = self._user(name)
+        # copies set aside for this user's holds go to the next in line
+        now, taken = datetime.now(), set()
+        recs = [self._cancel_record(h, now, taken) for h in self.loans.holds.for_user(name)]
+        self._commit_many(recs + [{"op": "user_del", "name": name}])
+        self._compact_after_bulk()
+        return removed
+
+    @instrument("rename_user")
+    def rename_user(self, old, new):
+        old, new = _text(old, "Name"), _text(new, "New name")
+        if old not in self.store["users"]:
+            raise NotFound("User not found.")
+        if not new:
+            raise ValidationError("New name required.")
+        if new in self.store["users"]:
+            raise Conflict("User exists.")
+        # also moves open loans and holds; returned loans are found through the rename
+        self._commit({"op": "user_rename", "old": old, "new": new, "at": datetime.now().isoformat()})
+        return self._user(new)
+
+    # ----- circulation -----
+    @instrument("issue")
+    def issue(self, user, book, days=DEFAULT_LOAN_DAYS):
+        user, book = _text(user, "User"), _text(book, "Book")
+        if user not in self.store["users"]:
+            raise NotFound("User not registered.")
+        self._book_data(book)
+        self._settle_holds([book])
+        d = self._book_data(book)
+        # a copy set aside for this user's hold does not need a shelf copy
+        hold = self.loans.holds.find(user, book)
+        if not (hold and hold.get("expires")) and d.get("qty", 0) <= 0:
+            if any(h.get("expires") for h in self.loans.holds.queue(book)):
+                raise Unavailable("All available copies are held for reservations.")
+            raise Unavailable("No copies available.")
+        now = datetime.now()
+        with self.lock:  # the id is only taken once the record is applied
+            tx = {"id": self.store["next_tx_id"], "user": user, "book": book,
+                  "issued_on": now.isoformat(),
+                  "due_date": (now + timedelta(days=int(days))).isoformat(),
+                  "returned": False}
+            rec = {"op": "issue", "tx": tx}
+            if hold:
+                rec["hold"] = hold["id"]
+            self._commit(rec)
+        return _loan(tx)
+
+    @instrument("return_book")
+    def return_book(self, user, book):
+        user, book = _text(user, "User"), _text(book, "Book")
+        self.load()
+        # latest open loan of this book to this user
+        matching = [tx for tx in self.loans.for_user(user) if tx["book"] == book]
+        if not matching:
+            raise NotFound("No matching issued record found.")
+        tx = max(matching, key=lambda t: t["id"])
+        now = datetime.now()
+        rec = {"op": "return", "id": tx["id"], "returned_on": now.isoformat()}
+        holds = self.loans.holds
+        nxt = holds.next_waiting(book)
+        if nxt is not None:
+            # the copy goes to the head of the queue instead of the shelf
+            rec.update(to=nxt["id"], expires=(now + timedelta(days=HOLD_DAYS)).isoformat())
+        self._commit(rec)
+        return _loan(tx, held_for=_hold(nxt, holds.position(nxt)) if nxt is not None else None)
+
+    @instrument("circulate")
+    def circulate(self, ops, days=DEFAULT_LOAN_DAYS):
+        """Issue and return many books as one all-or-nothing batch.
+
+        ops are (action, user, book) with action "issue" or "return". Each is
+        checked the way issue() / return_book() would check it, against the
+        state the items before it leave behind. If all pass, every record is
+        committed as one batch record, replayed whole or not at all; otherwise
+        nothing is, and the report's items say which failed and why.
+        """
+        try:
+            ops = [(str(a).strip().lower(), str(u).strip(), str(b).strip()) for a, u, b in ops]
+        except (TypeError, ValueError):
+            raise ValidationError("Each operation needs an action, a user and a book.") from None
+        self.load()
+        s, holds = self.store, self.loans.holds
+        now = datetime.now()
+        with self.lock:
+            shelf = {}        # title -> shelf copies left after the items so far
+            opened = {}       # (user, book) -> txs issued earlier in the batch
+            closed = set()    # tx ids returned earlier in the batch
+            given = set()     # hold ids a returned or shelf copy was set aside for
+            # held copies past their time move on first, as issue() does, in the same batch
+            settle = self._settle_records(dict.fromkeys(b for a, _, b in ops if a == "issue"), now, given, shelf)
+            consumed = {rec["id"] for rec in settle if rec["op"] == "hold_cancel"}  # hold ids issued against or run out
+            next_id = s["next_tx_id"]
+            recs, results = [], []
+            for action, user, book in ops:
+                try:
+                    if action == "issue":
+                        if user not in s["users"]:
+                            raise NotFound("User not registered.")
+                        d = self._book_data(book)
+                        hold = holds.find(user, book)
+                        if hold is not None and hold["id"] in consumed:
+                            hold = None
+                        if not (hold and (hold.get("expires") or hold["id"] in given)):
+                            if shelf.get(book, d.get("qty", 0)) <= 0:
+                                if any(h.get("expires") or h["id"] in given for h in holds.queue(book)
+                                       if h["id"] not in consumed):
+                                    raise Unavailable("All available copies are held for reservations.")
+                                raise Unavailable("No copies available.")
+                            shelf[book] = shelf.get(book, d.get("qty", 0)) - 1
+                        tx = {"id": next_id, "user": user, "book": book, "issued_on": now.isoformat(),
+                              "due_date": (now + timedelta(days=int(days))).isoformat(), "returned": False}
+                        next_id += 1
+                        rec = {"op": "issue", "tx": tx}
+                        if hold:
+                            rec["hold"] = hold["id"]
+                            consumed.add(hold["id"])
+                        opened.setdefault((user, book), []).append(tx)
+                        loan = _loan(tx)
+                    elif action == "return":
+                        matching = [tx for tx in self.loans.for_user(user) + opened.get((user, book), [])
+                                    if tx["book"] == book and tx["id"] not in closed]
+                        if not matching:
+                            raise NotFound("No matching issued record found.")
+                        tx = max(matching, key=lambda t: t["id"])
+                        closed.add(tx["id"])
+                        rec = {"op": "return", "id": tx["id"], "returned_on": now.isoformat()}
+                        nxt = holds.next_waiting(book, consumed | given)
+                        held = None
+                        if nxt is not None:
+                            rec.update(to=nxt["id"], expires=(now + timedelta(days=HOLD_DAYS)).isoformat())
+                            given.add(nxt["id"])
+                            held = _hold(dict(nxt, expires=rec["expires"]), holds.position(nxt))
+                        elif book in s["books"]:
+                            shelf[book] = shelf.get(book, s["books"][book].get("qty", 0)) + 1
+                        loan = _loan(dict(tx, returned=True, returned_on=rec["returned_on"]), held_for=held)
+                    else:
+                        raise ValidationError("Action must be 'issue' or 'return'.")
+                except LibraryError as e:
+                    results.append((action, user, book, None, str(e)))
+                    continue
+                recs.append(rec)
+                results.append((action, user, book, loan, None))
+            applied = len(recs) == len(ops)
+            if applied and recs:
+                self._commit_many([{"op": "batch", "recs": settle + recs}])
+        if applied:
+            self._compact_after_bulk()
+        return BatchReport(applied, [BatchItem(a, u, b, error is None, loan if applied else None, error)
+                                     for a, u, b, loan, error in results])
+
+    # ----- reservations -----
+    def _cancel_record(self, hold, now, taken):
+        """hold_cancel record; an allocated copy moves to the next waiting hold not in taken."""
+        rec = {"op": "hold_cancel", "id": hold["id"]}
+        if hold.get("expires"):
+            nxt = self.loans.holds.next_waiting(hold["book"], taken)
+            if nxt is not None:
+                taken.add(nxt["id"])
+                rec.update(to=nxt["id"], expires=(now + timedelta(days=HOLD_DAYS)).isoformat())
+        return rec
+
+    def _settle_records(self, titles, now, taken, shelf):
+        """Records that release run-out holds on titles and set shelf copies aside
+        for waiting holds, oldest first.
+
+        taken: ids of holds already given a copy by the records this goes with;
+        shelf: title -> shelf copies as those records leave it (updated here).
+        """
+        books, holds, cutoff = self.store["books"], self.loans.holds, now.isoformat()
+        recs = []
+        for title in titles:
+            if title not in books:
+                continue
+            qty = shelf.get(title, books[title].get("qty", 0))
+            for hold in holds.queue(title):
+                if hold.get("expires") and hold["expires"] <= cutoff:
+                    rec = self._cancel_record(hold, now, taken)
+                    recs.append(rec)
+                    qty += "to" not in rec  # nobody waiting: back on the shelf
+            while qty > 0:
+                nxt = holds.next_waiting(title, taken)
+                if nxt is None:
+                    break
+                taken.add(nxt["id"])
+                qty -= 1
+                recs.append({"op": "hold_allocate", "id": nxt["id"],
+                             "expires": (now + timedelta(days=HOLD_DAYS)).isoformat()})
+            shelf[title] = qty
+        return recs
+
+    def _settle_holds(self, titles, now=None):
+        """Commit _settle_records() for titles; returns the number of holds released."""
+        recs = self._settle_records(titles, now or datetime.now(), set(), {})
+        if recs:
+            self._commit_many(recs)
+            self._compact_after_bulk()
+        return sum(rec["op"] == "hold_cancel" for rec in recs)
+
+    def expired_holds(self, now=None):
+        """Holds whose set-aside copy has run out but is not released yet, soonest first."""
+        self.load()
+        return [_hold(h) for h in self.loans.holds.expired((now or datetime.now()).isoformat())]
+
+    @instrument("expire_holds")
+    def expire_holds(self, now=None):
+        """Release copies whose hold ran out to the next in line (or the shelf).
+
+        Holds are also expired lazily whenever their book is issued or
+        reserved. This settles the titles of every run-out hold, found
+        through the expiry index, so a sweep with nothing to do costs a
+        bisect. Returns the number released.
+        """
+        self.load()
+        now = now or datetime.now()
+        titles = dict.fromkeys(h["book"] for h in self.loans.holds.expired(now.isoformat()))
+        return self._settle_holds(list(titles), now) if titles else 0
+
+    @instrument("reserve")
+    def reserve(self, user, book):
+        """Join the book's queue. With a copy on the shelf and nobody waiting,
+        the copy is set aside for the user straight away."""
+        user, book = _text(user, "User"), _text(book, "Book")
+        if user not in self.store["users"]:
+            raise NotFound("User not found.")
+        self._book_data(book)
+        holds = self.loans.holds
+        self._settle_holds([book])
+        if holds.find(user, book):
+            raise Conflict("Already reserved.")
+        now = datetime.now()
+        with self.lock:
+            hold = {"id": self.store.get("next_hold_id", 1), "user": user, "book": book, "placed_on": now.isoformat()}
+            if self._book_data(book).get("qty", 0) > 0 and holds.next_waiting(book) is None:
+                hold["expires"] = (now + timedelta(days=HOLD_DAYS)).isoformat()
+            self._commit({"op": "hold_add", "hold": hold})
+            return _hold(hold, len(holds.by_book[book]))
+
+    @instrument("cancel_reservation")
+    def cancel_reservation(self, user, book):
+        user, book = _text(user, "User"), _text(book, "Book")
+        self.load()
+        hold = self.loans.holds.find(user, book)
+        if hold is None:
+            raise NotFound("No reservation found.")
+        self._commit(self._cancel_record(hold, datetime.now(), set()))
+        return _hold(hold)
+
+    def reservations(self, user=None, book=None):
+        """Holds of a user, or a book's queue in order, as Hold results."""
+        self.load()
+        holds = self.loans.holds
+        if book is not None:
+            return [_hold(h, i) for i, h in enumerate(holds.queue(_text(book, "Book")), 1)]
+        return [_hold(h, holds.position(h)) for h in holds.for_user(_text(user or "", "User"))]
+
+    # ----- bulk -----
+    @instrument("import_books")
+    def import_books(self, rows, batch_size=IMPORT_BATCH):
+        """Merge book rows (title, author, qty) the way add_book does, one commit per batch."""
+        report = ImportReport()
+        books = self.store["books"]
+        pending = {}
+        for n, row in enumerate(rows, 1):
+            title = str(row.get("title") or "").strip()
+            if not title:
+                report.error(n, "Title required.")
+                continue
+            try:
+                qty = int(row.get("qty") or 0)
+            except (TypeError, ValueError):
+                report.error(n, "Quantity needs a number.")
+                continue
+            if title in books or title in pending:
+                report.merged += 1
+            else:
+                report.added += 1
+            book = pending.get(title)
+            if book is None:
+                current = books.get(title)
+                if current is None:
+                    author = str(row.get("author") or "").strip() or "Unknown"
+                    book = {"author": author, "qty": 0}
+                else:
+                    book = dict(current)
+                pending[title] = book
+            book["qty"] += qty
+            if len(pending) >= batch_size:
+                self._commit_many(self._book_records(pending))
+                pending.clear()
+        if pending:
+            self._commit_many(self._book_records(pending))
+        self._compact_after_bulk()
+        return report
+
+    @instrument("import_users")
+    def import_users(self, rows, batch_size=IMPORT_BATCH):
+        """Register user rows (name, optional registered_on); existing names are skipped."""
+        report = ImportReport()
+        users = self.store["users"]
+        pending = {}
+        now = datetime.now().isoformat()
+        for n, row in enumerate(rows, 1):
+            name = str(row.get("name") or "").strip()
+            if not name:
+                report.error(n, "Name required.")
+                continue
+            if name in users or name in pending:
+                report.skipped += 1
+                continue
+            pending[name] = {"op": "user_add", "name": name, "registered_on": row.get("registered_on") or now}
+            report.added += 1
+            if len(pending) >= batch_size:
+                self._commit_many(list(pending.values()))
+                pending.clear()
+        if pending:
+            self._commit_many(list(pending.values()))
+        self._compact_after_bulk()
+        return report
+
+    def _compact_after_bulk(self):
+        # imports skip per-batch compaction; fold the whole journal once at the end
+        if self.writer is None and self.storage.pending >= COMPACT_EVERY:
+            self.compact()
+
+    def export_rows(self, kind):
+        """Generator over 'books', 'users' or 'loans' (full history) as flat dicts."""
+        s = self.store
+        if kind == "books":
+            for t, d in s["books"].items():
+                yield {"title": t, "author": d.get("author", ""), "qty": d.get("qty", 0)}
+        elif kind == "users":
+            for name, meta in s["users"].items():
+                yield dict(meta, name=name)
+        elif kind == "loans":
+            # archived loans first; after an interrupted archive run a loan can be in both
+            hot_ids = {tx["id"] for tx in s["issued"]}
+            for tx in self.archive.read():
+                if tx["id"] not in hot_ids:
+                    yield tx
+            yield from s["issued"]
+        else:
+            raise ValidationError(f"Unknown export '{kind}' (books, users or loans).")
+
+    @instrument("export")
+    def export(self, kind, f, fmt):
+        if kind not in EXPORT_FIELDS:
+            raise ValidationError(f"Unknown export '{kind}' (books, users or loans).")
+        return write_rows(self.export_rows(kind), f, fmt, EXPORT_FIELDS[kind])
+
+    def import_file(self, kind, path):
+        importer = {"books": self.import_books, "users": self.import_users}.get(kind)
+        if importer is None:
+            raise ValidationError(f"Unknown import '{kind}' (books or users).")
+        fmt = file_format(path)
+        try:
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                return importer(read_rows(f, fmt))
+        except OSError as e:
+            raise NotFound(f"Could not read {path}: {e}") from e
+
+    def export_file(self, kind, path):
+        fmt = file_format(path)
+        try:
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                return self.export(kind, f, fmt)
+        except OSError as e:
+            raise StorageError(f"Could not write {path}: {e}") from e
+
+    # ----- paged views -----
+    def _view_source(self, kind):
+        s = self.store
+        if kind == "books":
+            return s["books"]
+        if kind == "users":
+            return s["users"]
+        if kind == "loans":
+            return self.loans.by_id  # active loans
+        raise ValidationError(f"Unknown view '{kind}'.")
+
+    def _view_row(self, kind, key, value):
+        if kind == "books":
+            return self._as_book(key, value)
+        if kind == "users":
+            return self._user(key)
+        return _loan(value)
+
+    def _view_keys(self, kind, src, sort, descending, filter):
+        cache_key = (kind, sort, descending, filter)
+        keys = self._views.get(cache_key)
+        if keys is not None:
+            return keys
+        if not filter:
+            keys = list(src)
+        elif kind == "books":
+            keys = self._search_titles(filter)[0]
+        elif kind == "users":
+            keys = [n for n in src if filter in n.lower()]
+        else:
+            keys = [i for i, tx in src.items() if filter in tx["user"].lower() or filter in tx["book"].lower()]
+        if sort:
+            key_fn = VIEW_SORTS[kind].get(sort)
+            if key_fn is None:
+                raise ValidationError(f"Cannot sort {kind} by '{sort}'.")
+            if isinstance(src, SqliteTable):
+                src = dict(src.items())  # one scan rather than a query per key
+            keys.sort(key=lambda k: key_fn(k, src[k]), reverse=descending)
+        elif descending:
+            keys.reverse()
+        if len(self._views) >= MAX_CACHED_VIEWS:
+            self._views.clear()
+        self._views[cache_key] = keys
+        return keys
+
+    @instrument("page")
+    def page(self, kind, offset=0, limit=50, sort=None, descending=False, filter=""):
+        """One page of 'books', 'users', active 'loans' or 'overdue' loans.
+
+        Unsorted, unfiltered pages are sliced straight out of the store, so the
+        first page costs the same at any size; other orders are computed once
+        and cached until the next commit.
+        """
+        filter = _text(filter, "Filter").lower()
+        offset = max(0, offset)
+        if kind == "overdue":
+            return self._overdue_page(offset, limit, descending, filter)
+        src = self._view_source(kind)
+        if not sort and not filter:
+            if isinstance(src, SqliteTable):
+                keys = src.keys_at(offset, limit, descending)
+            else:
+                keys = list(islice(reversed(src) if descending else iter(src), offset, offset + limit))
+            total = len(src)
+        else:
+            ordered = self._view_keys(kind, src, sort, descending, filter)
+            keys, total = ordered[offset:offset + limit], len(ordered)
+        return Page([self._view_row(kind, k, src[k]) for k in keys], total, offset)
+
+    def _overdue_page(self, offset, limit, descending, filter):
+        # most overdue first; the due-date index makes this O(log n + page)
+        self.load()
+        now = datetime.now().isoformat()
+        by_id = self.loans.by_id
+        count = self.loans.overdue_count(now)
+        if filter:
+            entries = [e for e in self.loans.by_due[:count]
+                       if filter in by_id[e[1]]["user"].lower() or filter in by_id[e[1]]["book"].lower()]
+            count = len(entries)
+        else:
+            entries = self.loans.by_due
+        if descending:
+            window = entries[max(0, count - offset - limit):max(0, count - offset)][::-1]
+        else:
+            window = entries[offset:min(count, offset + limit)]
+        return Page([_loan(by_id[i], now) for _, i in window], count, offset)
+
+    @instrument("overdue")
+    def overdue(self, now=None):
+        """Every overdue loan, most overdue first, with its fine so far."""
+        self.load()
+        now = now or datetime.now().isoformat()
+        return [_loan(self.loans.by_id[i], now) for _, i in self.loans.due_between(None, now)]
+
+    def newly_overdue(self, since, now=None):
+        """Loans that fell due after `since` and by `now`; returns (loans, now).
+
+        Pass the returned `now` as the next `since` to see each loan once.
+        """
+        self.load()
+        now = now or datetime.now().isoformat()
+        return [_loan(self.loans.by_id[i], now) for _, i in self.loans.due_between(since, now)], now
+
+    # ----- history -----
+    @instrument("archive")
+    def archive_returned(self, older_than_days=ARCHIVE_AFTER_DAYS, now=None):
+        """Move loans returned more than older_than_days ago to the history archive.
+
+        The segments are written before the journal record that drops the
+        loans from the store, so a crash in between leaves them in both places
+        until the next run. Returns the number of loans moved.
+        """
+        s = self.store
+        cutoff = ((now or datetime.now()) - timedelta(days=older_than_days)).isoformat()
+        if isinstance(s, SnapshotStore) and not s.returns_before(cutoff):
+            return 0  # answered from the snapshot without reading the loan history
+        if isinstance(s, SqliteStore):
+            old = s["issued"].returned_before(cutoff)
+        else:
+            old = [tx for tx in s["issued"]
+                   if tx.get("returned", False) and (tx.get("returned_on") or tx["issued_on"]) < cutoff]
+        if not old:
+            return 0
+        self.archive.append(old)
+        self._commit_many([{"op": "archive", "ids": [tx["id"] for tx in old]}])
+        if self.writer is None:
+            try:
+                self.compact()  # the point is a smaller snapshot, so fold right away
+            except StorageError:
+                pass  # the archive record is in the journal; folded on a later compaction
+        return len(old)
+
+    def _name_spans(self, name):
+        """(name, returned after, returned before) for user name and each name they had earlier."""
+        spans, cur, hi, lo = [], name, None, ""
+        for old, new, at in reversed(self.store.get("renames", [])):
+            if new == cur:
+                spans.append((cur, at, hi))
+                cur, hi = old, at
+            elif old == cur:
+                lo = at  # an earlier user of this name was renamed away before ours registered
+                break
+        spans.append((cur, lo, hi))
+        return spans
+
+    def history(self, user=None, book=None):
+        """Every loan of a user and/or book, archived ones first, as a stream of Loans.
+
+        Archive segments are read one line at a time, so the full history is
+        never in memory. Returned loans of a renamed user are found under the
+        names they were returned under.
+        """
+        user = _text(user or "", "User") or None
+        book = _text(book or "", "Book") or None
+        if user is None and book is None:
+            raise ValidationError("Enter a user or a book.")
+        self.load()
+        return self._history(user, book)
+
+    def _history(self, user, book):
+        spans = self._name_spans(user) if user else None
+        needle = book if book or len(spans) > 1 else user
+        seen = set()
+        for tx in self.archive.read(needle):
+            if (book is None or tx["book"] == book) and (spans is None or _held_by(tx, user, spans)):
+                seen.add(tx["id"])
+                yield _loan(tx)
+        now = datetime.now().isoformat()
+        issued = self.store["issued"]
+        if isinstance(issued, SqliteLoans):
+            names = dict.fromkeys(n for n, _, _ in spans) if spans else (None,)
+            issued = heapq.merge(*(issued.matching(n, book) for n in names), key=lambda tx: tx["id"])
+        for tx in issued:
+            if tx["id"] not in seen and (book is None or tx["book"] == book) and (spans is None or _held_by(tx, user, spans)):
+                yield _loan(tx, now)
+
+    @instrument("active_loans")
+    def active_loans(self):
+        self.load()
+        now = datetime.now().isoformat()
+        return [_loan(tx, now) for tx in sorted(self.loans.by_id.values(), key=lambda t: t["id"])]
@@ -1,476 +1,1063 @@
-# library_animated_persistent.py
-# Single-file animated Library Management System with JSON persistence
-# Requires Python 3.x (Tkinter included)
-
-import tkinter as tk
-from tkinter import messagebox
-import json
-import os
-from datetime import datetime, timedelta
-
-# ---------- Persistence ----------
-DATA_FILE = "library_data.json"
-
-def make_empty_store():
-    return {"books": {}, "users": [], "issued": []}
-
-def load_store():
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            return make_empty_store()
-    return make_empty_store()
-
-def save_store():
-    try:
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(store, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        messagebox.showerror("Save error", f"Could not save data: {e}")
-
-store = load_store()  # store: { books: {title: {author, qty, reserved:list}}, users: [name], issued: [txs] }
-
-# ---------- Basic config + colors ----------
-APP_BG = "#071229"
-CARD_COLORS = ["#10b981", "#ef4444", "#3b82f6", "#8b5cf6", "#f59e0b", "#6366f1",
-               "#ec4899", "#06b6d4", "#7c3aed", "#0891b2", "#16a34a", "#fb923c"]
-TITLE_FONT = ("Inter", 22, "bold")
-ENTRY_FONT = ("Inter", 13)
-
-# ---------- Tk root ----------
-root = tk.Tk()
-root.title("Library — Persistent Animated UI")
-root.geometry("1100x700")
-root.minsize(900, 600)
-root.configure(bg=APP_BG)
-
-current_user = {"name": ""}
-
-# Frames
-welcome_frame = tk.Frame(root, bg=APP_BG)
-dashboard_frame = tk.Frame(root, bg=APP_BG)
-overlay_frame = tk.Frame(root, bg=APP_BG)  # slide-in overlay for full-screen forms
-welcome_frame.place(relx=0, rely=0, relwidth=1, relheight=1)
-
-# ---------- Animation helper ----------
-def slide_widget(widget, start_rel_y, end_rel_y, steps=16, delay=16):
-    # place widget with variable rely
-    def step(i):
-        frac = i / steps
-        y = start_rel_y + (end_rel_y - start_rel_y) * frac
-        widget.place(relx=0, rely=y, relwidth=1, relheight=1)
-        if i < steps:
-            widget.after(delay, lambda: step(i+1))
-    step(0)
-
-# ---------- Styled button helper ----------
-def styled_button(parent, text, bg="#2b6cb0", command=None):
-    b = tk.Button(parent, text=text, bg=bg, fg="white", font=("Inter", 11, "bold"),
-                  bd=0, relief="flat", command=command)
-    def on_enter(e):
-        b.config(bg="#0ea5a4")
-    def on_leave(e, color=bg):
-        b.config(bg=color)
-    b.bind("<Enter>", on_enter); b.bind("<Leave>", on_leave)
-    return b
-
-# ---------- Welcome Screen ----------
-def build_welcome():
-    for w in welcome_frame.winfo_children():
-        w.destroy()
-    # background blocks
-    c = tk.Canvas(welcome_frame, highlightthickness=0, bg=APP_BG)
-    c.place(relx=0, rely=0, relwidth=1, relheight=1)
-    wwidth = root.winfo_width() or 1100
-    wheight= root.winfo_height() or 700
-    for i in range(0, 12):
-        color = "#0b3a50" if i % 2 == 0 else APP_BG
-        c.create_rectangle(0, i*(wheight/12), wwidth, (i+1)*(wheight/12), outline=color, fill=color)
-    # card
-    card = tk.Frame(welcome_frame, bg="white")
-    card.place(relx=0.5, rely=0.45, anchor="center", width=640, height=320)
-    tk.Label(card, text="Welcome to the Library", font=TITLE_FONT, bg="white", fg="#0b1220").pack(pady=(18,8))
-    tk.Label(card, text="Enter your name to continue", font=("Inter", 11), bg="white", fg="#475569").pack(pady=(0,14))
-    name_var = tk.StringVar()
-    entry = tk.Entry(card, font=ENTRY_FONT, textvariable=name_var, justify="center", bd=1, relief="solid")
-    entry.pack(ipady=10, ipadx=10, pady=8)
-    entry.focus_set()
-    def on_continue():
-        name = name_var.get().strip()
-        if not name:
-            messagebox.showwarning("Name required", "Please enter your name to continue.")
-            return
-        current_user["name"] = name
-        # auto-register if new
-        if name not in store.get("users", []):
-            store.setdefault("users", []).append(name)
-            save_store()
-        slide_out_welcome_and_show_dashboard()
-    btn = styled_button(card, "Continue", bg="#06b6d4", command=on_continue)
-    btn.pack(pady=12, ipadx=8, ipady=6)
-    tk.Label(card, text="Data saved to 'library_data.json' automatically.", font=("Inter", 9), bg="white", fg="#94a3b8").pack(side="bottom", pady=10)
-
-def slide_out_welcome_and_show_dashboard():
-    dashboard_frame.place(relx=0, rely=1, relwidth=1, relheight=1)
-    build_dashboard()
-    slide_widget(dashboard_frame, start_rel_y=1.0, end_rel_y=0.0, steps=16, delay=18)
-    # hide welcome after small delay
-    def hide():
-        welcome_frame.place_forget()
-    root.after(350, hide)
-
-# ---------- Overlay form helper ----------
-def show_overlay_form(title, fields, submit_callback, initial_values=None):
-    """
-    fields: list of tuples (label, key, type) where type in {'str','int','days'} (type optional)
-    submit_callback receives dict key->value
-    """
-    for w in overlay_frame.winfo_children():
-        w.destroy()
-    overlay_frame.place(relx=0, rely=1, relwidth=1, relheight=1)
-    overlay_frame.configure(bg="#071029")
-    card = tk.Frame(overlay_frame, bg="#0b1220")
-    card.place(relx=0.5, rely=0.5, anchor="center", width=900, height=600)
-    tk.Label(card, text=title, font=TITLE_FONT, bg="#0b1220", fg="white").pack(pady=(18,10))
-    form_area = tk.Frame(card, bg="#0b1220")
-    form_area.pack(expand=True, fill="both", padx=24, pady=6)
-    entries = {}
-    for field in fields:
-        label, key = field[0], field[1]
-        typ = field[2] if len(field) > 2 else 'str'
-        row = tk.Frame(form_area, bg="#0b1220")
-        row.pack(fill="x", pady=8)
-        tk.Label(row, text=label, bg="#0b1220", fg="#cbd5e1", font=("Inter", 11)).pack(side="left", padx=(4,12))
-        ent = tk.Entry(row, font=ENTRY_FONT, width=36, bd=0, relief="solid")
-        ent.pack(side="left", padx=6)
-        if initial_values and key in initial_values:
-            ent.insert(0, str(initial_values[key]))
-        entries[key] = (ent, typ)
-    ctrl = tk.Frame(card, bg="#0b1220")
-    ctrl.pack(pady=10)
-    def on_submit():
-        vals = {}
-        for k, (ent, typ) in entries.items():
-            v = ent.get().strip()
-            if typ in ('int','days'):
-                try:
-                    vals[k] = int(v)
-                except:
-                    messagebox.showerror("Invalid", f"Field '{k}' needs a number.")
-                    return
-            else:
-                vals[k] = v
-        submit_callback(vals)
-        slide_out_overlay()
-    styled_button(ctrl, "Submit", bg="#06b6d4", command=on_submit).pack(side="left", padx=12)
-    styled_button(ctrl, "Cancel", bg="#ef4444", command=slide_out_overlay).pack(side="left", padx=12)
-    slide_widget(overlay_frame, start_rel_y=1.0, end_rel_y=0.0, steps=16, delay=16)
-
-def slide_out_overlay():
-    slide_widget(overlay_frame, start_rel_y=0.0, end_rel_y=1.0, steps=16, delay=16)
-    def hide():
-        overlay_frame.place_forget()
-    overlay_frame.after(350, hide)
-
-# ---------- Feature implementations (all 12) ----------
-def add_book_action(vals):
-    title = vals.get("title","").strip()
-    author = vals.get("author","").strip() or "Unknown"
-    qty = vals.get("qty",0)
-    if not title:
-        messagebox.showerror("Validation", "Title required.")
-        return
-    store.setdefault("books", {})
-    store["books"].setdefault(title, {"author": author, "qty":0, "reserved":[]})
-    store["books"][title]["qty"] += int(qty)
-    save_store()
-    messagebox.showinfo("Added", f"'{title}' added ({qty}).")
-
-def add_book():
-    fields = [("Title", "title"), ("Author", "author"), ("Quantity", "qty", "int")]
-    show_overlay_form("Add Book", fields, add_book_action)
-
-def remove_book_action(vals):
-    title = vals.get("title","").strip()
-    if not title or title not in store.get("books", {}):
-        messagebox.showerror("Error", "Book not found.")
-        return
-    # prevent if issued
-    for tx in store.get("issued", []):
-        if tx["book"] == title and not tx.get("returned", False):
-            messagebox.showerror("Error", "Book currently issued; cannot remove.")
-            return
-    del store["books"][title]
-    save_store()
-    messagebox.showinfo("Removed", f"'{title}' removed.")
-
-def remove_book():
-    show_overlay_form("Remove Book", [("Title", "title")], remove_book_action)
-
-def update_book_action(vals):
-    title = vals.get("title","").strip()
-    if title not in store.get("books", {}):
-        messagebox.showerror("Error", "Book not found.")
-        return
-    author = vals.get("author","").strip() or store["books"][title]["author"]
-    qty = vals.get("qty", store["books"][title]["qty"])
-    store["books"][title]["author"] = author
-    store["books"][title]["qty"] = int(qty)
-    save_store()
-    messagebox.showinfo("Updated", f"'{title}' updated.")
-
-def update_book():
-    fields = [("Title", "title"), ("New Author", "author"), ("New Quantity", "qty", "int")]
-    show_overlay_form("Update Book", fields, update_book_action)
-
-def search_book_action(vals):
-    q = vals.get("q","").strip().lower()
-    if not q:
-        messagebox.showerror("Error", "Enter search query.")
-        return
-    lines = []
-    for t,d in store.get("books", {}).items():
-        if q in t.lower() or q in d.get("author","").lower():
-            lines.append(f"{t} — {d.get('author','')} | Qty: {d.get('qty',0)}")
-    if not lines:
-        messagebox.showinfo("No results", "No books match.")
-        return
-    # show result overlay
-    for w in overlay_frame.winfo_children():
-        w.destroy()
-    overlay_frame.place(relx=0, rely=0, relwidth=1, relheight=1)
-    card = tk.Frame(overlay_frame, bg="#0b1220"); card.place(relx=0.5, rely=0.5, anchor="center", width=900, height=600)
-    tk.Label(card, text="Search Results", font=TITLE_FONT, bg="#0b1220", fg="white").pack(pady=12)
-    txt = tk.Text(card, bg="#071029", fg="white"); txt.pack(expand=True, fill="both", padx=12, pady=12)
-    txt.insert("1.0", "\n".join(lines)); txt.configure(state="disabled")
-    styled_button(card, "Close", bg="#ef4444", command=slide_out_overlay).pack(pady=8)
-
-def search_book():
-    show_overlay_form("Search Book", [("Search (title/author)", "q")], search_book_action)
-
-def list_all_books():
-    books = store.get("books", {})
-    if not books:
-        messagebox.showinfo("All Books", "No books available.")
-        return
-    lines = []
-    for t,d in books.items():
-        reserved = f" | Reserved: {', '.join(d.get('reserved',[]))}" if d.get("reserved") else ""
-        lines.append(f"{t} — {d.get('author','')} | Qty: {d.get('qty',0)}{reserved}")
-    # show overlay list
-    for w in overlay_frame.winfo_children():
-        w.destroy()
-    overlay_frame.place(relx=0, rely=0, relwidth=1, relheight=1)
-    card = tk.Frame(overlay_frame, bg="#0b1220"); card.place(relx=0.5, rely=0.5, anchor="center", width=900, height=600)
-    tk.Label(card, text="All Books", font=TITLE_FONT, bg="#0b1220", fg="white").pack(pady=12)
-    txt = tk.Text(card, bg="#071029", fg="white"); txt.pack(expand=True, fill="both", padx=12, pady=12)
-    txt.insert("1.0", "\n".join(lines)); txt.configure(state="disabled")
-    styled_button(card, "Close", bg="#ef4444", command=slide_out_overlay).pack(pady=8)
-
-# Users
-def register_user_action(vals):
-    name = vals.get("name","").strip()
-    if not name:
-        messagebox.showerror("Error", "Name required.")
-        return
-    if name in store.get("users", []):
-        messagebox.showerror("Error", "User exists.")
-        return
-    store.setdefault("users", []).append(name)
-    save_store()
-    messagebox.showinfo("Registered", f"'{name}' registered.")
-
-def register_user():
-    show_overlay_form("Register User", [("Name", "name")], register_user_action)
-
-def delete_user_action(vals):
-    name = vals.get("name","").strip()
-    if name not in store.get("users", []):
-        messagebox.showerror("Error", "User not found.")
-        return
-    for tx in store.get("issued", []):
-        if tx["user"] == name and not tx.get("returned", False):
-            messagebox.showerror("Error", "User has issued books; can't delete.")
-            return
-    store["users"].remove(name)
-    # also remove reservations
-    for d in store.get("books", {}).values():
-        if "reserved" in d:
-            d["reserved"] = [r for r in d.get("reserved",[]) if r != name]
-    save_store()
-    messagebox.showinfo("Deleted", f"'{name}' removed.")
-
-def delete_user():
-    show_overlay_form("Delete User", [("Name", "name")], delete_user_action)
-
-def update_user_action(vals):
-    old = vals.get("old","").strip()
-    new = vals.get("new","").strip()
-    if old not in store.get("users", []):
-        messagebox.showerror("Error", "User not found.")
-        return
-    if not new:
-        messagebox.showerror("Error", "New name required.")
-        return
-    idx = store["users"].index(old)
-    store["users"][idx] = new
-    # update issued and reserved
-    for tx in store.get("issued", []):
-        if tx["user"] == old:
-            tx["user"] = new
-    for d in store.get("books", {}).values():
-        if "reserved" in d:
-            d["reserved"] = [new if x==old else x for x in d.get("reserved",[])]
-    save_store()
-    messagebox.showinfo("Updated", f"'{old}' -> '{new}'")
-
-def update_user():
-    show_overlay_form("Update User", [("Old Name","old"), ("New Name","new")], update_user_action)
-
-def list_users():
-    users = store.get("users", [])
-    lines = users[:] if users else ["(No users)"]
-    for w in overlay_frame.winfo_children():
-        w.destroy()
-    overlay_frame.place(relx=0, rely=0, relwidth=1, relheight=1)
-    card = tk.Frame(overlay_frame, bg="#0b1220"); card.place(relx=0.5, rely=0.5, anchor="center", width=700, height=500)
-    tk.Label(card, text="Registered Users", font=TITLE_FONT, bg="#0b1220", fg="white").pack(pady=12)
-    txt = tk.Text(card, bg="#071029", fg="white")
-    txt.insert("1.0", "\n".join(lines))
-    txt.configure(state="disabled")
-    txt.pack(expand=True, fill="both", padx=12, pady=12)
-    styled_button(card, "Close", bg="#ef4444", command=slide_out_overlay).pack(pady=8)
-
-# Issue / Return / Reserve
-def issue_book_action(vals):
-    user = vals.get("user","").strip()
-    book = vals.get("book","").strip()
-    days = vals.get("days", 14)
-    if user not in store.get("users", []):
-        messagebox.showerror("Error", "User not registered.")
-        return
-    if book not in store.get("books", {}):
-        messagebox.showerror("Error", "Book not found.")
-        return
-    if store["books"][book].get("qty",0) <= 0:
-        messagebox.showerror("Unavailable", "No copies available.")
-        return
-    store["books"][book]["qty"] -= 1
-    tx = {"user": user, "book": book,
-          "issued_on": datetime.now().isoformat(),
-          "due_date": (datetime.now() + timedelta(days=int(days))).isoformat(),
-          "returned": False}
-    store.setdefault("issued", []).append(tx)
-    save_store()
-    messagebox.showinfo("Issued", f"'{book}' issued to {user} for {days} days.")
-
-def issue_book():
-    fields = [("User Name","user"), ("Book Title","book"), ("Days","days","days")]
-    show_overlay_form("Issue Book", fields, issue_book_action)
-
-def return_book_action(vals):
-    user = vals.get("user","").strip()
-    book = vals.get("book","").strip()
-    for tx in reversed(store.get("issued", [])):
-        if tx["user"] == user and tx["book"] == book and not tx.get("returned", False):
-            tx["returned"] = True
-            tx["returned_on"] = datetime.now().isoformat()
-            store["books"][book]["qty"] = store["books"].get(book, {}).get("qty", 0) + 1
-            save_store()
-            messagebox.showinfo("Returned", f"'{book}' returned by {user}.")
-            return
-    messagebox.showerror("Error", "No matching issued record found.")
-
-def return_book():
-    fields = [("User Name","user"), ("Book Title","book")]
-    show_overlay_form("Return Book", fields, return_book_action)
-
-def reserve_book_action(vals):
-    user = vals.get("user","").strip()
-    book = vals.get("book","").strip()
-    if user not in store.get("users", []):
-        messagebox.showerror("Error", "User not found.")
-        return
-    if book not in store.get("books", {}):
-        messagebox.showerror("Error", "Book not found.")
-        return
-    store["books"][book].setdefault("reserved", []).append(user)
-    save_store()
-    messagebox.showinfo("Reserved", f"'{book}' reserved for {user}.")
-
-def reserve_book():
-    fields = [("User Name","user"), ("Book Title","book")]
-    show_overlay_form("Reserve Book", fields, reserve_book_action)
-
-def list_issued_books_ui():
-    lines = []
-    for tx in store.get("issued", []):
-        if not tx.get("returned", False):
-            lines.append(f"{tx['book']} → {tx['user']} | Issued: {tx['issued_on'][:19]} | Due: {tx['due_date'][:10]}")
-    if not lines:
-        messagebox.showinfo("Issued Books", "No books currently issued.")
-        return
-    for w in overlay_frame.winfo_children():
-        w.destroy()
-    overlay_frame.place(relx=0, rely=0, relwidth=1, relheight=1)
-    card = tk.Frame(overlay_frame, bg="#0b1220"); card.place(relx=0.5, rely=0.5, anchor="center", width=900, height=600)
-    tk.Label(card, text="Issued Books", font=TITLE_FONT, bg="#0b1220", fg="white").pack(pady=12)
-    txt = tk.Text(card, bg="#071029", fg="white"); txt.pack(expand=True, fill="both", padx=12, pady=12)
-    txt.insert("1.0", "\n".join(lines)); txt.configure(state="disabled")
-    styled_button(card, "Close", bg="#ef4444", command=slide_out_overlay).pack(pady=8)
-
-# ---------- Dashboard builder (3x4 grid) ----------
-def styled_card(parent, text, color, command):
-    card = tk.Frame(parent, bg=color, bd=0, relief="flat")
-    lbl  = tk.Label(card, text=text, bg=color, fg="white", font=("Inter", 13, "bold"))
-    lbl.pack(expand=True, fill="both", padx=12, pady=12)
-    def on_enter(e):
-        card.configure(bg="#041227"); lbl.configure(bg="#041227")
-    def on_leave(e, col=color):
-        card.configure(bg=col); lbl.configure(bg=col)
-    card.bind("<Enter>", on_enter); card.bind("<Leave>", on_leave)
-    lbl.bind("<Enter>", on_enter); lbl.bind("<Leave>", on_leave)
-    card.bind("<Button-1>", lambda e: command())
-    lbl.bind("<Button-1>", lambda e: command())
-    return card
-
-def build_dashboard():
-    for w in dashboard_frame.winfo_children():
-        w.destroy()
-    dashboard_frame.place(relx=0, rely=0, relwidth=1, relheight=1)
-    top = tk.Frame(dashboard_frame, bg="#071229", height=70)
-    top.pack(fill="x")
-    tk.Label(top, text=f"Welcome, {current_user['name']}", bg="#071229", fg="white", font=("Inter", 16, "bold")).pack(side="left", padx=20)
-    tk.Label(top, text="Click a card to open a full-screen form", bg="#071229", fg="#94a3b8", font=("Inter", 10)).pack(side="left", padx=8)
-    main = tk.Frame(dashboard_frame, bg="#071029")
-    main.pack(expand=True, fill="both", padx=36, pady=20)
-    features = [
-        ("Add Book", add_book, CARD_COLORS[0]),
-        ("Remove Book", remove_book, CARD_COLORS[1]),
-        ("Update Book", update_book, CARD_COLORS[2]),
-        ("Search Book", search_book, CARD_COLORS[3]),
-        ("List All Books", list_all_books, CARD_COLORS[4]),
-        ("Register User", register_user, CARD_COLORS[5]),
-        ("Delete User", delete_user, CARD_COLORS[6]),
-        ("Update User", update_user, CARD_COLORS[7]),
-        ("List Users", list_users, CARD_COLORS[8]),
-        ("Issue Book", issue_book, CARD_COLORS[9]),
-        ("Return Book", return_book, CARD_COLORS[10]),
-        ("Reserve Book", reserve_book, CARD_COLORS[11])
-    ]
-    cols = 3
-    for i, (label, cmd, color) in enumerate(features[:12]):
-        r, c = divmod(i, cols)
-        card = styled_card(main, label, color, cmd)
-        card.grid(row=r, column=c, padx=18, pady=18, sticky="nsew")
-        main.grid_columnconfigure(c, weight=1)
-    rows_needed = (12 + cols - 1)//cols
-    for rr in range(rows_needed):
-        main.grid_rowconfigure(rr, weight=1)
-
-# ---------- Start ----------
-build_welcome()
-root.bind("<Escape>", lambda e: slide_out_overlay() if overlay_frame.winfo_ismapped() else None)
-root.mainloop()
+# library_animated_persistent.py
+# Animated Library Management System with JSON persistence.
+# Tk front end over the headless engine in library_core.py.
+# Requires Python 3.x (Tkinter included)
+#
+#   python library_management_system.py [data file]
+#   python library_management_system.py --server http://127.0.0.1:8765   # desk of a library_server
+
+import queue
+import sys
+import time
+import tkinter as tk
+from datetime import datetime
+from itertools import islice
+from tkinter import font as tkfont
+from tkinter import messagebox
+
+from library_core import DATA_FILE, LibraryError, Library, SearchWorker
+from library_metrics import METRICS, instrument
+from library_server import DEFAULT_URL, RemoteLibrary
+
+lib = None  # Library engine, created at startup
+search_worker = None  # SearchWorker behind the dashboard search box, created at startup
+persist_errors = queue.SimpleQueue()  # filled by the background writer thread
+PERSIST_POLL_MS = 250
+
+# ---------- Basic config + colors ----------
+APP_BG = "#071229"
+CARD_COLORS = ["#10b981", "#ef4444", "#3b82f6", "#8b5cf6", "#f59e0b", "#6366f1",
+               "#ec4899", "#06b6d4", "#7c3aed", "#0891b2", "#16a34a", "#fb923c"]
+TITLE_FONT = ("Inter", 22, "bold")
+ENTRY_FONT = ("Inter", 13)
+
+current_user = {"name": ""}
+
+# Tk root and frames are created at startup (see bottom of file)
+root = welcome_frame = dashboard_frame = overlay_frame = None
+screens = None  # ScreenManager over overlay_frame, created at startup
+
+# ---------- Animation scheduler ----------
+FRAME_MS = 16   # target frame interval (~60 fps)
+SLIDE_MS = 260  # length of a slide in or out
+
+class Animator:
+    """One root.after loop driving every running slide.
+
+    A slide is positioned by elapsed time rather than by step count, so a
+    frame that comes late jumps to where the slide should be by now instead
+    of replaying the missed steps. The loop only runs while something moves.
+    Every frame interval is recorded as ui.frame; frames later than twice
+    FRAME_MS count as errors there (dropped frames).
+    """
+    def __init__(self):
+        self.slides = {}  # widget -> (start rely, end rely, started, seconds, on_done)
+        self.job = None
+        self.last = 0.0
+
+    def slide(self, widget, start, end, ms=SLIDE_MS, on_done=None):
+        """Slide widget's rely from start (None: where it is now) to end.
+
+        Starting a slide replaces the one the widget had in flight, along
+        with its on_done.
+        """
+        if start is None:
+            start = float(widget.place_info().get("rely", 1.0 - end))
+        widget.place(relx=0, rely=start, relwidth=1, relheight=1)
+        self.slides[widget] = (start, end, time.perf_counter(), ms / 1000, on_done)
+        if self.job is None:
+            self.last = time.perf_counter()
+            self.job = root.after(FRAME_MS, self._frame)
+
+    def cancel(self, widget):
+        self.slides.pop(widget, None)
+
+    def _frame(self):
+        now = time.perf_counter()
+        METRICS.record("ui.frame", now - self.last, ok=now - self.last <= 2 * FRAME_MS / 1000)
+        self.last = now
+        finished = []
+        for widget, (start, end, t0, seconds, on_done) in list(self.slides.items()):
+            frac = min(1.0, (now - t0) / seconds)
+            eased = 1 - (1 - frac) ** 3  # ease out
+            widget.place_configure(rely=start + (end - start) * eased)
+            if frac >= 1.0:
+                finished.append((widget, on_done))
+        for widget, on_done in finished:
+            del self.slides[widget]
+            if on_done:
+                on_done()
+        if self.slides:
+            spent = (time.perf_counter() - now) * 1000
+            self.job = root.after(max(1, int(FRAME_MS - spent)), self._frame)
+        else:
+            self.job = None
+
+animator = Animator()
+
+# ---------- Styled button helper ----------
+def styled_button(parent, text, bg="#2b6cb0", command=None):
+    b = tk.Button(parent, text=text, bg=bg, fg="white", font=("Inter", 11, "bold"),
+                  bd=0, relief="flat", command=command)
+    def on_enter(e):
+        b.config(bg="#0ea5a4")
+    def on_leave(e, color=bg):
+        b.config(bg=color)
+    b.bind("<Enter>", on_enter); b.bind("<Leave>", on_leave)
+    return b
+
+# ---------- Welcome Screen ----------
+@instrument("ui.build_welcome")
+def build_welcome():
+    for w in welcome_frame.winfo_children():
+        w.destroy()
+    # background blocks
+    c = tk.Canvas(welcome_frame, highlightthickness=0, bg=APP_BG)
+    c.place(relx=0, rely=0, relwidth=1, relheight=1)
+    wwidth = root.winfo_width() or 1100
+    wheight= root.winfo_height() or 700
+    for i in range(0, 12):
+        color = "#0b3a50" if i % 2 == 0 else APP_BG
+        c.create_rectangle(0, i*(wheight/12), wwidth, (i+1)*(wheight/12), outline=color, fill=color)
+    # card
+    card = tk.Frame(welcome_frame, bg="white")
+    card.place(relx=0.5, rely=0.45, anchor="center", width=640, height=320)
+    tk.Label(card, text="Welcome to the Library", font=TITLE_FONT, bg="white", fg="#0b1220").pack(pady=(18,8))
+    tk.Label(card, text="Enter your name to continue", font=("Inter", 11), bg="white", fg="#475569").pack(pady=(0,14))
+    name_var = tk.StringVar()
+    entry = tk.Entry(card, font=ENTRY_FONT, textvariable=name_var, justify="center", bd=1, relief="solid")
+    entry.pack(ipady=10, ipadx=10, pady=8)
+    entry.focus_set()
+    def on_continue():
+        name = name_var.get().strip()
+        if not name:
+            messagebox.showwarning("Name required", "Please enter your name to continue.")
+            return
+        current_user["name"] = name
+        # auto-register if new
+        perform(lambda: lib.ensure_user(name))
+        slide_out_welcome_and_show_dashboard()
+    btn = styled_button(card, "Continue", bg="#06b6d4", command=on_continue)
+    btn.pack(pady=12, ipadx=8, ipady=6)
+    tk.Label(card, text="Data saved to 'library_data.json' automatically.", font=("Inter", 9), bg="white", fg="#94a3b8").pack(side="bottom", pady=10)
+
+def slide_out_welcome_and_show_dashboard():
+    build_dashboard()
+    animator.slide(dashboard_frame, 1.0, 0.0, on_done=welcome_frame.place_forget)
+    start_reminders()
+
+# ---------- Screen manager ----------
+class Screen:
+    """A card in overlay_frame; built on first use, then kept and reused."""
+    width, height = 900, 600
+
+    def __init__(self, host, title):
+        self.card = tk.Frame(host, bg="#0b1220")
+        self.title = tk.Label(self.card, text=title, font=TITLE_FONT, bg="#0b1220", fg="white")
+
+    def place(self):
+        self.card.place(relx=0.5, rely=0.5, anchor="center", width=self.width, height=self.height)
+
+    def focus(self):
+        pass
+
+class ScreenManager:
+    """Overlay screens built once, then shown again with their state reset.
+
+    Each form and view gets its own card under key the first time it opens;
+    later opens only reset its contents and swap the card in, so opening a
+    screen no longer destroys and recreates its widgets.
+    """
+    def __init__(self, host):
+        self.host = host
+        self.screens = {}
+        self.current = None
+
+    def get(self, key, build):
+        screen = self.screens.get(key)
+        if screen is None:
+            screen = self.screens[key] = build(self.host)
+        return screen
+
+    def show(self, screen, slide=False):
+        if self.current is not screen:
+            if self.current is not None:
+                self.current.card.place_forget()
+            self.current = screen
+        screen.place()
+        if slide:
+            animator.slide(self.host, 1.0, 0.0)
+        else:
+            animator.cancel(self.host)
+            self.host.place(relx=0, rely=0, relwidth=1, relheight=1)
+        screen.focus()
+
+# ---------- Overlay form helper ----------
+class FormScreen(Screen):
+    """
+    fields: list of tuples (label, key, type) where type in {'str','int','days'} (type optional)
+    submit_callback receives dict key->value
+    """
+    def __init__(self, host, title, fields, submit_callback):
+        super().__init__(host, title)
+        self.submit_callback = submit_callback
+        self.title.pack(pady=(18,10))
+        form_area = tk.Frame(self.card, bg="#0b1220")
+        form_area.pack(expand=True, fill="both", padx=24, pady=6)
+        self.entries = {}
+        for field in fields:
+            label, key = field[0], field[1]
+            typ = field[2] if len(field) > 2 else 'str'
+            row = tk.Frame(form_area, bg="#0b1220")
+            row.pack(fill="x", pady=8)
+            tk.Label(row, text=label, bg="#0b1220", fg="#cbd5e1", font=("Inter", 11)).pack(side="left", padx=(4,12))
+            ent = tk.Entry(row, font=ENTRY_FONT, width=36, bd=0, relief="solid")
+            ent.pack(side="left", padx=6)
+            self.entries[key] = (ent, typ)
+        ctrl = tk.Frame(self.card, bg="#0b1220")
+        ctrl.pack(pady=10)
+        styled_button(ctrl, "Submit", bg="#06b6d4", command=self.on_submit).pack(side="left", padx=12)
+        styled_button(ctrl, "Cancel", bg="#ef4444", command=slide_out_overlay).pack(side="left", padx=12)
+
+    def reset(self, initial_values=None):
+        for key, (ent, typ) in self.entries.items():
+            ent.delete(0, "end")
+            if initial_values and key in initial_values:
+                ent.insert(0, str(initial_values[key]))
+
+    def focus(self):
+        if self.entries:
+            next(iter(self.entries.values()))[0].focus_set()
+
+    def on_submit(self):
+        vals = {}
+        for k, (ent, typ) in self.entries.items():
+            v = ent.get().strip()
+            if typ in ('int','days'):
+                try:
+                    vals[k] = int(v)
+                except:
+                    messagebox.showerror("Invalid", f"Field '{k}' needs a number.")
+                    return
+            else:
+                vals[k] = v
+        self.submit_callback(vals)
+        if screens.current is self:  # unless the callback opened a result screen in its place
+            slide_out_overlay()
+
+@instrument("ui.show_overlay_form")
+def show_overlay_form(title, fields, submit_callback, initial_values=None):
+    form = screens.get(("form", title), lambda host: FormScreen(host, title, fields, submit_callback))
+    form.reset(initial_values)
+    screens.show(form, slide=True)
+
+def slide_out_overlay():
+    animator.slide(overlay_frame, None, 1.0, on_done=overlay_frame.place_forget)
+
+# ---------- Feature implementations (all 12) ----------
+def perform(call):
+    """Run an engine call; on LibraryError show it and return None."""
+    try:
+        return call()
+    except LibraryError as e:
+        messagebox.showerror(e.title, str(e))
+        return None
+
+class TextScreen(Screen):
+    """Read-only text card shared by every text overlay."""
+    def __init__(self, host):
+        super().__init__(host, "")
+        self.title.pack(pady=12)
+        self.note = tk.Label(self.card, bg="#0b1220", fg="#94a3b8", font=("Inter", 10))
+        self.txt = tk.Text(self.card, bg="#071029", fg="white")
+        self.txt.pack(expand=True, fill="both", padx=12, pady=12)
+        self.close = styled_button(self.card, "Close", bg="#ef4444", command=slide_out_overlay)
+        self.close.pack(pady=8)
+
+    def reset(self, title, lines, width, height, note):
+        self.width, self.height = width, height
+        self.title.configure(text=title)
+        if note:
+            self.note.configure(text=note)
+            self.note.pack(after=self.title)
+        else:
+            self.note.pack_forget()
+        self.txt.configure(state="normal"); self.txt.delete("1.0", "end")
+        self.txt.insert("1.0", "\n".join(lines)); self.txt.configure(state="disabled")
+        self.txt.yview_moveto(0)
+
+    def focus(self):
+        self.close.focus_set()
+
+@instrument("ui.show_text_overlay")
+def show_text_overlay(title, lines, width=900, height=600, note=None):
+    view = screens.get("text", TextScreen)
+    view.reset(title, lines, width, height, note)
+    screens.show(view)
+
+# ---------- Virtualized list view ----------
+class VirtualList:
+    """List overlay body that only holds the rows currently on screen.
+
+    Rows come from lib.page(kind, ...) in PAGE_ROWS chunks as the view
+    scrolls, so opening it costs the same for 10 or 200k records. Column
+    buttons sort (click again to reverse) and the filter box narrows rows.
+    """
+    PAGE_ROWS = 200
+
+    def __init__(self, parent, kind, fmt, sorts, default_label="Added"):
+        self.kind, self.fmt = kind, fmt
+        self.sort, self.descending, self.filter = None, False, ""
+        self.offset = 0    # first row on screen
+        self.visible = 20  # rows that fit, updated on resize
+        self.total = 0
+        self.chunk = (0, [])  # (start, rows) of the last fetched page
+        self._filter_job = None
+
+        bar = tk.Frame(parent, bg="#0b1220"); bar.pack(fill="x", padx=12)
+        tk.Label(bar, text="Filter", bg="#0b1220", fg="#cbd5e1", font=("Inter", 10)).pack(side="left")
+        self.filter_var = tk.StringVar()
+        tk.Entry(bar, textvariable=self.filter_var, font=("Inter", 11), width=24, bd=0).pack(side="left", padx=6)
+        self.filter_var.trace_add("write", lambda *a: self._filter_changed())
+        self.sort_buttons = {}
+        for col, label in [(None, default_label)] + sorts:
+            btn = tk.Button(bar, text=label, bg="#1e293b", fg="white", bd=0, font=("Inter", 10),
+                            command=lambda c=col: self.set_sort(c))
+            btn.pack(side="left", padx=3)
+            self.sort_buttons[col] = btn
+        self.count = tk.Label(bar, bg="#0b1220", fg="#94a3b8", font=("Inter", 10)); self.count.pack(side="right")
+
+        body = tk.Frame(parent, bg="#071029"); body.pack(expand=True, fill="both", padx=12, pady=8)
+        self.scroll = tk.Scrollbar(body, orient="vertical", command=self._on_scrollbar)
+        self.scroll.pack(side="right", fill="y")
+        self.box = tk.Listbox(body, bg="#071029", fg="white", bd=0, highlightthickness=0,
+                              activestyle="none", font=("Inter", 11))
+        self.box.pack(side="left", expand=True, fill="both")
+        self.row_height = tkfont.Font(font=self.box.cget("font")).metrics("linespace")
+        self.box.bind("<Configure>", lambda e: self._resized())
+        self.box.bind("<MouseWheel>", lambda e: self.scroll_by(-3 if e.delta > 0 else 3))
+        self.box.bind("<Button-4>", lambda e: self.scroll_by(-3))
+        self.box.bind("<Button-5>", lambda e: self.scroll_by(3))
+        for key, delta in (("<Prior>", -1.0), ("<Next>", 1.0)):
+            self.box.bind(key, lambda e, d=delta: self.scroll_by(int(d * self.visible)))
+        self.box.bind("<Home>", lambda e: self.scroll_to(0))
+        self.box.bind("<End>", lambda e: self.scroll_to(self.total))
+
+    def reset(self):
+        """Back to the unfiltered, unsorted first page (screens are reused between opens)."""
+        self.filter_var.set("")
+        if self._filter_job:  # pending typing, or scheduled by the write above
+            self.box.after_cancel(self._filter_job)
+            self._filter_job = None
+        self.sort, self.descending, self.filter, self.offset = None, False, "", 0
+        for btn in self.sort_buttons.values():
+            btn.configure(bg="#1e293b")
+        self.reload()
+
+    def reload(self):
+        self.scroll_to(self.offset, refetch=True)
+
+    def _fetch(self, start):
+        limit = max(self.PAGE_ROWS, 3 * self.visible)
+        page = perform(lambda: lib.page(self.kind, start, limit, self.sort, self.descending, self.filter))
+        if page is None:
+            return False
+        self.total, self.chunk = page.total, (start, page.rows)
+        return True
+
+    def scroll_to(self, offset, refetch=False):
+        offset = max(0, min(offset, self.total - self.visible))
+        start, rows = self.chunk
+        end = start + len(rows)
+        if refetch or offset < start or (offset + self.visible > end and end < self.total):
+            # centre the new chunk on the viewport so small scrolls either way stay cached
+            if not self._fetch(max(0, offset - self.PAGE_ROWS // 2)):
+                return
+            offset = max(0, min(offset, self.total - self.visible))
+            start, rows = self.chunk
+        self.offset = offset
+        self.box.delete(0, "end")
+        for row in rows[offset - start:offset - start + self.visible]:
+            self.box.insert("end", self.fmt(row))
+        shown = min(self.visible, self.total - offset)
+        self.count.configure(text=f"{offset + 1 if self.total else 0}–{offset + shown} of {self.total}")
+        if self.total:
+            self.scroll.set(offset / self.total, (offset + shown) / self.total)
+        else:
+            self.scroll.set(0, 1)
+
+    def scroll_by(self, rows):
+        self.scroll_to(self.offset + rows)
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * self.total))
+        elif unit == "pages":
+            self.scroll_by(int(amount) * self.visible)
+        else:
+            self.scroll_by(int(amount))
+
+    def _resized(self):
+        rows = max(1, self.box.winfo_height() // max(1, self.row_height))
+        if rows != self.visible:
+            self.visible = rows
+            self.scroll_to(self.offset)
+
+    def set_sort(self, col):
+        self.descending = not self.descending if col == self.sort else False
+        self.sort = col
+        for c, btn in self.sort_buttons.items():
+            btn.configure(bg="#0ea5a4" if c == col else "#1e293b")
+        self.offset = 0
+        self.reload()
+
+    def _filter_changed(self):
+        # debounce typing so each keystroke doesn't re-query
+        if self._filter_job:
+            self.box.after_cancel(self._filter_job)
+        self._filter_job = self.box.after(200, self._apply_filter)
+
+    def _apply_filter(self):
+        self._filter_job = None
+        self.filter = self.filter_var.get()
+        self.offset = 0
+        self.reload()
+
+class ListScreen(Screen):
+    def __init__(self, host, title, kind, fmt, sorts, width, height, default_label):
+        super().__init__(host, title)
+        self.width, self.height = width, height
+        self.title.pack(pady=12)
+        styled_button(self.card, "Close", bg="#ef4444", command=slide_out_overlay).pack(side="bottom", pady=8)
+        self.view = VirtualList(self.card, kind, fmt, sorts, default_label)
+
+    def focus(self):
+        self.view.box.focus_set()
+
+@instrument("ui.show_virtual_list")
+def show_virtual_list(title, kind, fmt, sorts, width=900, height=600, default_label="Added"):
+    screen = screens.get(("list", kind), lambda host: ListScreen(host, title, kind, fmt, sorts, width, height,
+                                                                 default_label))
+    screen.view.reset()
+    screens.show(screen)
+    return screen.view
+
+def book_line(b, show_reserved=False):
+    reserved = f" | Reserved: {', '.join(b.reserved)}" if show_reserved and b.reserved else ""
+    return f"{b.title} — {b.author} | Qty: {b.qty}{reserved}"
+
+def add_book_action(vals):
+    qty = vals.get("qty",0)
+    b = perform(lambda: lib.add_book(vals.get("title",""), vals.get("author",""), qty))
+    if b:
+        messagebox.showinfo("Added", f"'{b.title}' added ({qty}).")
+
+def add_book():
+    fields = [("Title", "title"), ("Author", "author"), ("Quantity", "qty", "int")]
+    show_overlay_form("Add Book", fields, add_book_action)
+
+def remove_book_action(vals):
+    b = perform(lambda: lib.remove_book(vals.get("title","")))
+    if b:
+        messagebox.showinfo("Removed", f"'{b.title}' removed.")
+
+def remove_book():
+    show_overlay_form("Remove Book", [("Title", "title")], remove_book_action)
+
+def update_book_action(vals):
+    b = perform(lambda: lib.update_book(vals.get("title",""), vals.get("author",""), vals.get("qty")))
+    if b:
+        messagebox.showinfo("Updated", f"'{b.title}' updated.")
+
+def update_book():
+    fields = [("Title", "title"), ("New Author", "author"), ("New Quantity", "qty", "int")]
+    show_overlay_form("Update Book", fields, update_book_action)
+
+def search_book_action(vals):
+    res = perform(lambda: lib.search(vals.get("q","")))
+    if res is None:
+        return
+    if not res.books:
+        messagebox.showinfo("No results", "No books match.")
+        return
+    note = f"Showing top {len(res.books)} of {res.total} matches" if res.total > len(res.books) else None
+    show_text_overlay("Search Results", [book_line(b) for b in res.books], note=note)
+
+def search_book():
+    show_overlay_form("Search Book", [("Search (title/author)", "q")], search_book_action)
+
+def list_all_books():
+    page = perform(lambda: lib.page("books", limit=0))
+    if page is None:
+        return
+    if not page.total:
+        messagebox.showinfo("All Books", "No books available.")
+        return
+    show_virtual_list("All Books", "books", lambda b: book_line(b, show_reserved=True),
+                      [("title", "Title"), ("author", "Author"), ("qty", "Qty")])
+
+# Users
+def register_user_action(vals):
+    u = perform(lambda: lib.register_user(vals.get("name","")))
+    if u:
+        messagebox.showinfo("Registered", f"'{u.name}' registered.")
+
+def register_user():
+    show_overlay_form("Register User", [("Name", "name")], register_user_action)
+
+def delete_user_action(vals):
+    u = perform(lambda: lib.delete_user(vals.get("name","")))
+    if u:
+        messagebox.showinfo("Deleted", f"'{u.name}' removed.")
+
+def delete_user():
+    show_overlay_form("Delete User", [("Name", "name")], delete_user_action)
+
+def update_user_action(vals):
+    old = vals.get("old","").strip()
+    u = perform(lambda: lib.rename_user(old, vals.get("new","")))
+    if u:
+        messagebox.showinfo("Updated", f"'{old}' -> '{u.name}'")
+
+def update_user():
+    show_overlay_form("Update User", [("Old Name","old"), ("New Name","new")], update_user_action)
+
+def user_line(u):
+    since = f" | Since: {u.registered_on[:10]}" if u.registered_on else ""
+    return f"{u.name}{since} | Loans: {u.loans} | Active: {u.active}"
+
+def list_users():
+    show_virtual_list("Registered Users", "users", user_line,
+                      [("name", "Name"), ("registered_on", "Since"), ("loans", "Loans")], width=800, height=560)
+
+# Issue / Return / Reserve
+def issue_book_action(vals):
+    days = vals.get("days", 14)
+    loan = perform(lambda: lib.issue(vals.get("user",""), vals.get("book",""), days))
+    if loan:
+        messagebox.showinfo("Issued", f"'{loan.book}' issued to {loan.user} for {days} days.")
+
+def issue_book(initial_values=None):
+    fields = [("User Name","user"), ("Book Title","book"), ("Days","days","days")]
+    show_overlay_form("Issue Book", fields, issue_book_action, initial_values=initial_values)
+
+def return_book_action(vals):
+    loan = perform(lambda: lib.return_book(vals.get("user",""), vals.get("book","")))
+    if loan:
+        fine = f"\nLate by {days_late(loan.due_date, loan.returned_on)} days, fine due: {loan.fine:g}" if loan.fine else ""
+        held = loan.held_for
+        hold = f"\nHeld for {held.user} until {held.expires[:10]}." if held else ""
+        messagebox.showinfo("Returned", f"'{loan.book}' returned by {loan.user}.{fine}{hold}")
+
+def return_book():
+    fields = [("User Name","user"), ("Book Title","book")]
+    show_overlay_form("Return Book", fields, return_book_action)
+
+def reserve_book_action(vals):
+    h = perform(lambda: lib.reserve(vals.get("user",""), vals.get("book","")))
+    if h:
+        where = f"A copy is held until {h.expires[:10]}." if h.expires else f"Position {h.position} in the queue."
+        messagebox.showinfo("Reserved", f"'{h.book}' reserved for {h.user}.\n{where}")
+
+def reserve_book():
+    fields = [("User Name","user"), ("Book Title","book")]
+    show_overlay_form("Reserve Book", fields, reserve_book_action)
+
+def cancel_reservation_action(vals):
+    h = perform(lambda: lib.cancel_reservation(vals.get("user",""), vals.get("book","")))
+    if h:
+        messagebox.showinfo("Cancelled", f"Reservation of '{h.book}' for {h.user} cancelled.")
+
+def cancel_reservation():
+    fields = [("User Name","user"), ("Book Title","book")]
+    show_overlay_form("Cancel Reservation", fields, cancel_reservation_action)
+
+# Scan queue: many issues/returns, committed together
+class ScanScreen(Screen):
+    """Desk mode for scanner bursts.
+
+    Each scan (Enter in the book field) queues an issue or return for the
+    user in the user field; Commit sends the whole queue to lib.circulate,
+    which applies all of it with one save or none of it. After a refused
+    batch the queue stays, marked with each item's error, to be fixed and
+    committed again. The queue is kept while the screen is closed.
+    """
+    width, height = 900, 620
+
+    def __init__(self, host):
+        super().__init__(host, "Scan Queue")
+        self.title.pack(pady=(18,10))
+        self.queue = []  # (action, user, book)
+        form = tk.Frame(self.card, bg="#0b1220"); form.pack(fill="x", padx=24)
+        self.action = tk.StringVar(value="issue")
+        for value, label in (("issue", "Issue"), ("return", "Return")):
+            tk.Radiobutton(form, text=label, value=value, variable=self.action, bg="#0b1220", fg="white",
+                           selectcolor="#1e293b", activebackground="#0b1220", font=("Inter", 11)).pack(side="left", padx=(0,10))
+        tk.Label(form, text="User", bg="#0b1220", fg="#cbd5e1", font=("Inter", 11)).pack(side="left", padx=(12,6))
+        self.user = tk.Entry(form, font=ENTRY_FONT, width=16, bd=0); self.user.pack(side="left")
+        tk.Label(form, text="Book", bg="#0b1220", fg="#cbd5e1", font=("Inter", 11)).pack(side="left", padx=(12,6))
+        self.book = tk.Entry(form, font=ENTRY_FONT, width=26, bd=0); self.book.pack(side="left")
+        self.book.bind("<Return>", lambda e: self.add())
+        self.user.bind("<Return>", lambda e: self.book.focus_set())
+        self.status = tk.Label(self.card, bg="#0b1220", fg="#94a3b8", font=("Inter", 10), anchor="w")
+        self.status.pack(fill="x", padx=24, pady=(10,0))
+        self.box = tk.Listbox(self.card, bg="#071029", fg="white", font=("Inter", 11), bd=0,
+                              highlightthickness=0, activestyle="none", selectbackground="#2b6cb0")
+        self.box.pack(expand=True, fill="both", padx=24, pady=10)
+        self.box.bind("<Delete>", lambda e: self.remove())
+        ctrl = tk.Frame(self.card, bg="#0b1220"); ctrl.pack(pady=(0,12))
+        styled_button(ctrl, "Commit", bg="#06b6d4", command=self.commit).pack(side="left", padx=8)
+        styled_button(ctrl, "Remove selected", bg="#f59e0b", command=self.remove).pack(side="left", padx=8)
+        styled_button(ctrl, "Clear", bg="#8b5cf6", command=self.clear).pack(side="left", padx=8)
+        styled_button(ctrl, "Close", bg="#ef4444", command=slide_out_overlay).pack(side="left", padx=8)
+
+    def reset(self):
+        self.user.delete(0, "end")
+        self.user.insert(0, current_user["name"])
+        self.book.delete(0, "end")
+        self.refresh()
+
+    def focus(self):
+        self.book.focus_set()
+
+    def refresh(self, errors=None):
+        self.box.delete(0, "end")
+        for i, (action, user, book) in enumerate(self.queue):
+            mark = f"  ✗ {errors[i]}" if errors and errors[i] else ""
+            self.box.insert("end", f"{action.title():<7} {book} — {user}{mark}")
+            if mark:
+                self.box.itemconfigure(i, fg="#f87171")
+        n = len(self.queue)
+        self.status.configure(text=f"{n} item{'s' if n != 1 else ''} queued · Enter in Book adds a scan · Delete removes")
+
+    def add(self):
+        user, book = self.user.get().strip(), self.book.get().strip()
+        if not user or not book:
+            return
+        self.queue.append((self.action.get(), user, book))
+        self.book.delete(0, "end")
+        self.refresh()
+        self.box.see("end")
+
+    def remove(self):
+        for i in reversed(self.box.curselection()):
+            del self.queue[i]
+        self.refresh()
+
+    def clear(self):
+        self.queue.clear()
+        self.refresh()
+
+    def commit(self):
+        if not self.queue:
+            return
+        report = perform(lambda: lib.circulate(self.queue))
+        if report is None:
+            return
+        if not report.applied:
+            self.refresh([item.error for item in report.items])
+            failed = sum(not item.ok for item in report.items)
+            messagebox.showerror("Not committed", f"{failed} of {len(report.items)} items failed; nothing was saved.\n"
+                                                  "Fix or remove the marked items and commit again.")
+            return
+        issued = sum(item.action == "issue" for item in report.items)
+        self.queue.clear()
+        self.refresh()
+        messagebox.showinfo("Committed", f"{issued} issued, {len(report.items) - issued} returned.")
+
+def scan_queue():
+    screen = screens.get("scan", ScanScreen)
+    screen.reset()
+    screens.show(screen, slide=True)
+
+def loan_line(l):
+    return f"{l.book} → {l.user} | Issued: {l.issued_on[:19]} | Due: {l.due_date[:10]}"
+
+def list_issued_books_ui():
+    page = perform(lambda: lib.page("loans", limit=0))
+    if page is None:
+        return
+    if not page.total:
+        messagebox.showinfo("Issued Books", "No books currently issued.")
+        return
+    show_virtual_list("Issued Books", "loans", loan_line,
+                      [("due_date", "Due"), ("user", "User"), ("book", "Book")])
+
+# Overdue loans + reminders
+REMINDER_MS = 60 * 1000
+reminder = {"since": None, "count": 0, "label": None, "running": False}
+
+def days_late(due_date, on):
+    return max(0, (datetime.fromisoformat(on) - datetime.fromisoformat(due_date)).days)
+
+def overdue_line(l):
+    now = datetime.now().isoformat()
+    return f"{l.book} → {l.user} | Due: {l.due_date[:10]} | {days_late(l.due_date, now)} days late | Fine: {l.fine:g}"
+
+def show_overdue():
+    reminder["count"] = 0
+    update_reminder_label()
+    page = perform(lambda: lib.page("overdue", limit=0))
+    if page is None:
+        return
+    if not page.total:
+        messagebox.showinfo("Overdue", "No overdue loans.")
+        return
+    show_virtual_list("Overdue Loans", "overdue", overdue_line, [], default_label="Most overdue")
+
+def update_reminder_label():
+    lbl = reminder["label"]
+    if lbl is None or not lbl.winfo_exists():
+        return
+    n = reminder["count"]
+    lbl.configure(text=f"⚠ {n} overdue loan{'s' if n != 1 else ''} — view" if n else "")
+
+def check_overdue():
+    # each tick only looks at loans that fell due since the previous tick
+    try:
+        if isinstance(lib, Library):
+            # unclaimed copies move on to the next reservation; a bisect when none ran out.
+            # A library_server sweeps its own store, so desks leave this to it.
+            lib.expire_holds()
+        loans, reminder["since"] = lib.newly_overdue(reminder["since"])
+    except LibraryError:
+        loans = []
+    if loans:
+        reminder["count"] += len(loans)
+        update_reminder_label()
+    root.after(REMINDER_MS, check_overdue)
+
+def start_reminders():
+    if not reminder["running"]:
+        reminder["running"] = True
+        check_overdue()
+
+# Circulation history (archived loans included)
+HISTORY_ROWS = 2000
+
+def history_action(vals):
+    loans = perform(lambda: lib.history(vals.get("user",""), vals.get("book","")))
+    if loans is None:
+        return
+    lines = [loan_line(l) + (f" | Returned: {l.returned_on[:10]}" if l.returned else " | On loan")
+             for l in islice(loans, HISTORY_ROWS + 1)]
+    if not lines:
+        messagebox.showinfo("History", "No loans found.")
+        return
+    note = f"Showing the first {HISTORY_ROWS} loans" if len(lines) > HISTORY_ROWS else None
+    show_text_overlay("Circulation History", lines[:HISTORY_ROWS], note=note)
+
+def history():
+    fields = [("User Name (optional)","user"), ("Book Title (optional)","book")]
+    show_overlay_form("Circulation History", fields, history_action)
+
+# Bulk import / export
+def import_export_action(vals):
+    action = vals.get("action","").strip().lower()
+    kind = vals.get("kind","").strip().lower()
+    path = vals.get("path","").strip()
+    if action == "import":
+        report = perform(lambda: lib.import_file(kind, path))
+        if report:
+            msg = f"Added {report.added}, merged {report.merged}, skipped {report.skipped}, failed {report.failed}."
+            if report.errors:
+                msg += "\n" + "\n".join(f"Row {n}: {m}" for n, m in report.errors[:10])
+            messagebox.showinfo("Import", msg)
+    elif action == "export":
+        n = perform(lambda: lib.export_file(kind, path))
+        if n is not None:
+            messagebox.showinfo("Export", f"{n} {kind} rows written to '{path}'.")
+    else:
+        messagebox.showerror("Error", "Action must be 'import' or 'export'.")
+
+def import_export():
+    fields = [("Action (import/export)", "action"), ("Data (books/users/loans)", "kind"), ("File (.csv/.jsonl)", "path")]
+    show_overlay_form("Import / Export", fields, import_export_action, initial_values={"action": "import", "kind": "books"})
+
+# Performance
+METRICS_FILE = "library_metrics.json"
+
+def metrics_lines():
+    lines = [f"{'Operation':<28}{'Count':>8}{'Err':>5}{'Mean':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'Max':>10}  (ms)"]
+    for r in METRICS.snapshot():
+        lines.append(f"{r['op']:<28}{r['count']:>8}{r['errors']:>5}{r['mean_ms']:>10.2f}"
+                     f"{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['max_ms']:>10.2f}")
+    if METRICS.last_profile:
+        name, path, summary = METRICS.last_profile
+        lines += ["", f"Last profile: {name} -> {path}", summary]
+    return lines
+
+class PerformanceScreen(Screen):
+    width, height = 1000, 620
+
+    def __init__(self, host):
+        super().__init__(host, "Performance")
+        self.title.pack(pady=12)
+        self.since = tk.Label(self.card, bg="#0b1220", fg="#94a3b8", font=("Inter", 10)); self.since.pack()
+        self.txt = tk.Text(self.card, bg="#071029", fg="white", font=("Courier", 10), wrap="none")
+        self.txt.pack(expand=True, fill="both", padx=12, pady=12)
+        ctrl = tk.Frame(self.card, bg="#0b1220"); ctrl.pack(pady=8)
+        styled_button(ctrl, "Refresh", bg="#06b6d4", command=self.refresh).pack(side="left", padx=8)
+        styled_button(ctrl, "Export", bg="#3b82f6", command=self.export).pack(side="left", padx=8)
+        styled_button(ctrl, "Profile next op", bg="#8b5cf6", command=self.profile_next).pack(side="left", padx=8)
+        styled_button(ctrl, "Reset", bg="#f59e0b", command=self.reset).pack(side="left", padx=8)
+        styled_button(ctrl, "Close", bg="#ef4444", command=slide_out_overlay).pack(side="left", padx=8)
+
+    def refresh(self):
+        self.since.configure(text=f"Since {METRICS.started:%Y-%m-%d %H:%M:%S}")
+        self.txt.configure(state="normal"); self.txt.delete("1.0", "end")
+        self.txt.insert("1.0", "\n".join(metrics_lines())); self.txt.configure(state="disabled")
+
+    def export(self):
+        try:
+            path = METRICS.export(METRICS_FILE)
+        except OSError as e:
+            messagebox.showerror("Export", f"Could not write metrics: {e}")
+            return
+        messagebox.showinfo("Export", f"Metrics written to '{path}'.")
+
+    def profile_next(self):
+        METRICS.profile_next()
+        messagebox.showinfo("Profile", "The next operation will be profiled; reopen this card to see it.")
+
+    def reset(self):
+        METRICS.reset(); self.refresh()
+
+def show_performance():
+    screen = screens.get("performance", PerformanceScreen)
+    screen.refresh()
+    screens.show(screen)
+
+# ---------- Live search (dashboard) ----------
+LIVE_SEARCH_LIMIT = 50
+
+class LiveSearch:
+    """Search box in the dashboard's top bar; matches drop down while typing.
+
+    Keystrokes are debounced, then the query goes to search_worker, so the
+    Tk loop never runs a search itself. Answers are collected with
+    root.after polling (only while a query is in flight) and inserted a
+    chunk per tick. A newer keystroke makes every older query stale.
+    """
+    DEBOUNCE_MS = 40
+    POLL_MS = 10
+    CHUNK = 25  # rows inserted per Tk tick
+    MIN_CHARS = 2
+
+    def __init__(self, top, host):
+        self.var = tk.StringVar()
+        self.entry = tk.Entry(top, textvariable=self.var, font=ENTRY_FONT, width=28, bd=0, relief="solid")
+        self.entry.pack(side="right", padx=(6, 20))
+        tk.Label(top, text="Search", bg="#071229", fg="#94a3b8", font=("Inter", 10)).pack(side="right")
+        self.panel = tk.Frame(host, bg="#0b1220")
+        self.status = tk.Label(self.panel, bg="#0b1220", fg="#94a3b8", font=("Inter", 10), anchor="w")
+        self.status.pack(fill="x", padx=10, pady=(8, 0))
+        self.box = tk.Listbox(self.panel, bg="#071029", fg="white", font=("Inter", 11), bd=0,
+                              highlightthickness=0, activestyle="none", selectbackground="#2b6cb0")
+        self.box.pack(expand=True, fill="both", padx=10, pady=10)
+        self.books = []
+        self.gen = 0          # generation of the query whose answer we want
+        self.waiting = False  # a query is in flight
+        self.polling = False
+        self.debounce = None
+        self.started = 0.0
+        self.var.trace_add("write", lambda *a: self._changed())
+        self.entry.bind("<Return>", lambda e: self._open(0))
+        self.entry.bind("<Down>", lambda e: self._focus_results())
+        self.entry.bind("<Escape>", lambda e: self.clear())
+        self.box.bind("<Return>", lambda e: self._open_selected())
+        self.box.bind("<Double-Button-1>", lambda e: self._open_selected())
+        self.box.bind("<Escape>", lambda e: self.clear())
+
+    def _changed(self):
+        if self.debounce:
+            root.after_cancel(self.debounce)
+        self.debounce = root.after(self.DEBOUNCE_MS, self._submit)
+
+    def _submit(self):
+        self.debounce = None
+        q = self.var.get().strip()
+        if len(q) < self.MIN_CHARS:
+            search_worker.cancel()
+            self.waiting = False
+            self.panel.place_forget()
+            return
+        self.gen = search_worker.submit(q)
+        self.waiting = True
+        self.started = time.perf_counter()
+        if not self.polling:
+            self.polling = True
+            root.after(self.POLL_MS, self._poll)
+
+    def _poll(self):
+        if not self.waiting or not self.panel.winfo_exists():
+            self.polling = False
+            return
+        latest = None
+        try:
+            while True:
+                latest = search_worker.results.get_nowait()
+        except queue.Empty:
+            pass
+        if latest is not None and latest[0] == self.gen:
+            self.waiting = self.polling = False
+            self._show(*latest)
+        else:
+            root.after(self.POLL_MS, self._poll)
+
+    def _show(self, gen, q, res, err):
+        self.box.delete(0, "end")
+        self.books = res.books if res else []
+        if err is not None:
+            self.status.configure(text=str(err))
+        elif not self.books:
+            self.status.configure(text=f"No books match '{q}'.")
+        else:
+            shown = f"Top {len(self.books)} of {res.total}" if res.total > len(self.books) else f"{res.total}"
+            self.status.configure(text=f"{shown} matches · Enter or double-click to issue")
+        self.panel.place(relx=1.0, x=-20, y=70, anchor="ne", width=560, relheight=0.6)
+        self.panel.lift()
+        self._fill(gen, 0)
+
+    def _fill(self, gen, start):
+        if gen != self.gen or not self.box.winfo_exists():
+            return  # a newer query took over
+        self.box.insert("end", *[book_line(b, show_reserved=True) for b in self.books[start:start + self.CHUNK]])
+        if start == 0:
+            METRICS.record("ui.live_search", time.perf_counter() - self.started)
+        if start + self.CHUNK < len(self.books):
+            root.after(1, self._fill, gen, start + self.CHUNK)
+
+    def _focus_results(self):
+        if self.books:
+            self.box.focus_set()
+            self.box.selection_clear(0, "end")
+            self.box.selection_set(0)
+            self.box.activate(0)
+
+    def _open_selected(self):
+        sel = self.box.curselection()
+        self._open(sel[0] if sel else 0)
+
+    def _open(self, i):
+        if i < len(self.books):
+            title = self.books[i].title
+            self.clear()
+            issue_book({"user": current_user["name"], "book": title, "days": 14})
+
+    def clear(self):
+        self.var.set("")
+        self.panel.place_forget()
+
+# ---------- Dashboard builder (3-column grid) ----------
+def styled_card(parent, text, color, command):
+    card = tk.Frame(parent, bg=color, bd=0, relief="flat")
+    lbl  = tk.Label(card, text=text, bg=color, fg="white", font=("Inter", 13, "bold"))
+    lbl.pack(expand=True, fill="both", padx=12, pady=12)
+    def on_enter(e):
+        card.configure(bg="#041227"); lbl.configure(bg="#041227")
+    def on_leave(e, col=color):
+        card.configure(bg=col); lbl.configure(bg=col)
+    card.bind("<Enter>", on_enter); card.bind("<Leave>", on_leave)
+    lbl.bind("<Enter>", on_enter); lbl.bind("<Leave>", on_leave)
+    card.bind("<Button-1>", lambda e: command())
+    lbl.bind("<Button-1>", lambda e: command())
+    return card
+
+dashboard = {"greeting": None}  # widgets the dashboard updates after it is built
+
+@instrument("ui.build_dashboard")
+def build_dashboard():
+    # built once; later calls only update the greeting
+    if dashboard["greeting"] is not None:
+        dashboard["greeting"].configure(text=f"Welcome, {current_user['name']}")
+        return
+    top = tk.Frame(dashboard_frame, bg="#071229", height=70)
+    top.pack(fill="x")
+    dashboard["greeting"] = tk.Label(top, text=f"Welcome, {current_user['name']}", bg="#071229", fg="white", font=("Inter", 16, "bold"))
+    dashboard["greeting"].pack(side="left", padx=20)
+    tk.Label(top, text="Click a card to open a full-screen form", bg="#071229", fg="#94a3b8", font=("Inter", 10)).pack(side="left", padx=8)
+    reminder["label"] = tk.Label(top, text="", bg="#071229", fg="#f59e0b", font=("Inter", 11, "bold"), cursor="hand2")
+    reminder["label"].pack(side="right", padx=20)
+    reminder["label"].bind("<Button-1>", lambda e: show_overdue())
+    update_reminder_label()
+    LiveSearch(top, dashboard_frame)
+    main = tk.Frame(dashboard_frame, bg="#071029")
+    main.pack(expand=True, fill="both", padx=36, pady=20)
+    features = [
+        ("Add Book", add_book, CARD_COLORS[0]),
+        ("Remove Book", remove_book, CARD_COLORS[1]),
+        ("Update Book", update_book, CARD_COLORS[2]),
+        ("Search Book", search_book, CARD_COLORS[3]),
+        ("List All Books", list_all_books, CARD_COLORS[4]),
+        ("Register User", register_user, CARD_COLORS[5]),
+        ("Delete User", delete_user, CARD_COLORS[6]),
+        ("Update User", update_user, CARD_COLORS[7]),
+        ("List Users", list_users, CARD_COLORS[8]),
+        ("Issue Book", issue_book, CARD_COLORS[9]),
+        ("Return Book", return_book, CARD_COLORS[10]),
+        ("Reserve Book", reserve_book, CARD_COLORS[11]),
+        ("Cancel Reservation", cancel_reservation, CARD_COLORS[10]),
+        ("Scan Queue", scan_queue, CARD_COLORS[9]),
+        ("Issued Books", list_issued_books_ui, CARD_COLORS[2]),
+        ("Overdue", show_overdue, CARD_COLORS[1]),
+        ("History", history, CARD_COLORS[3]),
+        ("Import / Export", import_export, CARD_COLORS[0]),
+        ("Performance", show_performance, CARD_COLORS[1]),
+    ]
+    cols = 3
+    for i, (label, cmd, color) in enumerate(features):
+        r, c = divmod(i, cols)
+        card = styled_card(main, label, color, cmd)
+        card.grid(row=r, column=c, padx=18, pady=18, sticky="nsew")
+        main.grid_columnconfigure(c, weight=1)
+    rows_needed = (len(features) + cols - 1)//cols
+    for rr in range(rows_needed):
+        main.grid_rowconfigure(rr, weight=1)
+
+# ---------- Start ----------
+def poll_persist_errors():
+    # writer failures arrive on another thread; surface them from the Tk loop,
+    # one dialog for whatever piled up since the last poll
+    errors = []
+    while True:
+        try:
+            errors.append(persist_errors.get_nowait())
+        except queue.Empty:
+            break
+    if errors:
+        e = errors[-1]
+        messagebox.showerror(e.title, f"{e}\nChanges are kept in memory and will be retried.")
+    root.after(PERSIST_POLL_MS, poll_persist_errors)
+
+def on_close():
+    search_worker.close(timeout=1.0)
+    try:
+        lib.close()  # flush pending writes, then fold the journal into the snapshot
+    except LibraryError as e:
+        messagebox.showerror(e.title, str(e))
+    root.destroy()
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--server"]:
+        lib = RemoteLibrary(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_URL)
+    else:
+        lib = Library(sys.argv[1] if len(sys.argv) > 1 else DATA_FILE, background=True, on_error=persist_errors.put)
+    search_worker = SearchWorker(lib, limit=LIVE_SEARCH_LIMIT)
+    root = tk.Tk()
+    root.title("Library — Persistent Animated UI")
+    root.geometry("1100x700")
+    root.minsize(900, 600)
+    root.configure(bg=APP_BG)
+
+    welcome_frame = tk.Frame(root, bg=APP_BG)
+    dashboard_frame = tk.Frame(root, bg=APP_BG)
+    overlay_frame = tk.Frame(root, bg="#071029")  # slide-in overlay for full-screen forms
+    screens = ScreenManager(overlay_frame)
+    welcome_frame.place(relx=0, rely=0, relwidth=1, relheight=1)
+
+    build_welcome()
+    root.bind("<Escape>", lambda e: slide_out_overlay() if overlay_frame.winfo_ismapped() else None)
+    root.protocol("WM_DELETE_WINDOW", on_close)
+    poll_persist_errors()
+    root.mainloop()
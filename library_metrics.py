@@ -0,0 +1,141 @@
+# library_metrics.py
+# Always-on operation timing for the Library app.
+#
+# Instrumented calls cost two perf_counter() reads and a bucket increment, so
+# they stay enabled in production. METRICS is the process-wide registry; the
+# dashboard's Performance card and `library_cli.py --metrics` read it.
+
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime
+
+# upper bounds of the latency buckets, in milliseconds (last bucket is open-ended)
+BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+PROFILE_DIR = "profiles"
+
+class Histogram:
+    __slots__ = ("count", "errors", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, ms, ok=True):
+        self.count += 1
+        self.errors += not ok
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+        self.buckets[bisect_left(BUCKETS_MS, ms)] += 1
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile, capped at the max seen."""
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(BUCKETS_MS[i], round(self.max, 3)) if i < len(BUCKETS_MS) else round(self.max, 3)
+        return self.max
+
+class Metrics:
+    """Counters and latency histograms keyed by operation name."""
+    def __init__(self):
+        self.ops = {}
+        self.started = datetime.now()
+        self.last_profile = None  # (op name, path, text summary) of the latest capture
+        self._profile_target = None
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, ok=True):
+        with self._lock:
+            h = self.ops.get(name)
+            if h is None:
+                h = self.ops[name] = Histogram()
+            h.add(seconds * 1000, ok)
+
+    def instrument(self, name):
+        """Decorator timing every call under name; exceptions count as errors."""
+        def wrap(fn):
+            @functools.wraps(fn)
+            def timed(*args, **kwargs):
+                if self._profile_target is not None and self._profile_target in ("*", name):
+                    return self._profiled(name, fn, args, kwargs)
+                t = time.perf_counter()
+                ok = False
+                try:
+                    result = fn(*args, **kwargs)
+                    ok = True
+                    return result
+                finally:
+                    self.record(name, time.perf_counter() - t, ok)
+            return timed
+        return wrap
+
+    # ----- on-demand profiling -----
+    def profile_next(self, name="*"):
+        """Capture a cProfile of the next call to op name ('*' = any instrumented op)."""
+        self._profile_target = name
+
+    def _profiled(self, name, fn, args, kwargs):
+        self._profile_target = None  # one capture; also keeps nested ops unprofiled
+        prof = cProfile.Profile()
+        t = time.perf_counter()
+        ok = False
+        try:
+            result = prof.runcall(fn, *args, **kwargs)
+            ok = True
+            return result
+        finally:
+            self.record(name, time.perf_counter() - t, ok)
+            self._save_profile(name, prof)
+
+    def _save_profile(self, name, prof):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{name}-{datetime.now():%Y%m%d-%H%M%S}.prof")
+        prof.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(25)
+        self.last_profile = (name, path, out.getvalue())
+
+    # ----- reading -----
+    def snapshot(self):
+        """One dict per operation, slowest p95 first."""
+        with self._lock:
+            rows = [{"op": name, "count": h.count, "errors": h.errors,
+                     "mean_ms": round(h.total / h.count, 3) if h.count else 0.0,
+                     "p50_ms": h.percentile(50), "p95_ms": h.percentile(95),
+                     "p99_ms": h.percentile(99), "max_ms": round(h.max, 3)}
+                    for name, h in self.ops.items()]
+        return sorted(rows, key=lambda r: r["p95_ms"], reverse=True)
+
+    def export(self, path):
+        data = {"since": self.started.isoformat(timespec="seconds"),
+                "exported": datetime.now().isoformat(timespec="seconds"),
+                "bucket_bounds_ms": BUCKETS_MS,
+                "ops": self.snapshot()}
+        with self._lock:
+            data["histograms"] = {name: list(h.buckets) for name, h in self.ops.items()}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        return path
+
+    def reset(self):
+        with self._lock:
+            self.ops.clear()
+            self.started = datetime.now()
+
+METRICS = Metrics()
+instrument = METRICS.instrument
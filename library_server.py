@@ -0,0 +1,422 @@
+# library_server.py
+# Local circulation server: one process owns the store, every desk talks to it.
+#
+#   python library_server.py --data library_data.json --port 8765
+#   python library_management_system.py --server http://127.0.0.1:8765
+#
+# Requests are JSON over HTTP on localhost: POST /call with
+# {"method": "issue", "args": [...], "kwargs": {...}} runs that Library method
+# (whitelisted in METHODS) and answers {"ok": true, "result": ...} or
+# {"ok": false, "type": "Unavailable", "error": "..."}. RemoteLibrary is the
+# matching client; it raises the same LibraryError subclasses as Library.
+# Each request carries an "id"; a change sent again under the same id is run
+# once and the first answer repeated.
+
+import argparse
+import functools
+import http.client
+import inspect
+import json
+import signal
+import sys
+import threading
+import traceback
+import types
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import fields, is_dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from library_core import (DATA_FILE, EXPORT_FIELDS, BatchItem, BatchReport, Book, Conflict, Hold, ImportReport,
+                          Library, LibraryError, Loan, NotFound, Page, SearchResult, StorageError, Unavailable, User,
+                          ValidationError, file_format, read_rows, write_rows)
+
+HOST = "127.0.0.1"
+PORT = 8765
+DEFAULT_URL = f"http://{HOST}:{PORT}"
+CLIENT_TIMEOUT = 30.0  # seconds a RemoteLibrary call waits for an answer
+SWEEP_SECONDS = 60.0  # how often the server releases copies whose hold ran out
+REMEMBER_REQUESTS = 1000  # answers kept for clients that resend a change
+
+class ServerUnavailable(LibraryError):
+    title = "Server"
+
+RESULT_TYPES = {c.__name__: c for c in (Book, User, Loan, Hold, SearchResult, Page, ImportReport, BatchItem,
+                                         BatchReport)}
+ERROR_TYPES = {c.__name__: c for c in (LibraryError, ValidationError, NotFound, Conflict, Unavailable,
+                                       StorageError, ServerUnavailable)}
+
+# How each method may run alongside others:
+#   READ       under the engine lock, so it never sees a half-applied commit
+#   FREE       does its own locking (search ranks and prepare_search builds off the lock)
+#   EXCLUSIVE  alone: touches users or books it cannot name up front
+#   BATCH      holds the user and book locks of every (action, user, book) in ops
+#   {"user": params, "book": params}  holds the per-user / per-book locks named
+#              by those parameters, so desks working on different books and
+#              users do not wait for each other
+READ, FREE, EXCLUSIVE, BATCH = "read", "free", "exclusive", "batch"
+METHODS = {
+    "get_book": READ, "books": READ, "has_user": READ, "users": READ,
+    "page": READ, "active_loans": READ, "overdue": READ, "newly_overdue": READ,
+    "reservations": READ, "expired_holds": READ, "history": READ,
+    "search": FREE, "prepare_search": FREE,
+    "add_book": {"book": ("title",)}, "update_book": {"book": ("title",)}, "remove_book": {"book": ("title",)},
+    "register_user": {"user": ("name",)}, "ensure_user": {"user": ("name",)},
+    "rename_user": {"user": ("old", "new")},
+    "issue": {"user": ("user",), "book": ("book",)},
+    "return_book": {"user": ("user",), "book": ("book",)},
+    "reserve": {"user": ("user",), "book": ("book",)},
+    "cancel_reservation": {"user": ("user",), "book": ("book",)},
+    "circulate": BATCH,
+    "delete_user": EXCLUSIVE, "expire_holds": EXCLUSIVE, "archive_returned": EXCLUSIVE,
+    # rows, not file paths: nothing here opens a file a client names
+    "import_books": EXCLUSIVE, "import_users": EXCLUSIVE, "export_rows": READ,
+}
+
+def encode(obj):
+    """Results to plain JSON values; dataclasses carry their type name."""
+    if is_dataclass(obj):
+        out = {f.name: encode(getattr(obj, f.name)) for f in fields(obj)}
+        out["__type__"] = type(obj).__name__
+        return out
+    if isinstance(obj, (list, tuple)):
+        return [encode(x) for x in obj]
+    if isinstance(obj, dict):
+        return {k: encode(v) for k, v in obj.items()}
+    return obj
+
+def decode(d):
+    # json object_hook: rebuild the result dataclasses
+    t = d.pop("__type__", None)
+    return RESULT_TYPES[t](**d) if t in RESULT_TYPES else d
+
+# ---------- Locking ----------
+class KeyLocks:
+    """Per-user and per-book locks, plus a gate exclusive calls close.
+
+    Keyed calls pass the gate together; an exclusive call waits for them to
+    drain and blocks new ones until it is done (waiting exclusive calls go
+    first, so they are not starved). Locks are taken in sorted order, so two
+    calls naming the same user and book never deadlock, and are dropped from
+    the table once nobody holds or waits for them.
+    """
+    def __init__(self):
+        self._locks = {}  # key -> [lock, holders + waiters]
+        self._table = threading.Lock()
+        self._gate = threading.Condition()
+        self._active = 0
+        self._exclusive = False
+        self._waiting_exclusive = 0
+
+    @contextmanager
+    def holding(self, keys):
+        with self._gate:
+            self._gate.wait_for(lambda: not self._exclusive and not self._waiting_exclusive)
+            self._active += 1
+        taken = []
+        try:
+            for key in sorted(set(keys)):
+                with self._table:
+                    entry = self._locks.setdefault(key, [threading.Lock(), 0])
+                    entry[1] += 1
+                entry[0].acquire()
+                taken.append(key)
+            yield
+        finally:
+            for key in reversed(taken):
+                with self._table:
+                    entry = self._locks[key]
+                    entry[0].release()
+                    entry[1] -= 1
+                    if not entry[1]:
+                        del self._locks[key]
+            with self._gate:
+                self._active -= 1
+                self._gate.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._gate:
+            self._waiting_exclusive += 1
+            self._gate.wait_for(lambda: not self._exclusive and not self._active)
+            self._waiting_exclusive -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._gate:
+                self._exclusive = False
+                self._gate.notify_all()
+
+# ---------- Server ----------
+class CirculationServer:
+    """Runs whitelisted Library calls for many request threads at once.
+
+    Mutations answer only after lib.flush(): the background writer batches
+    whatever all desks committed meanwhile into one fsync, so concurrent
+    checkouts share the cost of durability instead of queueing for it.
+    """
+    def __init__(self, lib):
+        self.lib = lib
+        self.locks = KeyLocks()
+        self._requests = OrderedDict()  # request id -> [done event, result, error], newest last
+        self._requests_lock = threading.Lock()
+
+    def _keys(self, name, spec, args, kwargs):
+        bound = inspect.signature(getattr(Library, name)).bind(None, *args, **kwargs)
+        if spec == BATCH:
+            # a malformed item takes no lock; circulate() rejects it
+            return [key for op in bound.arguments["ops"] if isinstance(op, (list, tuple)) and len(op) == 3
+                    for key in (("user", str(op[1]).strip()), ("book", str(op[2]).strip()))]
+        keys = []
+        for kind, params in spec.items():
+            for p in params:
+                value = bound.arguments.get(p)
+                if value is not None:
+                    keys.append((kind, str(value).strip()))
+        return keys
+
+    def call(self, name, args, kwargs, request_id=None):
+        spec = METHODS.get(name)
+        if spec is None:
+            raise ValidationError(f"Unknown method '{name}'.")
+        if request_id is None or spec in (READ, FREE):
+            return self._run(name, spec, args, kwargs)
+        # a client that lost the connection resends under the same id: answer
+        # it from the first run instead of issuing or returning twice
+        with self._requests_lock:
+            entry = self._requests.get(request_id)
+            first = entry is None
+            if first:
+                entry = self._requests[request_id] = [threading.Event(), None, None]
+                while len(self._requests) > REMEMBER_REQUESTS:
+                    self._requests.popitem(last=False)
+        if first:
+            try:
+                entry[1] = self._run(name, spec, args, kwargs)
+            except Exception as e:
+                entry[2] = e
+            finally:
+                entry[0].set()
+        else:
+            entry[0].wait()
+        if entry[2] is not None:
+            raise entry[2]
+        return entry[1]
+
+    def _run(self, name, spec, args, kwargs):
+        method = getattr(self.lib, name)
+        if spec == FREE:
+            return method(*args, **kwargs)
+        if spec == READ:
+            with self.lib.lock:
+                result = method(*args, **kwargs)
+                # generators (history) are drained while the lock is held
+                return list(result) if isinstance(result, types.GeneratorType) else result
+        if spec == EXCLUSIVE:
+            with self.locks.exclusive():
+                result = method(*args, **kwargs)
+        else:
+            with self.locks.holding(self._keys(name, spec, args, kwargs)):
+                result = method(*args, **kwargs)
+        if not self.lib.flush(CLIENT_TIMEOUT):
+            raise StorageError("The change is applied but could not be saved yet.")
+        return result
+
+    def sweep_holds(self, stop, every=SWEEP_SECONDS):
+        """Run expire_holds() every `every` seconds until stop is set. The
+        exclusive gate is only closed when some hold has actually run out."""
+        while not stop.wait(every):
+            try:
+                if self._run("expired_holds", READ, (), {}):
+                    self._run("expire_holds", EXCLUSIVE, (), {})
+            except LibraryError as e:
+                print(f"{e.title}: {e} (will retry)", file=sys.stderr)
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive: one connection per client thread
+    disable_nagle_algorithm = True  # headers and body go out separately; don't hold the body for an ACK
+
+    def do_POST(self):
+        if self.path != "/call":
+            self._reply(404, {"ok": False, "type": "NotFound", "error": "Unknown path."})
+            return
+        try:
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            name, args, kwargs = req["method"], req.get("args", []), req.get("kwargs", {})
+            result = self.server.app.call(name, args, kwargs, req.get("id"))
+        except LibraryError as e:
+            self._reply(200, {"ok": False, "type": type(e).__name__, "error": str(e)})
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply(400, {"ok": False, "type": "ValidationError", "error": f"Bad request: {e}"})
+        except Exception as e:
+            # answer instead of dropping the connection, which the client would take for a lost request
+            self.log_error("Server error: %r", e)
+            traceback.print_exc()
+            self._reply(500, {"ok": False, "type": "LibraryError", "error": f"Server error: {e}"})
+        else:
+            self._reply(200, {"ok": True, "result": encode(result)})
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, {"ok": True, "result": "ok"})
+        else:
+            self._reply(404, {"ok": False, "type": "NotFound", "error": "Unknown path."})
+
+    def _reply(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def log_error(self, fmt, *args):
+        super().log_message(fmt, *args)  # always, verbose or not
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # the default of 5 resets desks that connect at the same moment
+
+def make_server(lib, host=HOST, port=PORT, verbose=False):
+    """HTTP server for lib; port 0 picks a free one (see server_address)."""
+    httpd = Server((host, port), Handler)
+    httpd.app = CirculationServer(lib)
+    httpd.verbose = verbose
+    return httpd
+
+# ---------- Client ----------
+class RemoteLibrary:
+    """Stand-in for Library that forwards each call to a library_server.
+
+    Every thread gets its own kept-alive connection. Results come back as the
+    same Book / Loan / ... dataclasses and failures as the same LibraryError
+    subclasses, so the UI works unchanged against either.
+    """
+    def __init__(self, url=DEFAULT_URL, timeout=CLIENT_TIMEOUT):
+        parts = urlsplit(url)
+        self.url = url
+        self.host, self.port = parts.hostname or HOST, parts.port or PORT
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def call(self, method, *args, **kwargs):
+        req = {"id": uuid.uuid4().hex, "method": method, "args": args, "kwargs": kwargs}
+        body = json.dumps(req, ensure_ascii=False).encode("utf-8")
+        for attempt in range(2):
+            conn = self._connection()
+            reused = conn.sock is not None
+            try:
+                conn.request("POST", "/call", body, {"Content-Type": "application/json"})
+                data = conn.getresponse().read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                # most likely the server dropped an idle kept-alive connection before
+                # reading the request; if it did run it, the resent id gets the
+                # first answer back rather than a second run
+                self.close()
+                if not reused or attempt:
+                    raise ServerUnavailable(f"Library server at {self.url} is not answering: {e}") from e
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                raise ServerUnavailable(f"Library server at {self.url} is not answering: {e}") from e
+        reply = json.loads(data, object_hook=decode)
+        if not reply["ok"]:
+            raise ERROR_TYPES.get(reply.get("type"), LibraryError)(reply["error"])
+        return reply["result"]
+
+    def __getattr__(self, name):
+        if name not in METHODS:
+            raise AttributeError(name)
+        return functools.partial(self.call, name)
+
+    def import_file(self, kind, path):
+        """Library.import_file with the file read here; the server gets the rows."""
+        method = {"books": "import_books", "users": "import_users"}.get(kind)
+        if method is None:
+            raise ValidationError(f"Unknown import '{kind}' (books or users).")
+        fmt = file_format(path)
+        try:
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                rows = list(read_rows(f, fmt))
+        except OSError as e:
+            raise NotFound(f"Could not read {path}: {e}") from e
+        return self.call(method, rows)
+
+    def export_file(self, kind, path):
+        """Library.export_file with the file written here, from the server's rows."""
+        if kind not in EXPORT_FIELDS:
+            raise ValidationError(f"Unknown export '{kind}' (books, users or loans).")
+        fmt = file_format(path)
+        rows = self.call("export_rows", kind)
+        try:
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                return write_rows(rows, f, fmt, EXPORT_FIELDS[kind])
+        except OSError as e:
+            raise StorageError(f"Could not write {path}: {e}") from e
+
+    def load(self):
+        pass  # the server owns the store
+
+    def flush(self, timeout=None):
+        return True  # mutations answer once they are on disk
+
+    def close(self, timeout=None):
+        """Close this thread's connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Serve one Library store to many desks on this machine")
+    p.add_argument("--data", default=DATA_FILE, help="data file (default: %(default)s)")
+    p.add_argument("--host", default=HOST, help="interface to bind (default: %(default)s)")
+    p.add_argument("--port", type=int, default=PORT, help="0 picks a free port (default: %(default)s)")
+    p.add_argument("--verbose", action="store_true", help="log every request")
+    args = p.parse_args(argv)
+
+    errors = lambda e: print(f"{e.title}: {e} (will retry)", file=sys.stderr)
+    lib = Library(args.data, background=True, on_error=errors)
+    try:
+        lib.load()
+        httpd = make_server(lib, args.host, args.port, args.verbose)
+    except (LibraryError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    # SIGTERM stops the server the same way Ctrl+C does
+    signal.signal(signal.SIGTERM, lambda *a: sys.exit(0))
+    host, port = httpd.server_address[:2]
+    print(f"serving {args.data} on http://{host}:{port}", flush=True)
+    stop = threading.Event()
+    sweeper = threading.Thread(target=httpd.app.sweep_holds, args=(stop,), name="hold-sweep", daemon=True)
+    sweeper.start()
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        sweeper.join(CLIENT_TIMEOUT)  # not mid-sweep while the store closes
+        httpd.server_close()
+        try:
+            lib.close()
+        except LibraryError as e:
+            print(f"{e.title}: {e}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
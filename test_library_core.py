@@ -0,0 +1,541 @@
+# test_library_core.py
+# Checks for the storage and circulation engine. Stdlib only:
+#
+#   python -m unittest test_library_core
+#   python -m pytest test_library_core.py
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+from library_cli import run_batch
+from library_core import (FINE_PER_DAY, HOLD_DAYS, HistoryArchive, ImportReport, Library, LibraryError, Unavailable,
+                          User, ValidationError, read_rows)
+
+class TempDirTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="library-test-")
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        self.libs = []
+        self.addCleanup(self._close_all)
+
+    def _close_all(self):
+        for lib in self.libs:
+            try:
+                lib.close()
+            except LibraryError:
+                pass
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def open(self, name, **kw):
+        lib = Library(self.path(name), **kw)
+        self.libs.append(lib)
+        return lib
+
+    def reopen(self, lib, crash=False, **kw):
+        """A fresh Library on lib's file; crash=True drops lib without closing
+        it, as if the process had died."""
+        if not crash:
+            lib.close()
+        self.libs.remove(lib)
+        return self.open(os.path.basename(getattr(lib.storage, "data_file", None) or lib.storage.db_file), **kw)
+
+def state(lib):
+    """Everything a user can see, as plain values."""
+    users = sorted(u.name for u in lib.users())
+    return {
+        "books": sorted((b.title, b.author, b.qty, b.reserved) for b in lib.books()),
+        "users": sorted((u.name, u.loans, u.active) for u in lib.users()),
+        "open": [(l.id, l.user, l.book) for l in lib.active_loans()],
+        "history": {u: [(l.id, l.book, l.returned) for l in lib.history(user=u)] for u in users},
+        "holds": sorted((h.id, h.user, h.book, h.expires is not None) for u in users for h in lib.reservations(user=u)),
+    }
+
+def circulation(lib):
+    """A fixed run of catalog, user, loan and hold changes."""
+    for title, qty in (("Dune", 1), ("Emma", 2), ("Ulysses", 0)):
+        lib.add_book(title, "Author " + title, qty)
+    for name in ("ann", "bob", "cy"):
+        lib.register_user(name)
+    lib.issue("ann", "Dune")
+    lib.reserve("bob", "Dune")
+    lib.reserve("cy", "Dune")
+    lib.issue("bob", "Emma")
+    lib.return_book("ann", "Dune")  # set aside for bob
+    lib.issue("bob", "Dune")
+    lib.rename_user("cy", "cyd")
+    lib.update_book("Ulysses", qty=1)
+    lib.circulate([("issue", "ann", "Ulysses"), ("return", "bob", "Emma")])
+    lib.remove_book("Emma")
+
+class JournalReplayTest(TempDirTest):
+    def test_torn_tail_is_dropped_and_truncated(self):
+        lib = self.open("lib.json")
+        lib.add_book("Dune", "Herbert", 2)
+        lib.register_user("ann")
+        journal = lib.storage.journal_file
+        good = os.path.getsize(journal)
+        with open(journal, "ab") as f:
+            f.write(b'{"op":"user_add","name":"bob","se')  # crash mid-append
+        lib = self.reopen(lib, crash=True)
+        self.assertEqual([u.name for u in lib.users()], ["ann"])
+        self.assertEqual(os.path.getsize(journal), good)
+        lib.register_user("cy")  # follows the last whole record
+        lib = self.reopen(lib)
+        self.assertEqual([u.name for u in lib.users()], ["ann", "cy"])
+
+    def test_records_in_the_snapshot_are_not_replayed(self):
+        lib = self.open("lib.json")
+        lib.add_book("Dune", "Herbert", 2)
+        lib.register_user("ann")
+        lib.issue("ann", "Dune")
+        journal = lib.storage.journal_file
+        with open(journal, "rb") as f:
+            records = f.read()
+        lib.compact()
+        with open(lib.storage.data_file, encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["journal_seq"], 3)
+        # a crash between writing the snapshot and truncating the journal
+        with open(journal, "wb") as f:
+            f.write(records)
+        lib = self.reopen(lib, crash=True)
+        self.assertEqual(lib.get_book("Dune").qty, 1)
+        self.assertEqual(len(lib.active_loans()), 1)
+
+    def test_compact_waits_for_the_background_writer(self):
+        lib = self.open("lib.json", background=True)
+        lib.add_book("Dune", "Herbert", 5)
+        lib.register_user("ann")
+        self.assertTrue(lib.flush(10))
+        append_many = lib.storage.append_many
+
+        def slow(recs):
+            time.sleep(0.2)
+            return append_many(recs)
+        lib.storage.append_many = slow
+        lib.issue("ann", "Dune")
+        lib.compact()  # the issue is still queued when this starts
+        self.assertTrue(lib.flush(10))
+        lib = self.reopen(lib, crash=True)
+        self.assertEqual(lib.get_book("Dune").qty, 4)
+        self.assertEqual(len(lib.active_loans()), 1)
+
+    def test_corrupt_snapshot_is_moved_aside(self):
+        for name in ("lib.json", "lib.snap"):
+            with self.subTest(name):
+                path = self.path(name)
+                with open(path, "wb") as f:
+                    f.write(b"\x00not a snapshot")
+                lib = self.open(name)
+                self.assertEqual(lib.books(), [])
+                with open(path + ".corrupt", "rb") as f:
+                    self.assertEqual(f.read(), b"\x00not a snapshot")
+                lib.add_book("Dune", "Herbert", 1)
+                lib.compact()
+                lib = self.reopen(lib)
+                self.assertEqual([b.title for b in lib.books()], ["Dune"])
+
+class BackendTest(TempDirTest):
+    def test_backends_agree_after_reload(self):
+        states = {}
+        for name, background in (("lib.json", False), ("lib.snap", False), ("lib.db", False),
+                                 ("bg.json", True), ("bg.snap", True), ("bg.db", True)):
+            with self.subTest(name):
+                lib = self.open(name, background=background)
+                circulation(lib)
+                self.assertTrue(lib.flush(10))
+                before = state(lib)
+                lib.compact()
+                lib = self.reopen(lib)
+                self.assertEqual(state(lib), before)
+                states[name] = before
+        expected = states.pop("lib.json")
+        for name, got in states.items():
+            self.assertEqual(got, expected, name)
+
+class SearchTest(TempDirTest):
+    BOOKS = (("Sand Dunes", "Ames"), ("Children of Dune", "Herbert"), ("Arrakis", "Dune Fan"),
+             ("Dune Messiah", "Herbert"), ("Dune", "Herbert"), ("Fondue", "Ames"), ("C# in Depth", "Skeet"))
+
+    def libraries(self):
+        # the in-memory index, and SQLite's full-text tables
+        for name in ("lib.json", "lib.db"):
+            with self.subTest(name):
+                lib = self.open(name)
+                for title, author in self.BOOKS:
+                    lib.add_book(title, author, 1)
+                yield lib
+
+    def titles(self, lib, q, **kw):
+        return [b.title for b in lib.search(q, **kw).books]
+
+    def test_ranking_and_limit(self):
+        for lib in self.libraries():
+            # exact title, title prefix, whole word, inside a word, author only
+            ranked = ["Dune", "Dune Messiah", "Children of Dune", "Sand Dunes", "Arrakis"]
+            self.assertEqual(self.titles(lib, " DUNE "), ranked)
+            res = lib.search("dune", limit=2)
+            self.assertEqual(([b.title for b in res.books], res.total), (ranked[:2], 5))
+
+    def test_short_queries_match_the_start_of_a_word(self):
+        for lib in self.libraries():
+            self.assertEqual(sorted(self.titles(lib, "du")),
+                             ["Arrakis", "Children of Dune", "Dune", "Dune Messiah", "Sand Dunes"])
+            self.assertEqual(self.titles(lib, "c#"), ["C# in Depth"])
+            self.assertEqual(self.titles(lib, "!"), [])
+            with self.assertRaises(LibraryError):
+                lib.search("  ")
+
+    def test_index_follows_catalog_changes(self):
+        for lib in self.libraries():
+            lib.update_book("Fondue", author="Brillat")
+            self.assertEqual(self.titles(lib, "brill"), ["Fondue"])
+            self.assertEqual(self.titles(lib, "ames"), ["Sand Dunes"])
+            lib.remove_book("Dune")
+            lib.add_book("Dune Road", "Ames", 1)
+            self.assertEqual(self.titles(lib, "dune r"), ["Dune Road"])
+            self.assertNotIn("Dune", self.titles(lib, "dune"))
+            lib = self.reopen(lib)
+            self.assertEqual(self.titles(lib, "am"), ["Dune Road", "Sand Dunes"])
+
+class UserTest(TempDirTest):
+    def test_list_of_names_becomes_users_with_loan_counts(self):
+        with open(self.path("lib.json"), "w", encoding="utf-8") as f:
+            json.dump({"books": {"Dune": {"author": "Herbert", "qty": 0, "reserved": ["bob"]}},
+                       "users": ["ann", "bob"],
+                       "issued": [{"user": "ann", "book": "Dune", "issued_on": "2024-01-01T00:00:00",
+                                   "due_date": "2024-01-15T00:00:00", "returned": True},
+                                  {"user": "ann", "book": "Dune", "issued_on": "2024-02-01T00:00:00",
+                                   "due_date": "2024-02-15T00:00:00"}]}, f)
+        lib = self.open("lib.json")
+        self.assertEqual([(u.name, u.loans, u.active) for u in lib.users()], [("ann", 2, 1), ("bob", 0, 0)])
+        self.assertEqual([h.user for h in lib.reservations(book="Dune")], ["bob"])
+        lib.add_book("Emma", "Austen", 1)
+        lib.issue("bob", "Emma")
+        self.assertEqual([l.id for l in lib.history(user="ann")], [1, 2])
+        lib = self.reopen(lib)
+        self.assertEqual([(u.name, u.loans, u.active) for u in lib.users()], [("ann", 2, 1), ("bob", 1, 1)])
+        self.assertEqual(lib.active_loans()[-1].id, 3)
+
+    def test_history_follows_renames(self):
+        for name in ("lib.json", "lib.snap", "lib.db"):
+            with self.subTest(name):
+                lib = self.open(name)
+                lib.add_book("Dune", "Herbert", 1)
+                lib.add_book("Emma", "Austen", 1)
+                lib.register_user("ann")
+                lib.issue("ann", "Dune")
+                lib.return_book("ann", "Dune")
+                lib.issue("ann", "Emma")
+                lib.rename_user("ann", "anna")
+                lib.register_user("ann")  # someone else, under the old name
+                lib.issue("ann", "Dune")
+                for reload in (False, True):
+                    if reload:
+                        lib = self.reopen(lib)
+                    self.assertEqual([(l.book, l.returned) for l in lib.history(user="anna")],
+                                     [("Dune", True), ("Emma", False)])
+                    self.assertEqual([l.book for l in lib.history(user="ann")], ["Dune"])
+                    self.assertEqual([(u.name, u.loans, u.active) for u in lib.users()],
+                                     [("anna", 2, 1), ("ann", 1, 1)])
+                lib.return_book("anna", "Emma")
+                self.assertEqual([l.book for l in lib.history(user="anna")], ["Dune", "Emma"])
+
+class ImportExportTest(TempDirTest):
+    def test_books_merge_and_bad_rows_are_reported(self):
+        lib = self.open("lib.json")
+        lib.add_book("Dune", "Herbert", 1)
+        rows = read_rows(io.StringIO("title,author,qty\nDune,,2\nEmma,Austen,1\n,Nobody,1\nUlysses,Joyce,many\n"
+                                     "Emma,,3\nHamlet,,\n"), "csv")
+        report = lib.import_books(rows, batch_size=2)
+        self.assertEqual(report, ImportReport(added=2, merged=2, failed=2,
+                                              errors=[(3, "Title required."), (4, "Quantity needs a number.")]))
+        self.assertEqual([(b.title, b.author, b.qty) for b in lib.books()],
+                         [("Dune", "Herbert", 3), ("Emma", "Austen", 4), ("Hamlet", "Unknown", 0)])
+
+    def test_users_already_registered_are_skipped(self):
+        lib = self.open("lib.json")
+        lib.register_user("ann")
+        rows = read_rows(io.StringIO('{"name": "bob", "registered_on": "2024-01-01T00:00:00"}\n'
+                                     '{"name": "ann"}\nnot json\n\n{"name": "bob"}\n["cy"]\n'), "jsonl")
+        report = lib.import_users(rows)
+        self.assertEqual((report.added, report.skipped, report.failed), (1, 2, 2))
+        self.assertEqual([n for n, _ in report.errors], [3, 5])
+        self.assertEqual(lib.users()[1], User("bob", "2024-01-01T00:00:00", 0, 0))
+
+    def test_export_reads_back_in_either_format(self):
+        lib = self.open("lib.db")
+        for title, qty in (("Dune", 2), ("Emma, the novel", 1)):
+            lib.add_book(title, "Author", qty)
+        lib.register_user("ann")
+        lib.issue("ann", "Dune")
+        lib.return_book("ann", "Dune")
+        lib.issue("ann", "Emma, the novel")
+        for fmt in ("csv", "jsonl"):
+            with self.subTest(fmt):
+                f = io.StringIO()
+                self.assertEqual(lib.export("books", f, fmt), 2)
+                f.seek(0)
+                copy = self.open(f"copy-{fmt}.json")
+                self.assertEqual(copy.import_books(read_rows(f, fmt)).added, 2)
+                self.assertEqual(copy.books(), lib.books())
+                f = io.StringIO()
+                self.assertEqual(lib.export("loans", f, fmt), 2)
+                f.seek(0)
+                loans = list(read_rows(f, fmt))
+                self.assertEqual([(r["id"], r["book"]) for r in loans], [("1", "Dune"), ("2", "Emma, the novel")]
+                                 if fmt == "csv" else [(1, "Dune"), (2, "Emma, the novel")])
+        with self.assertRaises(ValidationError):
+            lib.export("holds", io.StringIO(), "csv")
+
+class PageTest(TempDirTest):
+    def libraries(self):
+        for name in ("lib.json", "lib.db"):
+            with self.subTest(name):
+                lib = self.open(name)
+                for i, title in enumerate(("Emma", "dune", "Ulysses", "Dune Messiah", "Beloved")):
+                    lib.add_book(title, "Author", i)
+                for name in ("ann", "bob", "joanna"):
+                    lib.register_user(name)
+                yield lib
+
+    def rows(self, lib, kind, **kw):
+        page = lib.page(kind, **kw)
+        key = {"books": "title", "users": "name"}.get(kind, "id")
+        return [getattr(r, key) for r in page.rows], page.total
+
+    def test_storage_order_and_offset(self):
+        for lib in self.libraries():
+            self.assertEqual(self.rows(lib, "books", offset=1, limit=2), (["dune", "Ulysses"], 5))
+            self.assertEqual(self.rows(lib, "books", offset=1, limit=2, descending=True), (["Dune Messiah", "Ulysses"], 5))
+            self.assertEqual(self.rows(lib, "books", offset=4, limit=10), (["Beloved"], 5))
+            self.assertEqual(self.rows(lib, "books", offset=9), ([], 5))
+            lib.remove_book("dune")
+            self.assertEqual(self.rows(lib, "books", offset=1, limit=2), (["Ulysses", "Dune Messiah"], 4))
+
+    def test_sorted_and_filtered(self):
+        for lib in self.libraries():
+            self.assertEqual(self.rows(lib, "books", sort="title", limit=3), (["Beloved", "dune", "Dune Messiah"], 5))
+            self.assertEqual(self.rows(lib, "books", sort="qty", descending=True, offset=1, limit=2),
+                             (["Dune Messiah", "Ulysses"], 5))
+            self.assertEqual(self.rows(lib, "books", filter=" DUNE"), (["dune", "Dune Messiah"], 2))
+            self.assertEqual(self.rows(lib, "users", filter="ann", sort="name", descending=True), (["joanna", "ann"], 2))
+            lib.add_book("Dune Road", "Author", 1)  # cached orders are dropped on commit
+            self.assertEqual(self.rows(lib, "books", sort="title", filter="dune")[1], 3)
+            with self.assertRaises(ValidationError):
+                lib.page("books", sort="colour")
+
+    def test_loans_view_holds_open_loans(self):
+        for lib in self.libraries():
+            lib.issue("ann", "dune")
+            lib.issue("bob", "Ulysses")
+            lib.issue("ann", "Ulysses")
+            lib.return_book("bob", "Ulysses")
+            self.assertEqual(self.rows(lib, "loans"), ([1, 3], 2))
+            self.assertEqual(self.rows(lib, "loans", filter="ulys"), ([3], 1))
+            self.assertEqual(self.rows(lib, "loans", sort="book", descending=True), ([3, 1], 2))
+
+class OverdueTest(TempDirTest):
+    def setUp(self):
+        super().setUp()
+        self.lib = self.open("lib.json")
+        for title in ("Dune", "Emma", "Ulysses"):
+            self.lib.add_book(title, "Author", 1)
+        for name in ("ann", "bob", "cy"):
+            self.lib.register_user(name)
+        self.lib.issue("bob", "Emma", days=-1)
+        self.lib.issue("ann", "Dune", days=-3)
+        self.lib.issue("cy", "Ulysses", days=7)
+
+    def test_most_overdue_first_with_fines(self):
+        lib = self.lib
+        self.assertEqual([(l.user, l.fine) for l in lib.overdue()], [("ann", 3 * FINE_PER_DAY), ("bob", FINE_PER_DAY)])
+        later = (datetime.now() + timedelta(days=8)).isoformat()
+        self.assertEqual([(l.user, l.fine) for l in lib.overdue(later)],
+                         [("ann", 11 * FINE_PER_DAY), ("bob", 9 * FINE_PER_DAY), ("cy", FINE_PER_DAY)])
+        page = lib.page("overdue", limit=1, descending=True)
+        self.assertEqual(([l.user for l in page.rows], page.total), (["bob"], 2))
+        self.assertEqual([l.user for l in lib.page("overdue", filter="dune").rows], ["ann"])
+        # the fine stops at the return
+        self.assertEqual(lib.return_book("ann", "Dune").fine, 3 * FINE_PER_DAY)
+        self.assertEqual([l.user for l in lib.overdue()], ["bob"])
+
+    def test_newly_overdue_reports_each_loan_once(self):
+        lib = self.lib
+        loans, seen = lib.newly_overdue(None)
+        self.assertEqual([l.user for l in loans], ["ann", "bob"])
+        self.assertEqual(lib.newly_overdue(seen)[0], [])
+        later = (datetime.now() + timedelta(days=8)).isoformat()
+        loans, seen = lib.newly_overdue(seen, later)
+        self.assertEqual(([l.user for l in loans], seen), (["cy"], later))
+        self.assertEqual(lib.newly_overdue(seen, later)[0], [])
+
+class ArchiveTest(TempDirTest):
+    def test_archived_loans_stay_in_history_across_renames(self):
+        tomorrow = datetime.now() + timedelta(days=1)
+        for name in ("json.json", "snap.snap", "db.db"):  # each with its own <stem>_archive
+            with self.subTest(name):
+                lib = self.open(name)
+                lib.add_book("Dune", "Herbert", 1)
+                lib.add_book("Emma", "Austen", 1)
+                lib.register_user("ann")
+                lib.issue("ann", "Dune")
+                lib.return_book("ann", "Dune")
+                lib.issue("ann", "Emma")
+                lib.rename_user("ann", "anna")
+                lib.register_user("ann")
+                lib.issue("ann", "Dune")
+                lib.return_book("ann", "Dune")
+                self.assertEqual(lib.archive_returned(0, now=tomorrow), 2)
+                self.assertEqual(lib.archive_returned(0, now=tomorrow), 0)
+                lib = self.reopen(lib)
+                self.assertEqual([(l.id, l.returned) for l in lib.history(user="anna")], [(1, True), (2, False)])
+                self.assertEqual([l.id for l in lib.history(user="ann")], [3])
+                self.assertEqual([l.id for l in lib.history(book="Dune")], [1, 3])
+                self.assertEqual([row["id"] for row in lib.export_rows("loans")], [1, 3, 2])
+
+    def test_appends_add_members_and_skip_archived_ids(self):
+        archive = HistoryArchive(self.path("archive"))
+        tx = lambda i, month: {"id": i, "user": "ann", "book": "Dune", "issued_on": f"2024-{month}-01T00:00:00",
+                               "due_date": f"2024-{month}-15T00:00:00", "returned": True}
+        self.assertEqual(archive.append([tx(1, "01"), tx(2, "02")]), 2)
+        self.assertEqual(archive.append([tx(2, "02"), tx(3, "02")]), 1)
+        self.assertEqual([t["id"] for t in archive.read()], [1, 2, 3])
+        segment = archive.segments()[-1]
+        whole = os.path.getsize(segment)
+        # a crash mid-member, and another mid-sidecar line
+        with open(segment, "ab") as f:
+            f.write(b"\x1f\x8b\x08\x00torn")
+        self.assertEqual([t["id"] for t in archive.read()], [1, 2, 3])
+        with open(segment[:-len(".jsonl.gz")] + ".ids", "ab") as f:
+            f.write(b"999 4")
+        self.assertEqual(archive.append([tx(3, "02"), tx(4, "02")]), 1)
+        self.assertGreater(os.path.getsize(segment), whole)
+        self.assertEqual([t["id"] for t in archive.read()], [1, 2, 3, 4])
+        copy = HistoryArchive(self.path("copy"))
+        self.assertEqual(archive.copy_into(copy), 4)
+        self.assertEqual([t["id"] for t in copy.read("ann")], [1, 2, 3, 4])
+
+class HoldTest(TempDirTest):
+    def setUp(self):
+        super().setUp()
+        self.lib = self.open("lib.json")
+        self.lib.add_book("Dune", "Herbert", 1)
+        for name in ("ann", "bob", "cy", "dee"):
+            self.lib.register_user(name)
+
+    def test_returned_copy_goes_to_the_head_of_the_queue(self):
+        lib = self.lib
+        lib.issue("ann", "Dune")
+        lib.reserve("bob", "Dune")
+        lib.reserve("cy", "Dune")
+        loan = lib.return_book("ann", "Dune")
+        self.assertEqual(loan.held_for.user, "bob")
+        self.assertEqual(lib.get_book("Dune").qty, 0)
+        with self.assertRaises(Unavailable):
+            lib.issue("dee", "Dune")
+        with self.assertRaises(Unavailable):
+            lib.issue("cy", "Dune")
+        lib.issue("bob", "Dune")
+        self.assertEqual([h.user for h in lib.reservations(book="Dune")], ["cy"])
+
+    def test_restocked_copies_are_set_aside(self):
+        lib = self.lib
+        lib.issue("ann", "Dune")
+        lib.reserve("bob", "Dune")
+        lib.add_book("Dune", qty=1)
+        self.assertIsNotNone(lib.reservations(book="Dune")[0].expires)
+        with self.assertRaises(Unavailable):
+            lib.issue("dee", "Dune")
+
+    def test_expired_hold_passes_the_copy_on(self):
+        lib = self.lib
+        lib.issue("ann", "Dune")
+        lib.reserve("bob", "Dune")
+        lib.reserve("cy", "Dune")
+        lib.return_book("ann", "Dune")
+        later = datetime.now() + timedelta(days=HOLD_DAYS, hours=1)
+        self.assertEqual(lib.expire_holds(later), 1)
+        holds = lib.reservations(book="Dune")
+        self.assertEqual([(h.user, h.expires is not None) for h in holds], [("cy", True)])
+        self.assertEqual(lib.expire_holds(later + timedelta(days=HOLD_DAYS, hours=1)), 1)
+        self.assertEqual(lib.reservations(book="Dune"), [])
+        self.assertEqual(lib.get_book("Dune").qty, 1)  # nobody waiting: back on the shelf
+
+    def test_only_run_out_holds_are_swept(self):
+        lib = self.lib
+        lib.add_book("Emma", "Austen", 1)
+        lib.reserve("ann", "Dune")  # set aside straight away
+        lib.reserve("bob", "Dune")
+        lib.reserve("cy", "Emma")
+        self.assertEqual(lib.expired_holds(), [])
+        self.assertEqual(lib.expire_holds(), 0)
+        lib = self.reopen(self.lib)  # the expiry index is rebuilt on load
+        lib.cancel_reservation("cy", "Emma")
+        later = datetime.now() + timedelta(days=HOLD_DAYS, hours=1)
+        self.assertEqual([(h.user, h.book) for h in lib.expired_holds(later)], [("ann", "Dune")])
+        self.assertEqual(lib.expire_holds(later), 1)
+        self.assertEqual([h.user for h in lib.expired_holds(later)], [])
+        self.assertEqual([(h.user, h.expires is not None) for h in lib.reservations(book="Dune")], [("bob", True)])
+        self.assertEqual(lib.get_book("Emma").qty, 1)
+
+class CirculateTest(TempDirTest):
+    def setUp(self):
+        super().setUp()
+        self.lib = self.open("lib.json")
+        self.lib.add_book("Dune", "Herbert", 1)
+        self.lib.add_book("Emma", "Austen", 1)
+        self.lib.register_user("ann")
+
+    def test_a_failing_item_applies_nothing(self):
+        lib = self.lib
+        before, size = state(lib), os.path.getsize(lib.storage.journal_file)
+        report = lib.circulate([("issue", "ann", "Dune"), ("issue", "ann", "Dune"), ("issue", "ann", "Emma")])
+        self.assertFalse(report.applied)
+        self.assertEqual([item.ok for item in report.items], [True, False, True])
+        self.assertEqual(state(lib), before)
+        self.assertEqual(os.path.getsize(lib.storage.journal_file), size)
+
+    def test_batch_is_one_record_replayed_whole_or_not_at_all(self):
+        lib = self.lib
+        journal = lib.storage.journal_file
+        size = os.path.getsize(journal)
+        report = lib.circulate([("issue", "ann", "Dune"), ("issue", "ann", "Emma"), ("return", "ann", "Dune")])
+        self.assertTrue(report.applied)
+        with open(journal, "rb") as f:
+            f.seek(size)
+            batch = f.read()
+        self.assertEqual(batch.count(b"\n"), 1)
+        # torn anywhere, the batch is dropped as a whole
+        with open(journal, "r+b") as f:
+            f.truncate(size + len(batch) // 2)
+        lib = self.reopen(lib, crash=True)
+        self.assertEqual(lib.active_loans(), [])
+        self.assertEqual((lib.get_book("Dune").qty, lib.get_book("Emma").qty), (1, 1))
+
+class BatchFileTest(TempDirTest):
+    def test_a_bad_argument_fails_its_line_only(self):
+        lib = self.open("lib.json")
+        lines = ['{"action": "add_book", "title": "Dune", "qty": 1}',
+                 '{"action": "register", "name": 5}',
+                 '{"action": "register", "name": "ann"}',
+                 '{"action": "issue", "user": "ann", "book": ["Dune"]}',
+                 '{"action": "issue", "user": "ann", "book": "Dune"}']
+        out = io.StringIO()
+        with redirect_stdout(out):
+            self.assertEqual(run_batch(lib, lines), 1)
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([r["ok"] for r in results], [True, False, True, False, True])
+        self.assertEqual(results[1]["error"], "Name must be text.")
+        self.assertEqual([l.user for l in lib.active_loans()], ["ann"])
+
+if __name__ == "__main__":
+    unittest.main()
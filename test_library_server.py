@@ -0,0 +1,102 @@
+# test_library_server.py
+# Checks for the circulation server and its client. Stdlib only:
+#
+#   python -m unittest test_library_server
+#   python -m pytest test_library_server.py
+
+import os
+import threading
+import unittest
+
+from library_core import Loan, Unavailable, ValidationError
+from library_server import METHODS, CirculationServer, KeyLocks, RemoteLibrary, make_server
+from test_library_core import TempDirTest
+
+class KeyLocksTest(unittest.TestCase):
+    def hold(self, locks, keys=None):
+        """Take keys (or the exclusive gate) on a thread; returns (taken, release) events."""
+        taken, release = threading.Event(), threading.Event()
+
+        def run():
+            with (locks.exclusive() if keys is None else locks.holding(keys)):
+                taken.set()
+                release.wait(5)
+        t = threading.Thread(target=run, daemon=True)
+        t.start()
+        self.addCleanup(t.join, 5)
+        self.addCleanup(release.set)
+        return taken, release
+
+    def test_other_keys_go_ahead_and_the_same_key_waits(self):
+        locks = KeyLocks()
+        dune, release_dune = self.hold(locks, [("book", "Dune"), ("user", "ann")])
+        self.assertTrue(dune.wait(5))
+        emma, _ = self.hold(locks, [("book", "Emma"), ("user", "bob")])
+        self.assertTrue(emma.wait(5))
+        again, _ = self.hold(locks, [("user", "cy"), ("book", "Dune")])
+        self.assertFalse(again.wait(0.2))
+        release_dune.set()
+        self.assertTrue(again.wait(5))
+
+    def test_exclusive_waits_for_holders_and_goes_before_new_ones(self):
+        locks = KeyLocks()
+        dune, release_dune = self.hold(locks, [("book", "Dune")])
+        self.assertTrue(dune.wait(5))
+        exclusive, release_exclusive = self.hold(locks)
+        self.assertFalse(exclusive.wait(0.2))
+        emma, _ = self.hold(locks, [("book", "Emma")])  # arrives while the exclusive call waits
+        release_dune.set()
+        self.assertTrue(exclusive.wait(5))
+        self.assertFalse(emma.wait(0.2))
+        release_exclusive.set()
+        self.assertTrue(emma.wait(5))
+
+class CirculationServerTest(TempDirTest):
+    def setUp(self):
+        super().setUp()
+        self.lib = self.open("lib.json", background=True)
+        self.lib.add_book("Dune", "Herbert", 1)
+        self.lib.register_user("ann")
+        self.lib.register_user("bob")
+        self.app = CirculationServer(self.lib)
+
+    def test_a_resent_change_runs_once(self):
+        app = self.app
+        first = app.call("issue", ["ann", "Dune"], {}, request_id="r1")
+        self.assertEqual(app.call("issue", ["ann", "Dune"], {}, request_id="r1"), first)
+        self.assertEqual([l.id for l in self.lib.active_loans()], [first.id])
+        # a failure is repeated too, not retried
+        with self.assertRaises(Unavailable):
+            app.call("issue", ["bob", "Dune"], {}, request_id="r2")
+        app.call("return_book", ["ann", "Dune"], {}, request_id="r3")
+        with self.assertRaises(Unavailable):
+            app.call("issue", ["bob", "Dune"], {}, request_id="r2")
+        self.assertEqual(app.call("issue", ["bob", "Dune"], {}, request_id="r4").user, "bob")
+
+    def test_only_whitelisted_methods_run(self):
+        self.assertNotIn("import_file", METHODS)
+        self.assertNotIn("export_file", METHODS)
+        for name in ("import_file", "export_file", "compact", "close"):
+            with self.assertRaises(ValidationError):
+                self.app.call(name, ["books", self.path("x.csv")], {})
+
+    def test_desk_files_stay_on_the_desk(self):
+        httpd = make_server(self.lib, port=0)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        desk = RemoteLibrary("http://127.0.0.1:%d" % httpd.server_address[1])
+        self.addCleanup(desk.close)
+        with open(self.path("new.csv"), "w", encoding="utf-8", newline="") as f:
+            f.write("title,author,qty\nEmma,Austen,2\nDune,,1\n")
+        report = desk.import_file("books", self.path("new.csv"))
+        self.assertEqual((report.added, report.merged), (1, 1))
+        self.assertIsInstance(desk.issue("ann", "Emma"), Loan)
+        self.assertEqual(desk.export_file("books", self.path("out.jsonl")), 2)
+        with open(self.path("out.jsonl"), encoding="utf-8") as f:
+            self.assertEqual(f.read().splitlines(), ['{"title": "Dune", "author": "Herbert", "qty": 2}',
+                                                      '{"title": "Emma", "author": "Austen", "qty": 1}'])
+        self.assertFalse(os.path.exists(self.path("x.csv")))
+
+if __name__ == "__main__":
+    unittest.main()